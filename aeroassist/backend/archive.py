@@ -0,0 +1,52 @@
+"""Archive idle chat sessions and maintain the monthly message partitions.
+
+Moves the messages of sessions idle for ARCHIVE_AFTER_DAYS out of
+chat_messages into compressed files under ARCHIVE_DIR; they are restored
+when the session is next read. When chat_messages is partitioned
+(`python migrate.py --partition-messages`), upcoming months' partitions are
+created and emptied old ones dropped. Run it from cron, daily is plenty:
+
+    python archive.py
+    python archive.py --idle-days 30
+    python archive.py --stats
+"""
+
+import argparse
+import asyncio
+import sys
+
+import main
+
+async def archive(stats_only: bool) -> bool:
+    if stats_only:
+        print(main.message_archive.stats())
+        return True
+    await main.init_database()
+    if main.engine is None:
+        return False
+    try:
+        summary = await main.run_archival()
+    finally:
+        await main.engine.dispose()
+    print(f"Archived {summary['messages']} messages of {summary['sessions']} sessions to {main.ARCHIVE_DIR}")
+    for label in ("partitions_created", "partitions_dropped"):
+        if summary[label]:
+            print(f"{label.replace('_', ' ').capitalize()}: {', '.join(summary[label])}")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--idle-days", type=float, default=main.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-sessions", type=int, default=main.ARCHIVE_BATCH_SESSIONS)
+    parser.add_argument("--stats", action="store_true", help="only report what the archive holds")
+    args = parser.parse_args()
+    main.configure_logging()
+    main.ARCHIVE_AFTER_DAYS = args.idle_days
+    main.ARCHIVE_BATCH_SESSIONS = args.batch_sessions
+
+    if not args.stats and not main.ASYNC_DATABASE_URL:
+        print("No DATABASE_URL available")
+        sys.exit(1)
+    if not asyncio.run(archive(args.stats)):
+        print("Archival failed - see the log above")
+        sys.exit(1)
@@ -0,0 +1,112 @@
+"""Run a batch chat job from a JSONL file of prompts, outside the API.
+
+The same jobs as POST /chat/batch: every line is {"message": ..., "custom_id":
+..., "conversation_history": [...]}, the last two optional, and its reply is
+stored in chat_batch_results, BATCH_CONCURRENCY prompts at a time and
+checkpointed as it goes. A job stopped by Ctrl-C or a crash carries on from
+its checkpoint with --resume. Memory use stays flat however many prompts
+the file holds:
+
+    python batch.py prompts.jsonl --user-id ops-nightly
+    python batch.py --resume BATCH_ID
+    python batch.py --results BATCH_ID --output replies.ndjson
+"""
+
+import argparse
+import asyncio
+import sys
+
+import main
+
+async def write_results(batch_id: str, output) -> None:
+    async for chunk in main.ndjson_chunks(main.batch_results(main.SessionLocal, batch_id)):
+        output.write(chunk)
+
+async def run_job(args) -> bool:
+    if args.resume:
+        batch_id = args.resume
+    else:
+        try:
+            batch = await main.create_batch(main.SessionLocal, args.user_id, args.source)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return False
+        batch_id = args.resume = batch.id
+        print(f"Batch {batch_id}: {batch.total} prompts", file=sys.stderr)
+
+    if not await main.batch_runner.claim(batch_id):
+        print(f"Batch {batch_id} can't be run: it has finished, doesn't exist or another worker holds it",
+              file=sys.stderr)
+        return False
+    job = main.batch_runner.jobs[batch_id]
+    while not job.task.done():
+        await asyncio.wait({job.task}, timeout=args.progress_seconds)
+        print(f"  line {job.next_line}, {job.handled} prompts this run, {job.rate():.1f}/s", file=sys.stderr)
+
+    async with main.SessionLocal() as db:
+        batch = await db.get(main.ChatBatch, batch_id)
+    summary = main.batch_to_dict(batch)
+    print(f"Batch {batch_id} {summary['status']}: {summary['succeeded']} answered, {summary['failed']} failed, "
+          f"{summary['tokens_used']} tokens, {summary['prompts_per_second']} prompts/s"
+          + (f" - {summary['error']}" if summary["error"] else ""), file=sys.stderr)
+    return summary["status"] == "completed"
+
+async def run(args, output) -> bool:
+    await main.init_database(create_tables=main.AUTO_MIGRATE)
+    if main.engine is None:
+        return False
+    try:
+        if args.results:
+            await write_results(args.results, output)
+            return True
+
+        await asyncio.to_thread(main.init_openai_client)
+        await asyncio.to_thread(main.load_token_encoding)
+        await main.reload_policy_index()
+        main.usage_ledger = main.UsageLedger(main.SessionLocal, main.USAGE_FLUSH_SECONDS, 0, 0,
+                                             main.USAGE_TRACKED_USERS)
+        await main.usage_ledger.start()
+        # Only this job: jobs left by stopped API workers are theirs to resume
+        main.batch_runner = main.BatchRunner(main.SessionLocal, args.concurrency, main.BATCH_FLUSH_ROWS,
+                                             main.BATCH_FLUSH_SECONDS, main.BATCH_LEASE_SECONDS)
+        await main.batch_runner.start(adopt=False)
+        try:
+            return await run_job(args)
+        finally:
+            # On Ctrl-C this stores what is complete and releases the job for --resume
+            await main.batch_runner.stop()
+            await main.usage_ledger.stop()
+    finally:
+        await main.engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?", help="JSONL file of prompts")
+    parser.add_argument("--user-id", help="user the job and its token usage are recorded under")
+    parser.add_argument("--resume", metavar="BATCH_ID", help="continue a stopped job from its checkpoint")
+    parser.add_argument("--results", metavar="BATCH_ID", help="write a job's results as NDJSON")
+    parser.add_argument("--output", help="file for --results, defaults to stdout")
+    parser.add_argument("--concurrency", type=int, default=main.BATCH_CONCURRENCY)
+    parser.add_argument("--progress-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    main.configure_logging()
+    if not (args.source or args.resume or args.results):
+        parser.error("give a source file, --resume or --results")
+    if args.source and not args.user_id:
+        parser.error("a new job needs --user-id")
+
+    if not main.ASYNC_DATABASE_URL:
+        print("No DATABASE_URL available", file=sys.stderr)
+        sys.exit(1)
+    try:
+        if args.results:
+            with open(args.output, "wb") if args.output else sys.stdout.buffer as output:
+                ok = asyncio.run(run(args, output))
+        else:
+            ok = asyncio.run(run(args, None))
+    except KeyboardInterrupt:
+        print(f"Stopped; the results so far are stored, carry on with --resume {args.resume or 'BATCH_ID'}",
+              file=sys.stderr)
+        sys.exit(130)
+    if not ok:
+        sys.exit(1)
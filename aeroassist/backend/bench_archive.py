@@ -0,0 +1,158 @@
+"""Benchmark hot-table growth with and without cold archival, and rehydration latency.
+
+Simulates --months of backdated traffic in a temporary SQLite database:
+each month --sessions new sessions of --turns exchanges, and a share of the
+previous month's sessions coming back for one more turn. At every month end
+the retention job runs (with ARCHIVE_AFTER_DAYS = --idle-days), and the
+rows and on-disk size of chat_messages (tables and indexes, via dbstat) are
+recorded. Runs without archival, with archival, and with archival over
+monthly partitions are compared, then archived sessions are read back
+through get_user_session to time their rehydration.
+
+    python bench_archive.py --months 12 --sessions 200 --turns 5 --idle-days 90
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text
+
+import main
+
+CONTENT = ("My flight from Lisbon was moved to the next morning and I need to know whether "
+           "my hotel night and meals are covered, and whether I can rebook onto another airline. ")
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.0
+
+def simulate_month(start: datetime, args, returning: list, rng: random.Random) -> tuple:
+    """Session and message rows for one month: new sessions plus returning ones."""
+    sessions, messages, touched = [], [], {}
+    length = timedelta(days=28).total_seconds()
+
+    def exchange(session_id: str, user_id: str, at: datetime) -> None:
+        for role in ("user", "assistant"):
+            messages.append({
+                "id": str(uuid.uuid4()), "session_id": session_id, "user_id": user_id, "role": role,
+                "content": CONTENT, "timestamp": at, "tokens_used": 80 if role == "assistant" else 0,
+                "seq": main.seq_at(at),
+            })
+            at += timedelta(seconds=1)
+        touched[session_id] = at
+
+    for _ in range(args.sessions):
+        session_id, user_id = str(uuid.uuid4()), f"user-{rng.randrange(args.sessions * 4)}"
+        at = start + timedelta(seconds=rng.uniform(0, length))
+        sessions.append({"id": session_id, "user_id": user_id, "created_at": at, "updated_at": at,
+                         "message_count": 2 * args.turns})
+        for _ in range(args.turns):
+            at += timedelta(minutes=2)
+            exchange(session_id, user_id, at)
+    for session_id, user_id in rng.sample(returning, int(len(returning) * args.returning)):
+        exchange(session_id, user_id, start + timedelta(seconds=rng.uniform(0, length)))
+    return sessions, messages, touched
+
+async def footprint(conn) -> dict:
+    sizes = {"table": 0, "index": 0}
+    rows = await conn.execute(text(
+        "SELECT m.type, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name "
+        "WHERE m.tbl_name LIKE 'chat_messages%' GROUP BY m.type"
+    ))
+    for kind, size in rows:
+        sizes[kind] = size
+    sizes["rows"] = (await conn.execute(text("SELECT COUNT(*) FROM chat_messages"))).scalar()
+    return sizes
+
+async def run(label: str, args, archive: bool, partition: bool, tmpdir: str) -> list:
+    path = os.path.join(tmpdir, f"{label.replace(' ', '_')}.db")
+    main.ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{path}"
+    main.message_archive = main.MessageArchive(os.path.join(tmpdir, f"{label.replace(' ', '_')}-archive"))
+    await main.init_database(create_tables=True)
+    first = main.month_start(datetime.now() - timedelta(days=31 * args.months))
+    if partition:
+        async with main.engine.begin() as conn:
+            await conn.run_sync(main.partition_message_table, main.MESSAGE_PARTITIONS_AHEAD)
+            # Back to the first simulated month
+            await conn.run_sync(lambda sync_conn: main.ensure_message_partitions(
+                sync_conn, main.MESSAGE_PARTITIONS_AHEAD, since=first))
+
+    rng = random.Random(7)
+    returning: list = []
+    history = []
+    start = first
+    for _ in range(args.months):
+        end = main.next_month(start)
+        sessions, messages, touched = simulate_month(start.astimezone().replace(tzinfo=None), args, returning, rng)
+        async with main.SessionLocal() as db:
+            await db.execute(insert(main.ChatSession.__table__), sessions)
+            await db.execute(insert(main.ChatMessage.__table__), messages)
+            for session_id, at in touched.items():
+                await db.execute(text("UPDATE chat_sessions SET updated_at = :at WHERE id = :id"),
+                                 {"at": at, "id": session_id})
+            await db.commit()
+        returning = [(s["id"], s["user_id"]) for s in sessions]
+
+        month_end = end.astimezone().replace(tzinfo=None)
+        if archive:
+            await main.run_archival(now=month_end)
+        async with main.engine.connect() as conn:
+            sizes = await footprint(conn)
+        sizes["archive"] = main.message_archive.stats()["bytes"]
+        sizes["file"] = os.path.getsize(path)
+        history.append((f"{start:%Y-%m}", sizes))
+        start = end
+
+    print(f"\n{label}")
+    print(f"{'month':<8} {'hot rows':>9} {'data KB':>9} {'index KB':>9} {'db file KB':>11} {'archive KB':>11}")
+    for month, sizes in history:
+        print(f"{month:<8} {sizes['rows']:>9} {sizes['table'] // 1024:>9} {sizes['index'] // 1024:>9} "
+              f"{sizes['file'] // 1024:>11} {sizes['archive'] // 1024:>11}")
+
+    if archive:
+        async with main.SessionLocal() as db:
+            archived = (await db.execute(
+                select(main.ChatSession.id, main.ChatSession.user_id)
+                .where(main.ChatSession.archived_at.is_not(None)).limit(args.rehydrate)
+            )).all()
+        samples = []
+        for session_id, user_id in archived:
+            async with main.SessionLocal() as db:
+                began = time.perf_counter()
+                await main.get_user_session(db, session_id, user_id)
+                await main.get_session_messages(db, session_id, limit=100)
+                samples.append(time.perf_counter() - began)
+        print(f"rehydrate + first page: n={len(samples)}  p50={percentile(samples, 50) * 1000:.1f}ms  "
+              f"p95={percentile(samples, 95) * 1000:.1f}ms")
+    await main.engine.dispose()
+    return history
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--sessions", type=int, default=200, help="new sessions per month")
+    parser.add_argument("--turns", type=int, default=5, help="exchanges per new session")
+    parser.add_argument("--returning", type=float, default=0.2, help="share of last month's sessions that come back")
+    parser.add_argument("--idle-days", type=float, default=90.0)
+    parser.add_argument("--rehydrate", type=int, default=50, help="archived sessions to read back")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.ARCHIVE_AFTER_DAYS = args.idle_days
+    tmpdir = tempfile.mkdtemp()
+    print(f"{args.months} months, {args.sessions} new sessions x {args.turns} turns per month, "
+          f"archive after {args.idle_days:g} idle days")
+    asyncio.run(run("no archival", args, archive=False, partition=False, tmpdir=tmpdir))
+    asyncio.run(run("archival", args, archive=True, partition=False, tmpdir=tmpdir))
+    asyncio.run(run("archival + monthly partitions", args, archive=True, partition=True, tmpdir=tmpdir))
+
+if __name__ == "__main__":
+    main_cli()
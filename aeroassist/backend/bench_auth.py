@@ -0,0 +1,54 @@
+"""Benchmark per-request authentication overhead of verify_token.
+
+Compares the remote Supabase round trip against in-process JWT verification
+and a claims-cache hit, using a local fake Supabase Auth server.
+
+    python bench_auth.py --rtt-ms 40 --iterations 200
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+from fastapi.security import HTTPAuthorizationCredentials
+from supabase import create_client
+
+import main
+from fakes import FAKE_JWT_SECRET, FakeSupabaseAuth, make_service_role_key, make_token
+
+def run(label: str, iterations: int, setup, credentials: HTTPAuthorizationCredentials) -> None:
+    samples = []
+    for _ in range(iterations):
+        setup()
+        start = time.perf_counter()
+        main.verify_token(credentials)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    print(f"{label:<22} p50={statistics.median(samples):>10.1f}us  "
+          f"p95={samples[int(len(samples) * 0.95) - 1]:>10.1f}us")
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rtt-ms", type=float, default=40.0, help="simulated Supabase round trip")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token())
+
+    with FakeSupabaseAuth(latency_ms=args.rtt_ms) as fake:
+        main.supabase = create_client(fake.url, make_service_role_key())
+
+        main.AUTH_VERIFY_MODE = "remote"
+        run("remote (cache miss)", args.iterations, main.auth_cache.clear, credentials)
+
+        main.AUTH_VERIFY_MODE = "local"
+        main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+        run("local (cache miss)", args.iterations, main.auth_cache.clear, credentials)
+        run("claims cache hit", args.iterations, lambda: None, credentials)
+
+        print(f"Supabase requests served: {fake.requests}")
+
+if __name__ == "__main__":
+    main_cli()
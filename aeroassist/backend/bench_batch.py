@@ -0,0 +1,203 @@
+"""Benchmark batch chat jobs against calling /chat in a loop, their memory use and resuming.
+
+Runs against a fake OpenAI Responses server in this process:
+
+- answers --prompts distinct prompts, with the fake taking --latency-ms
+  each, through POST /chat called in a loop (by one client, then by
+  BATCH_CONCURRENCY clients) and as one POST /chat/batch job, all served by
+  the app under uvicorn with a temporary SQLite database, and reports
+  prompts/s and database commits per prompt
+- runs batch.py on each of --memory-prompts prompts, the fake answering at
+  once, and reports its peak resident memory, which should not grow with
+  the size of the file
+- kills batch.py with SIGKILL halfway through --resume-prompts prompts,
+  resumes the job with --resume, and reports how many prompts were asked
+  again and whether every line ended up with exactly one result
+
+    python bench_batch.py --prompts 400 --memory-prompts 10000 100000
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def write_prompts(path: str, count: int) -> None:
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({"custom_id": f"msg-{i}",
+                                "message": f"Flight {i % 900 + 100} to Lisbon was cancelled, draft a reply to "
+                                           f"customer message {i} about rebooking and refunds."}) + "\n")
+
+# ---------------------------------------------------------------------------
+# /chat in a loop against a batch job
+# ---------------------------------------------------------------------------
+
+def chat_loop(url: str, headers: dict, prompts: list, clients: int) -> None:
+    def one_client(share: list) -> None:
+        with httpx.Client(base_url=url, headers=headers, timeout=60) as client:
+            for message in share:
+                client.post("/chat", json={"message": message}).raise_for_status()
+
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(one_client, [prompts[i::clients] for i in range(clients)]))
+
+def batch_job(url: str, headers: dict, path: str) -> dict:
+    with httpx.Client(base_url=url, headers=headers, timeout=60) as client, open(path, "rb") as f:
+        response = client.post("/chat/batch", content=f)
+        response.raise_for_status()
+        batch_id = response.json()["batch_id"]
+        while (status := client.get(f"/chat/batch/{batch_id}").json())["status"] in ("queued", "running"):
+            time.sleep(0.05)
+    return status
+
+def compare(args, tmpdir: str) -> None:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench_batch.db')}"
+    os.environ["AUTO_MIGRATE"] = "true"
+    os.environ["BATCH_SPOOL_DIR"] = os.path.join(tmpdir, "spool")
+    import main
+    from openai import AsyncOpenAI
+    from fakes import FAKE_JWT_SECRET, AppServer, FakeOpenAI, make_token
+
+    main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+    main.response_cache = None
+    main.upstream_scheduler = main.UpstreamScheduler(64, 0, 0, 30, 10000, 3, 0.05, 1.0)
+    headers = {"Authorization": f"Bearer {make_token(user_id='ops-nightly')}"}
+    path = os.path.join(tmpdir, "compare.jsonl")
+    write_prompts(path, args.prompts)
+    with open(path) as f:
+        prompts = [json.loads(line)["message"] for line in f]
+
+    rows = []
+    with FakeOpenAI(args.latency_ms) as fake, AppServer(main.app) as server:
+        main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1", max_retries=0)
+        chat_loop(server.url, headers, ["warm-up"], 1)
+        for label, run in (
+            ("/chat loop, 1 client", lambda: chat_loop(server.url, headers, prompts, 1)),
+            (f"/chat loop, {main.BATCH_CONCURRENCY} clients",
+             lambda: chat_loop(server.url, headers, prompts, main.BATCH_CONCURRENCY)),
+            ("POST /chat/batch", lambda: batch_job(server.url, headers, path)),
+        ):
+            commits, calls = main.db_commits.value(), fake.requests
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            rows.append((label, elapsed, main.db_commits.value() - commits, fake.requests - calls))
+
+    print(f"{args.prompts} prompts, fake latency {args.latency_ms:g} ms, batch concurrency {main.BATCH_CONCURRENCY}")
+    print(f"{'':<24} {'seconds':>8} {'prompts/s':>10} {'commits/prompt':>15} {'upstream calls':>15}")
+    for label, elapsed, commits, calls in rows:
+        print(f"{label:<24} {elapsed:>8.1f} {args.prompts / elapsed:>10.1f} {commits / args.prompts:>15.3f} {calls:>15}")
+
+# ---------------------------------------------------------------------------
+# batch.py: memory and resuming
+# ---------------------------------------------------------------------------
+
+def cli_env(fake_url: str, database: str, tmpdir: str, **extra) -> dict:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", AUTO_MIGRATE="true", OPENAI_API_KEY="fake",
+               OPENAI_BASE_URL=fake_url + "/v1", LOG_LEVEL="WARNING", RESPONSE_CACHE_ENABLED="false",
+               BATCH_SPOOL_DIR=os.path.join(tmpdir, "spool"),
+               # Without rate limits, so the job goes as fast as this machine allows
+               LLM_REQUESTS_PER_MINUTE="0", LLM_TOKENS_PER_MINUTE="0")
+    env.update({key: str(value) for key, value in extra.items()})
+    return env
+
+def start_cli(env: dict, *cli_args: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "batch.py", *cli_args, "--progress-seconds", "3600"],
+                            env=env, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+def wait_cli(cli: subprocess.Popen) -> tuple:
+    """Wait for a batch.py run; returns (exit status, peak RSS in bytes, stderr)."""
+    stderr = cli.stderr.read()
+    _, status, usage = os.wait4(cli.pid, 0)
+    cli.returncode = os.waitstatus_to_exitcode(status)
+    return cli.returncode, usage.ru_maxrss * 1024, stderr
+
+def memory(args, fake, tmpdir: str) -> None:
+    print(f"\nbatch.py, fake answering at once, concurrency {args.concurrency}")
+    print(f"{'prompts':>8} {'seconds':>8} {'prompts/s':>10} {'peak RSS MB':>12} {'results DB MB':>14}")
+    for count in args.memory_prompts:
+        path = os.path.join(tmpdir, f"memory-{count}.jsonl")
+        database = os.path.join(tmpdir, f"memory-{count}.db")
+        write_prompts(path, count)
+        start = time.perf_counter()
+        cli = start_cli(cli_env(fake.url, database, tmpdir), path, "--user-id", "ops-nightly",
+                        "--concurrency", str(args.concurrency))
+        returncode, peak, stderr = wait_cli(cli)
+        elapsed = time.perf_counter() - start
+        if returncode:
+            raise SystemExit(f"batch.py failed:\n{stderr}")
+        print(f"{count:>8} {elapsed:>8.1f} {count / elapsed:>10.1f} {peak / 2**20:>12.1f} "
+              f"{os.path.getsize(database) / 2**20:>14.1f}")
+        os.remove(path)
+
+def crash_and_resume(args, fake, tmpdir: str) -> None:
+    path = os.path.join(tmpdir, "resume.jsonl")
+    database = os.path.join(tmpdir, "resume.db")
+    write_prompts(path, args.resume_prompts)
+    lease = 2
+    env = cli_env(fake.url, database, tmpdir, BATCH_LEASE_SECONDS=lease, BATCH_FLUSH_ROWS=100)
+    calls = fake.requests
+    cli = start_cli(env, path, "--user-id", "ops-nightly", "--concurrency", str(args.concurrency))
+    while not (line := cli.stderr.readline()).startswith("Batch "):
+        pass
+    batch_id = line.split()[1].rstrip(":")
+
+    def checkpoint() -> int:
+        with sqlite3.connect(database) as db:
+            return db.execute("SELECT checkpoint FROM chat_batches WHERE id = ?", (batch_id,)).fetchone()[0]
+
+    while checkpoint() < args.resume_prompts // 2:
+        time.sleep(0.05)
+    cli.send_signal(signal.SIGKILL)
+    wait_cli(cli)
+    killed_at, asked = checkpoint(), fake.requests - calls
+
+    # The killed worker's lease has to lapse before another may take the job
+    time.sleep(lease)
+    returncode, _, stderr = wait_cli(start_cli(env, "--resume", batch_id))
+    if returncode:
+        raise SystemExit(f"batch.py --resume failed:\n{stderr}")
+    with sqlite3.connect(database) as db:
+        status, stored = db.execute("SELECT status, succeeded + failed FROM chat_batches WHERE id = ?",
+                                    (batch_id,)).fetchone()
+        results, lines = db.execute("SELECT COUNT(*), COUNT(DISTINCT line) FROM chat_batch_results "
+                                    "WHERE batch_id = ?", (batch_id,)).fetchone()
+    upstream = fake.requests - calls
+    print(f"\nKilled with SIGKILL after {asked} of {args.resume_prompts} prompts were asked, checkpoint at line {killed_at}")
+    print(f"  resumed: {status}, {results} results for {lines} distinct lines ({stored} counted), "
+          f"{upstream} prompts asked upstream in all, {upstream - args.resume_prompts} of them again")
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="fake latency for the /chat comparison")
+    parser.add_argument("--memory-prompts", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--resume-prompts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8, help="batch.py concurrency")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    tmpdir = tempfile.mkdtemp()
+    compare(args, tmpdir)
+
+    from fakes import FakeOpenAI
+
+    with FakeOpenAI() as fake:
+        memory(args, fake, tmpdir)
+    with FakeOpenAI(20) as fake:
+        crash_and_resume(args, fake, tmpdir)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,138 @@
+"""Benchmark server-side response chaining against re-sending the context every turn.
+
+Runs the app under uvicorn with a temporary SQLite database against a fake
+OpenAI Responses server that stores responses, continues them with
+previous_response_id and prefills every prompt token (a chained
+conversation included) at --prefill-ms-per-1k, except for a prefix it has
+already seen, which it treats as cached the way OpenAI's prompt caching
+does. --sessions sessions of --turns turns each are played through
+POST /chat, first with the full budgeted context per turn (the default)
+and then, against a fresh fake, with LLM_CHAIN_RESPONSES. At each of the
+--report turns it prints the bytes sent upstream, the prompt tokens, how
+many of them missed the prompt cache and the /chat latency, averaged over
+the sessions. Finally the fake forgets every stored response, and one more
+turn per session shows what a broken chain costs.
+
+    python bench_chain.py --sessions 4 --turns 100
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+WORDS = ("flight booking baggage allowance rebooking Lisbon delayed connection seat upgrade refund "
+         "voucher lounge boarding gate terminal passport visa fare class economy business").split()
+
+def user_message(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+
+def play_turn(client: httpx.Client, fake, headers: dict, session_id, message: str) -> tuple:
+    """One /chat turn; returns (session id, sample), the sample being
+    (bytes sent upstream, prompt tokens, uncached prompt tokens, seconds)."""
+    sent, prompted = len(fake.bodies), len(fake.prompts)
+    start = time.perf_counter()
+    response = client.post("/chat", json={"message": message, "session_id": session_id}, headers=headers)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    upstream_bytes = sum(len(json.dumps(body)) for body in fake.bodies[sent:])
+    prompts = fake.prompts[prompted:]
+    tokens = sum(tokens for tokens, _ in prompts)
+    uncached = sum(tokens - cached for tokens, cached in prompts)
+    return response.json()["session_id"], (upstream_bytes, tokens, uncached, elapsed)
+
+def play(main, client: httpx.Client, headers: dict, args, chained: bool) -> tuple:
+    """Play every session against a fresh fake; returns per-turn samples, and
+    for chained runs the samples of a broken turn and the turn after it."""
+    from openai import AsyncOpenAI
+    from fakes import FakeOpenAI
+
+    # A reply of a realistic length, so the stored conversation grows as it would
+    reply = " ".join(random.Random(5).choice(WORDS) for _ in range(100)) + "."
+    main.LLM_CHAIN_RESPONSES = chained
+    rng = random.Random(3)
+    samples = [[] for _ in range(args.turns)]
+    session_ids = []
+    with FakeOpenAI(args.latency_ms, reply=reply, prefill_ms_per_1k_tokens=args.prefill_ms_per_1k) as fake:
+        main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1", max_retries=0)
+        play_turn(client, fake, headers, None, "warm-up")
+        for _ in range(args.sessions):
+            session_id = None
+            for turn in range(args.turns):
+                session_id, sample = play_turn(client, fake, headers, session_id, user_message(rng))
+                samples[turn].append(sample)
+            session_ids.append(session_id)
+        if not chained:
+            return samples, [], []
+
+        fake.forget()
+        broken = [play_turn(client, fake, headers, session_id, user_message(rng))[1] for session_id in session_ids]
+        rebuilt = [play_turn(client, fake, headers, session_id, user_message(rng))[1] for session_id in session_ids]
+    return samples, broken, rebuilt
+
+def mean(values) -> float:
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--report", type=int, nargs="+", default=[1, 2, 5, 10, 25, 50, 75, 100],
+                        help="turns to print")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake time to first byte")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=50.0,
+                        help="fake prefill time per 1000 prompt tokens")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_chain.db')}"
+    os.environ["AUTO_MIGRATE"] = "true"
+    logging.disable(logging.CRITICAL)
+    import main
+    from fakes import FAKE_JWT_SECRET, AppServer, make_token
+
+    main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+    main.response_cache = None
+    # Without rate limits, so the longer chained prompts don't wait on the token budget
+    main.upstream_scheduler = main.UpstreamScheduler(64, 0, 0, 30, 10000, 3, 0.05, 1.0)
+    headers = {"Authorization": f"Bearer {make_token()}"}
+
+    with AppServer(main.app) as server, httpx.Client(base_url=server.url, timeout=120) as client:
+        full, _, _ = play(main, client, headers, args, chained=False)
+        chain, broken, rebuilt = play(main, client, headers, args, chained=True)
+        stats = client.get("/debug/llm").json()["response_chains"]
+
+    print(f"{args.sessions} sessions of {args.turns} turns, fake latency {args.latency_ms:g} ms "
+          f"+ {args.prefill_ms_per_1k:g} ms per 1k prompt tokens, context budget {main.CONTEXT_TOKEN_BUDGET} tokens, "
+          f"chains restarted past {main.LLM_CHAIN_MAX_INPUT_TOKENS} tokens")
+    print(f"{'':>5} {'full context':^38} {'chained':^38}")
+    print(f"{'turn':>5}" + f" {'KB sent':>8} {'prompt tok':>10} {'uncached':>9} {'ms':>7}" * 2)
+    for turn in args.report:
+        if turn > args.turns:
+            continue
+        row = ""
+        for samples in (full[turn - 1], chain[turn - 1]):
+            row += (f" {mean(s[0] for s in samples) / 1024:>8.2f} {mean(s[1] for s in samples):>10.0f} "
+                    f"{mean(s[2] for s in samples):>9.0f} {mean(s[3] for s in samples) * 1000:>7.0f}")
+        print(f"{turn:>5}{row}")
+
+    row = ""
+    for samples in (full, chain):
+        flat = [s for turn in samples for s in turn]
+        row += (f" {sum(s[0] for s in flat) / 1024 / args.sessions:>8.0f} {sum(s[1] for s in flat) / args.sessions:>10.0f} "
+                f"{sum(s[2] for s in flat) / args.sessions:>9.0f} {mean(s[3] for s in flat) * 1000:>7.0f}")
+    print(f"{'all':>5}{row}")
+    print("(all: KB and tokens summed per session, mean ms per turn)")
+
+    print(f"\nAfter the stored responses expire: broken turn {mean(s[3] for s in broken) * 1000:.0f} ms "
+          f"({mean(s[0] for s in broken) / 1024:.2f} KB sent), next turn {mean(s[3] for s in rebuilt) * 1000:.0f} ms "
+          f"({mean(s[0] for s in rebuilt) / 1024:.2f} KB sent)")
+    print(f"Chained turns {stats['chained']}, full context {stats['full']}, rebuilt after a broken chain {stats['rebuilt']}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,58 @@
+"""Load test of single-flight coalescing under a burst of identical questions.
+
+Fires a burst of concurrent first-turn questions (as during a disruption) at
+/chat and /chat/stream and counts how many upstream OpenAI calls were made,
+with coalescing on and off. The answer cache is disabled so only coalescing
+is measured.
+
+    python bench_coalesce.py --burst 500 --distinct 5 --latency-ms 800
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+import main
+from fakes import FAKE_JWT_SECRET, FakeOpenAI, make_token
+
+async def burst(endpoint: str, total: int, distinct: int) -> float:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one(i: int) -> None:
+            headers = {"Authorization": f"Bearer {make_token()}"}
+            question = f"Is flight AA{100 + i % distinct} cancelled because of the storm?"
+            response = await client.post(endpoint, json={"message": question}, headers=headers)
+            response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - start
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=500, help="concurrent requests")
+    parser.add_argument("--distinct", type=int, default=5, help="distinct questions in the burst")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="fake upstream latency")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+    main.response_cache = None
+
+    print(f"{args.burst} concurrent requests, {args.distinct} distinct questions")
+    for endpoint in ("/chat", "/chat/stream"):
+        for coalescing in (False, True):
+            main.LLM_COALESCING_ENABLED = coalescing
+            with FakeOpenAI(latency_ms=args.latency_ms) as fake:
+                main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1", max_retries=0)
+                elapsed = asyncio.run(burst(endpoint, args.burst, args.distinct))
+                label = f"{endpoint} coalescing={'on' if coalescing else 'off'}"
+                print(f"{label:<30} upstream calls={fake.requests:>5}  "
+                      f"saved={args.burst - fake.requests:>5}  wall={elapsed:>6.2f}s")
+
+if __name__ == "__main__":
+    main_cli()
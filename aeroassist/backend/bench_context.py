@@ -0,0 +1,59 @@
+"""Benchmark prompt size per turn against session length.
+
+Replays synthetic sessions turn by turn and compares the tokens sent with the
+old behavior (full client history plus the system prompt twice) against the
+budgeted context from assemble_context, along with its assembly time.
+
+    python bench_context.py --lengths 2 10 50 200 1000 --budget 3000
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import main
+
+WORDS = ("flight booking baggage allowance rebooking Lisbon delayed connection seat upgrade refund "
+         "voucher lounge boarding gate terminal passport visa fare class economy business").split()
+
+def synthetic_message(rng: random.Random, role: str, seq: int = 0) -> dict:
+    content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+    return {"seq": seq, "role": role, "content": content}
+
+def prompt_tokens(messages: list, user_message: str, system_copies: int) -> int:
+    return (system_copies * main.estimate_tokens(main.SYSTEM_PROMPT)
+            + sum(main.estimate_message_tokens(m) for m in messages)
+            + main.estimate_message_tokens({"role": "user", "content": user_message}))
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[2, 10, 50, 200, 1000],
+                        help="session lengths in messages")
+    parser.add_argument("--budget", type=int, default=main.CONTEXT_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.load_token_encoding()
+    main.CONTEXT_TOKEN_BUDGET = args.budget
+    rng = random.Random(42)
+
+    print(f"{'messages':>8}  {'full history':>12}  {'budgeted':>8}  {'assembly':>10}")
+    for length in args.lengths:
+        history = []
+        summary = None
+        elapsed = 0.0
+        # Replay the session so the rolling summary is built up as it would be live
+        while len(history) < length:
+            history.append(synthetic_message(rng, "user", len(history)))
+            history.append(synthetic_message(rng, "assistant", len(history)))
+            user_message = synthetic_message(rng, "user")["content"]
+            start = time.perf_counter()
+            messages, summary = main.assemble_context(history, user_message, summary)
+            elapsed = time.perf_counter() - start
+
+        print(f"{len(history):>8}  {prompt_tokens(history, user_message, 2):>12}  "
+              f"{prompt_tokens(messages, user_message, 1):>8}  {elapsed * 1e6:>8.0f}us")
+
+if __name__ == "__main__":
+    main_cli()
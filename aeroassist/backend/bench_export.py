@@ -0,0 +1,150 @@
+"""Benchmark exporting a user's full history: load-everything vs streaming, with peak RSS.
+
+Fills a temporary SQLite database (or --db, reused if it exists) with
+--messages synthetic messages across --sessions sessions of one user, then
+exports them in a fresh process per mode so each peak RSS is its own:
+
+- naive: what a client paging /sessions and calling /conversation per
+  session ends up doing, every session and message held in memory and
+  serialized at the end
+- stream: export_user_history through ndjson_chunks, as served by
+  GET /export/{user_id} and export.py, written to a file as it goes
+- stream (gzip): the same, compressed on the fly
+
+    python bench_export.py --messages 2000000 --sessions 2000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+USER_ID = "export-bench-user"
+CONTENT = ("Can I bring my folding bike as checked baggage on the Lisbon to Porto leg, and does it "
+           "count towards my allowance if I already have one suitcase?")
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def populate(path: str, messages: int, sessions: int) -> None:
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    logging.disable(logging.CRITICAL)
+    import main
+    asyncio.run(main.init_database(create_tables=True))
+    asyncio.run(main.engine.dispose())
+
+    conn = sqlite3.connect(path)
+    start = datetime(2024, 1, 1)
+    per_session = messages // sessions
+    seq = int(start.timestamp() * 1_000_000)
+    for s in range(sessions):
+        session_id = str(uuid.uuid4())
+        created = start + timedelta(hours=s)
+        rows = []
+        for i in range(per_session):
+            seq += 1_000_000
+            rows.append((str(uuid.uuid4()), session_id, USER_ID, "user" if i % 2 == 0 else "assistant", CONTENT,
+                         (created + timedelta(seconds=i)).isoformat(" "), 0 if i % 2 == 0 else 60, seq))
+        conn.executemany(
+            "INSERT INTO chat_messages (id, session_id, user_id, role, content, timestamp, tokens_used, seq) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        conn.execute(
+            "INSERT INTO chat_sessions (id, user_id, created_at, updated_at, message_count, tokens_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, USER_ID, created.isoformat(" "), (created + timedelta(seconds=per_session)).isoformat(" "),
+             per_session, 30 * per_session)
+        )
+    conn.commit()
+    conn.close()
+
+async def export_naive(main, output: str) -> None:
+    sessions, cursor = [], None
+    async with main.SessionLocal() as db:
+        while True:
+            page, cursor = await main.list_user_sessions(db, USER_ID, 200, cursor)
+            sessions.extend(page)
+            if not cursor:
+                break
+        export = []
+        for session in sessions:
+            messages = await main.get_session_messages(db, session.id)
+            export.append({
+                "id": session.id,
+                "messages": [
+                    {"seq": m.seq, "role": m.role, "content": m.content,
+                     "timestamp": m.timestamp.isoformat() if m.timestamp else None, "tokens_used": m.tokens_used}
+                    for m in messages
+                ],
+            })
+    with open(output, "w") as f:
+        f.write("\n".join(json.dumps(session) for session in export))
+
+async def export_stream(main, output: str, compress: bool) -> None:
+    with open(output, "wb") as f:
+        async for chunk in main.ndjson_chunks(main.export_user_history(main.SessionLocal, USER_ID), compress):
+            f.write(chunk)
+
+def child(mode: str, path: str, output: str) -> None:
+    """Run one export in this process and print its stats as JSON."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    logging.disable(logging.CRITICAL)
+    import main
+
+    async def run() -> None:
+        await main.init_database()
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        if mode == "naive":
+            await export_naive(main, output)
+        else:
+            await export_stream(main, output, compress=mode == "stream_gzip")
+        elapsed = time.perf_counter() - start
+        await main.engine.dispose()
+        print(json.dumps({"seconds": elapsed, "baseline_mb": baseline, "peak_mb": peak_rss_mb(),
+                          "bytes": os.path.getsize(output)}))
+
+    asyncio.run(run())
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--db", help="SQLite file to use, populated if it doesn't exist")
+    parser.add_argument("--modes", nargs="+", choices=("naive", "stream", "stream_gzip"),
+                        default=["naive", "stream", "stream_gzip"])
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "DB", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    path = args.db or os.path.join(tmpdir, "bench_export.db")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        populate(path, args.messages, args.sessions)
+        print(f"Populated {args.messages} messages in {args.sessions} sessions in {time.perf_counter() - start:.0f}s")
+
+    print(f"{'mode':<12} {'seconds':>8} {'msgs/s':>9} {'output MB':>10} {'peak RSS MB':>12} {'over baseline':>14}")
+    for mode in args.modes:
+        output = os.path.join(tmpdir, f"export-{mode}.out")
+        result = subprocess.run([sys.executable, __file__, "--child", mode, path, output],
+                                capture_output=True, text=True, check=True)
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:<12} {stats['seconds']:>8.1f} {args.messages / stats['seconds']:>9.0f} "
+              f"{stats['bytes'] / 2**20:>10.1f} {stats['peak_mb']:>12.1f} {stats['peak_mb'] - stats['baseline_mb']:>14.1f}")
+        os.remove(output)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,62 @@
+"""Benchmark the per-span overhead of the metrics instrumentation.
+
+Times an empty block against the same block wrapped in StageTimer, with and
+without a Server-Timing collector, plus the bare counter and histogram calls.
+
+    python bench_metrics.py --iterations 1000000
+"""
+
+import argparse
+import logging
+import time
+
+import main
+
+def per_call_ns(body, iterations: int) -> float:
+    start = time.perf_counter()
+    body(iterations)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+def empty(n: int) -> None:
+    for _ in range(n):
+        pass
+
+def span(n: int) -> None:
+    timer = main.StageTimer
+    for _ in range(n):
+        with timer("bench"):
+            pass
+
+def counter(n: int) -> None:
+    inc = main.db_queries.inc
+    for _ in range(n):
+        inc()
+
+def histogram(n: int) -> None:
+    observe = main.stage_seconds.observe
+    for _ in range(n):
+        observe(0.0123, "bench")
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    baseline = per_call_ns(empty, args.iterations)
+
+    results = [
+        ("StageTimer span", per_call_ns(span, args.iterations)),
+        ("counter inc", per_call_ns(counter, args.iterations)),
+        ("histogram observe", per_call_ns(histogram, args.iterations)),
+    ]
+    token = main._server_timings.set([])
+    # Bounded so the collector doesn't grow without limit
+    results.append(("span + Server-Timing", per_call_ns(span, min(args.iterations, 100_000))))
+    main._server_timings.reset(token)
+
+    for label, ns in results:
+        print(f"{label:<22} {(ns - baseline) / 1000:>7.3f}us per call")
+
+if __name__ == "__main__":
+    main_cli()
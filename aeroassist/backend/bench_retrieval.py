@@ -0,0 +1,179 @@
+"""Benchmark policy retrieval: build time, query latency, prompt tokens and hot reload.
+
+Generates --documents synthetic policy documents (Markdown sections of
+airline terms mixed with Zipf-distributed filler), builds the index, then:
+
+- times --queries searches, and the full retrieve_policy_context step that
+  formats the excerpts for the instructions
+- compares the tokens added per turn with pasting the whole documents the
+  excerpts came from
+- rebuilds the index in another process and reloads it while searches keep
+  running on the event loop, reporting the slowest search and the largest
+  event-loop stall around the swap, next to the same before the rebuild
+
+    python bench_retrieval.py --documents 2000 --queries 2000
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import main
+
+TOPICS = {
+    "Checked baggage": "checked bag allowance kg weight piece overweight fee economy business",
+    "Cabin baggage": "cabin carry-on personal item overhead bin size dimensions laptop",
+    "Sports equipment": "bicycle surfboard golf ski equipment packed box oversized",
+    "Rebooking": "rebook cancelled delayed flight next available refund voucher",
+    "Fare rules": "fare change fee difference light classic flex refundable nonrefundable",
+    "Infants and children": "infant child stroller car seat lap bassinet age",
+    "Pets": "pet dog cat carrier cabin hold kennel vaccination",
+    "Special assistance": "wheelchair assistance mobility medical oxygen escort",
+    "Check-in": "check-in online airport deadline boarding pass kiosk",
+    "Compensation": "compensation regulation delay hours distance claim eligible",
+}
+QUESTIONS = [
+    "how much does an extra checked bag cost",
+    "can I bring my surfboard and does it count towards my allowance",
+    "my flight was cancelled can I get a refund or rebook",
+    "what size can my carry-on be",
+    "can my dog travel in the cabin",
+    "do I need to book a wheelchair in advance",
+    "when does online check-in close",
+    "how much compensation for a five hour delay",
+    "can I change a light fare",
+    "can I bring a stroller for my infant",
+]
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.0
+
+def write_corpus(directory: str, documents: int, rng: random.Random) -> None:
+    filler = [f"term{rank}" for rank in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(5000)]
+    topics = list(TOPICS.items())
+    for d in range(documents):
+        sections = []
+        for heading, vocabulary in rng.sample(topics, 4):
+            words = vocabulary.split()
+            paragraphs = []
+            for _ in range(rng.randint(2, 5)):
+                text = rng.choices(filler, weights, k=rng.randint(40, 90)) + rng.choices(words, k=rng.randint(3, 12))
+                rng.shuffle(text)
+                paragraphs.append(" ".join(text) + ".")
+            sections.append(f"## {heading} (region {d})\n\n" + "\n\n".join(paragraphs))
+        with open(os.path.join(directory, f"policy-{d:05d}.md"), "w") as f:
+            f.write(f"# Conditions of carriage {d}\n\n" + "\n\n".join(sections))
+
+async def reload_under_load(index_path: str, source: str, rng: random.Random) -> dict:
+    """Keep searching while another process rebuilds the index and it is reloaded."""
+    searches, lags = [], []
+    stop = asyncio.Event()
+
+    async def searcher() -> None:
+        while not stop.is_set():
+            start = time.perf_counter()
+            main.policy_index.search(rng.choice(QUESTIONS), main.POLICY_TOP_K)
+            searches.append((start, time.perf_counter() - start))
+            await asyncio.sleep(0.001)
+
+    async def lag_probe() -> None:
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append((start, time.perf_counter() - start - 0.005))
+
+    def worst(samples: list, start: float, end: float) -> float:
+        return max((value for at, value in samples if start <= at <= end), default=0.0)
+
+    tasks = [asyncio.create_task(searcher()), asyncio.create_task(lag_probe())]
+    baseline_start = time.perf_counter()
+    await asyncio.sleep(0.5)
+    baseline_end = time.perf_counter()
+    before = main.policy_index
+    builder = await asyncio.create_subprocess_exec(
+        sys.executable, "build_policy_index.py", source, "--output", index_path,
+        stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+    await builder.wait()
+    swap_start = time.perf_counter()
+    reloaded = await main.reload_policy_index(index_path)
+    swap_end = time.perf_counter()
+    await asyncio.sleep(0.5)
+    stop.set()
+    await asyncio.gather(*tasks)
+    window = (swap_start - 0.01, swap_end + 0.1)
+    return {
+        "reloaded": reloaded and main.policy_index is not before,
+        "swap": swap_end - swap_start,
+        "baseline": (worst(searches, baseline_start, baseline_end), worst(lags, baseline_start, baseline_end)),
+        "reload": (worst(searches, *window), worst(lags, *window)),
+    }
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.load_token_encoding()
+    rng = random.Random(5)
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "policies")
+    os.makedirs(source)
+    write_corpus(source, args.documents, rng)
+    corpus = []
+    for name in os.listdir(source):
+        with open(os.path.join(source, name)) as f:
+            corpus.append(f.read())
+    corpus_words = sum(len(document.split()) for document in corpus)
+    corpus_tokens = sum(main.estimate_tokens(document) for document in corpus)
+
+    index_path = os.path.join(tmpdir, "policy.idx")
+    start = time.perf_counter()
+    stats = main.build_policy_index(source, index_path)
+    print(f"{args.documents} documents, {corpus_words} words -> {stats['chunks']} chunks, {stats['terms']} terms, "
+          f"{stats['bytes'] / 2**20:.1f} MB index, built in {time.perf_counter() - start:.1f}s")
+
+    asyncio.run(main.reload_policy_index(index_path))
+    index = main.policy_index
+    search, context, injected, whole = [], [], [], []
+    document_tokens = {}
+    for i in range(args.queries):
+        question = rng.choice(QUESTIONS)
+        start = time.perf_counter()
+        hits = index.search(question, main.POLICY_TOP_K, main.POLICY_MIN_SCORE)
+        search.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        excerpts = main.retrieve_policy_context(question, [])
+        context.append(time.perf_counter() - start)
+        injected.append(main.estimate_tokens(excerpts))
+        for source_name in {hit["source"] for hit in hits}:
+            if source_name not in document_tokens:
+                with open(os.path.join(source, source_name)) as f:
+                    document_tokens[source_name] = main.estimate_tokens(f.read())
+        whole.append(sum(document_tokens[name] for name in {hit["source"] for hit in hits}))
+
+    print(f"\n{'step':<26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, samples in (("search (top-k)", search), ("search + format excerpts", context)):
+        print(f"{label:<26} {percentile(samples, 50) * 1000:>8.2f} {percentile(samples, 95) * 1000:>8.2f} "
+              f"{percentile(samples, 99) * 1000:>8.2f}")
+    print(f"\nPolicy tokens per turn: excerpts {sum(injected) / len(injected):.0f}, "
+          f"whole source documents {sum(whole) / len(whole):.0f}, whole corpus {corpus_tokens}")
+
+    result = asyncio.run(reload_under_load(index_path, source, rng))
+    print(f"\nHot reload while searching: reloaded={result['reloaded']}  swap={result['swap'] * 1000:.1f} ms")
+    for label in ("baseline", "reload"):
+        search_ms, lag_ms = (value * 1000 for value in result[label])
+        print(f"  {label:<9} slowest search={search_ms:.2f} ms  largest loop stall={lag_ms:.2f} ms")
+
+if __name__ == "__main__":
+    main_cli()
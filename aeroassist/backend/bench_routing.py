@@ -0,0 +1,137 @@
+"""Benchmark model routing: tail latency with hedging, and errors with failover.
+
+Two fake OpenAI endpoints stand in for a primary and a secondary route.
+Each draws its latency from a lognormal body (--median-ms) with a share of
+calls (--stall-share) stalling for --stall-ms more, independently of the
+other. Calls go through process_with_openai (or stream_with_openai with
+--stream, timing the first token) with --concurrency in flight:
+
+- single route: one attempt per call, as before routing
+- hedged, same route: a duplicate to the same endpoint past its hedge
+  percentile (LLM_HEDGE_PERCENTILE, --percentile)
+- hedged to secondary: the duplicate goes to the secondary route
+- primary failing, then down: the primary answers --failure-rate of calls,
+  then all of them, with a 500; with one route (scheduler retries only) and
+  with failover to the secondary
+
+    python bench_routing.py --calls 600 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import time
+
+from openai import AsyncOpenAI
+
+import main
+from fakes import FakeOpenAI, lognormal_latency, stall_latency
+
+HISTORY = [{"role": "user", "content": "I'm flying to Lisbon on Friday."},
+           {"role": "assistant", "content": "Great, how can I help with your Lisbon trip?"}]
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.0
+
+async def one_call(i: int, stream: bool) -> float:
+    message = f"Question {i}: can I bring a surfboard?"
+    start = time.perf_counter()
+    if not stream:
+        await main.process_with_openai(HISTORY, message)
+        return time.perf_counter() - start
+    elapsed = None
+    async for event in main.stream_with_openai(HISTORY, message):
+        if elapsed is None and event["type"] in ("delta", "done"):
+            elapsed = time.perf_counter() - start
+    return elapsed
+
+async def run_calls(calls: int, concurrency: int, stream: bool, offset: int) -> tuple:
+    latencies, errors = [], 0
+    queue = iter(range(offset, offset + calls))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in queue:
+            try:
+                latencies.append(await one_call(i, stream))
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+def scenario(label: str, args, hedge: bool, secondary: bool, failure_rate: float) -> None:
+    def latency(seed: int):
+        return stall_latency(lognormal_latency(args.median_ms, 0.3, seed), args.stall_ms, args.stall_share, seed + 1)
+
+    with FakeOpenAI(latency(1), failure_rate=failure_rate, seed=3) as primary, FakeOpenAI(latency(7)) as backup:
+        routes = [main.ModelRoute("gpt-4o-mini", primary.url + "/v1", args.timeout)]
+        if secondary:
+            routes.append(main.ModelRoute("gpt-4.1-mini", backup.url + "/v1", args.timeout))
+        main.model_router = main.ModelRouter(routes, hedge, args.percentile, main.LLM_HEDGE_MIN_SECONDS,
+                                             args.max_ratio, main.LLM_ROUTE_ERROR_THRESHOLD, args.cooldown)
+        main.upstream_scheduler = main.UpstreamScheduler(64, 0, 0, 30, 10000, 3, 0.05, 1.0)
+
+        async def run() -> tuple:
+            # Warm-up calls give the router its latency samples
+            await run_calls(args.warmup, args.concurrency, args.stream, 0)
+            warm_calls = primary.requests + backup.requests
+            stats = main.model_router.stats()
+            result = await run_calls(args.calls, args.concurrency, args.stream, args.warmup)
+            await main.model_router.close()
+            after = main.model_router.stats()
+            upstream = primary.requests + backup.requests - warm_calls
+            if args.verbose:
+                print(after["routes"])
+            return result, upstream, after["hedges"] - stats["hedges"], after["hedges_won"] - stats["hedges_won"], \
+                after["failovers"] - stats["failovers"]
+
+        (latencies, errors), upstream, hedges, won, failovers = asyncio.run(run())
+
+    if not latencies:
+        print(f"{label:<30} {'-':>7} {'-':>7} {'-':>7} {'-':>7} {errors:>6} {upstream / args.calls:>9.2f}")
+        return
+    print(f"{label:<30} {percentile(latencies, 50) * 1000:>7.0f} {percentile(latencies, 95) * 1000:>7.0f} "
+          f"{percentile(latencies, 99) * 1000:>7.0f} {max(latencies) * 1000:>7.0f} {errors:>6} "
+          f"{upstream / args.calls:>9.2f} {hedges:>7} {won:>5} {failovers:>9}")
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=600)
+    parser.add_argument("--warmup", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--median-ms", type=float, default=300.0)
+    parser.add_argument("--stall-ms", type=float, default=2000.0)
+    parser.add_argument("--stall-share", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.3)
+    parser.add_argument("--percentile", type=float, default=main.LLM_HEDGE_PERCENTILE)
+    parser.add_argument("--max-ratio", type=float, default=main.LLM_HEDGE_MAX_RATIO)
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-route timeout")
+    parser.add_argument("--cooldown", type=float, default=5.0)
+    parser.add_argument("--stream", action="store_true", help="time the first token of streamed replies")
+    parser.add_argument("--verbose", action="store_true", help="print the router's route stats after each scenario")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.OPENAI_API_KEY = "fake"
+    main.openai_client = AsyncOpenAI(api_key="fake", max_retries=0)
+    main.LLM_COALESCING_ENABLED = False
+    main.response_cache = None
+
+    print(f"{args.calls} calls, {args.concurrency} concurrent, latency lognormal median {args.median_ms:g} ms "
+          f"+ {args.stall_ms:g} ms stalls on {args.stall_share:.0%} of calls"
+          + (", time to first token" if args.stream else ""))
+    print(f"{'scenario':<30} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'errors':>6} "
+          f"{'calls/req':>9} {'hedges':>7} {'won':>5} {'failovers':>9}")
+    scenario("single route", args, hedge=False, secondary=False, failure_rate=0.0)
+    scenario("hedged, same route", args, hedge=True, secondary=False, failure_rate=0.0)
+    scenario("hedged to secondary", args, hedge=True, secondary=True, failure_rate=0.0)
+    for failure_rate in (args.failure_rate, 1.0):
+        state = "down" if failure_rate == 1.0 else f"failing {failure_rate:.0%}"
+        scenario(f"primary {state}, 1 route", args, hedge=False, secondary=False, failure_rate=failure_rate)
+        scenario(f"primary {state}, failover", args, hedge=False, secondary=True, failure_rate=failure_rate)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,85 @@
+"""Load test of the upstream scheduler against a rate-limited OpenAI stand-in.
+
+A burst of /chat requests, half follow-up turns and half new sessions, hits
+a fake OpenAI that answers 429 with Retry-After beyond --upstream-capacity
+concurrent calls. The unbounded run approximates the old behaviour, with no
+cap and no retries; the scheduled run caps in-flight calls at the upstream
+capacity and retries with backoff.
+
+    python bench_scheduler.py --burst 200 --upstream-capacity 8 --latency-ms 200
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+import main
+from fakes import FAKE_JWT_SECRET, FakeOpenAI, make_token
+
+HISTORY = [
+    {"role": "user", "content": "I'm flying to Lisbon on Friday."},
+    {"role": "assistant", "content": "Great, how can I help with your Lisbon trip?"},
+]
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.0
+
+async def burst(total: int) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    results = {"follow_up": [], "new_session": [], "status": {}}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one(i: int) -> None:
+            kind = "follow_up" if i % 2 else "new_session"
+            body = {"message": f"Request {i}: can I bring a surfboard?"}
+            if kind == "follow_up":
+                body["conversation_history"] = HISTORY
+            start = time.perf_counter()
+            response = await client.post("/chat", json=body, headers={"Authorization": f"Bearer {make_token()}"})
+            elapsed = time.perf_counter() - start
+            results["status"][response.status_code] = results["status"].get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                results[kind].append(elapsed)
+
+        await asyncio.gather(*(one(i) for i in range(total)))
+    return results
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=200)
+    parser.add_argument("--upstream-capacity", type=int, default=8, help="concurrent calls before the fake returns 429")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After sent with each 429")
+    parser.add_argument("--queue-timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+    main.response_cache = None
+
+    runs = {
+        "unbounded, no retries": main.UpstreamScheduler(10**6, 0, 0, args.queue_timeout, 10**6, 0, 0.5, 20),
+        "scheduled": main.UpstreamScheduler(args.upstream_capacity, 0, 0, args.queue_timeout, 1000, 3, 0.5, 20),
+    }
+    print(f"{args.burst} concurrent /chat requests, upstream accepts {args.upstream_capacity} at a time")
+    for label, scheduler in runs.items():
+        main.upstream_scheduler = scheduler
+        with FakeOpenAI(args.latency_ms, max_concurrency=args.upstream_capacity, retry_after=args.retry_after) as fake:
+            main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1", max_retries=0)
+            start = time.perf_counter()
+            results = asyncio.run(burst(args.burst))
+            elapsed = time.perf_counter() - start
+        statuses = "  ".join(f"{code}={count}" for code, count in sorted(results["status"].items()))
+        print(f"{label:<22} {statuses}  upstream 429s={fake.throttled}  wall={elapsed:.1f}s")
+        for kind in ("follow_up", "new_session"):
+            samples = results[kind]
+            print(f"  {kind:<20} ok={len(samples):>4}  p50={percentile(samples, 50) * 1000:>8.0f}ms  "
+                  f"p95={percentile(samples, 95) * 1000:>8.0f}ms")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,159 @@
+"""Benchmark /search latency as message history grows, full-text index vs a LIKE scan.
+
+Grows a temporary SQLite database (or --db) to each of --sizes messages,
+spread over --users users, with one user holding --user-share of them, so
+the searched history grows with the total. Message text is drawn from a
+Zipf-distributed vocabulary, and queries use a rare, a mid-frequency and a
+common word plus a two-word query. At every size the searched user's
+first page of results is timed through search_messages, which uses the
+FTS5 index, and through a LIKE scan of the user's messages for comparison.
+
+    python bench_search.py --sizes 100000 1000000 10000000
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import text
+
+SEARCHED_USER = "search-bench-user"
+VOCABULARY = 20000
+MESSAGES_PER_SESSION = 50
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.0
+
+def make_word(rank: int) -> str:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    word = ""
+    rank += 26 * 27
+    while rank:
+        rank, digit = divmod(rank, 26)
+        word += letters[digit]
+    return word + "o"
+
+def sentence_pool(rng: random.Random, size: int) -> list:
+    """Sentences of 10-30 words, word ranks Zipf-distributed."""
+    words = [make_word(rank) for rank in range(VOCABULARY)]
+    weights = [1 / (rank + 1) for rank in range(VOCABULARY)]
+    return [" ".join(rng.choices(words, weights, k=rng.randint(10, 30))) for _ in range(size)]
+
+def grow(path: str, start: int, target: int, args, pool: list, rng: random.Random) -> None:
+    """Insert messages until the database holds target of them; the triggers index them."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    seq = int(time.time() * 1_000_000) - 10 ** 14 + start * 1000
+    inserted = start
+    while inserted < target:
+        batch = min(MESSAGES_PER_SESSION * 200, target - inserted)
+        sessions, rows = [], []
+        for offset in range(0, batch, MESSAGES_PER_SESSION):
+            user_id = SEARCHED_USER if rng.random() < args.user_share else f"user-{rng.randrange(args.users)}"
+            session_id = str(uuid.uuid4())
+            count = min(MESSAGES_PER_SESSION, batch - offset)
+            sessions.append((session_id, user_id, count))
+            for i in range(count):
+                seq += 1000
+                rows.append((str(uuid.uuid4()), session_id, user_id, "user" if i % 2 == 0 else "assistant",
+                             rng.choice(pool), 0, seq))
+        conn.executemany(
+            "INSERT INTO chat_sessions (id, user_id, created_at, updated_at, message_count) "
+            "VALUES (?, ?, datetime('now'), datetime('now'), ?)", sessions
+        )
+        conn.executemany(
+            "INSERT INTO chat_messages (id, session_id, user_id, role, content, timestamp, tokens_used, seq) "
+            "VALUES (?, ?, ?, ?, ?, datetime('now'), ?, ?)", rows
+        )
+        conn.commit()
+        inserted += batch
+    conn.close()
+
+async def measure(main, queries: dict, repeat: int) -> dict:
+    results = {}
+    async with main.SessionLocal() as db:
+        user_messages = (await db.execute(
+            text("SELECT COUNT(*) FROM chat_messages_search WHERE user_id = :u"), {"u": SEARCHED_USER}
+        )).scalar()
+        for label, query in queries.items():
+            indexed, scanned = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                hits, _ = await main.search_messages(db, SEARCHED_USER, query, 20)
+                indexed.append(time.perf_counter() - start)
+            words = query.split()
+            where = " AND ".join(f"content LIKE :w{i}" for i in range(len(words)))
+            for _ in range(max(1, repeat // 10)):
+                start = time.perf_counter()
+                await db.execute(text(
+                    f"SELECT session_id, seq FROM chat_messages WHERE user_id = :u AND {where} "
+                    "ORDER BY seq DESC LIMIT 20"
+                ), {"u": SEARCHED_USER, **{f"w{i}": f"%{word}%" for i, word in enumerate(words)}})
+                scanned.append(time.perf_counter() - start)
+            results[label] = (len(hits), percentile(indexed, 50), percentile(indexed, 95), percentile(scanned, 50))
+    return {"user_messages": user_messages, "queries": results}
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--user-share", type=float, default=0.01, help="share of messages from the searched user")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per query and size")
+    parser.add_argument("--db", help="SQLite file to grow, defaults to a temporary one")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench_search.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    logging.disable(logging.CRITICAL)
+    import main
+
+    rng = random.Random(11)
+    pool = sentence_pool(rng, 200_000)
+    queries = {
+        "rare word": make_word(5000),
+        "mid word": make_word(300),
+        "common word": make_word(5),
+        "two words": f"{make_word(30)} {make_word(60)}",
+    }
+
+    async def setup() -> int:
+        await main.init_database(create_tables=True)
+        async with main.engine.connect() as conn:
+            count = (await conn.execute(text("SELECT COUNT(*) FROM chat_messages"))).scalar()
+        await main.engine.dispose()
+        return count
+
+    existing = asyncio.run(setup())
+    print(f"{'messages':>10} {'user msgs':>10} {'query':<12} {'hits':>5} "
+          f"{'FTS p50 ms':>11} {'FTS p95 ms':>11} {'LIKE p50 ms':>12}")
+    for size in args.sizes:
+        if size > existing:
+            start = time.perf_counter()
+            grow(path, existing, size, args, pool, rng)
+            logging.disable(logging.NOTSET)
+            print(f"  (grew to {size} messages in {time.perf_counter() - start:.0f}s)")
+            logging.disable(logging.CRITICAL)
+            existing = size
+
+        async def run() -> dict:
+            await main.init_database()
+            try:
+                return await measure(main, queries, args.repeat)
+            finally:
+                await main.engine.dispose()
+
+        stats = asyncio.run(run())
+        for label, (hits, p50, p95, scan) in stats["queries"].items():
+            print(f"{size:>10} {stats['user_messages']:>10} {label:<12} {hits:>5} "
+                  f"{p50 * 1000:>11.2f} {p95 * 1000:>11.2f} {scan * 1000:>12.1f}")
+
+if __name__ == "__main__":
+    main_cli()
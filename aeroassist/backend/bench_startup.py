@@ -0,0 +1,105 @@
+"""Benchmark cold start: module import time and time to the first served request.
+
+Each run is a fresh interpreter. Import time is measured in-process; for
+the first request, uvicorn is launched against the local Supabase and
+OpenAI fakes and a temporary SQLite database (or --database-url), and the
+clock runs from process spawn until the first /chat reply arrives.
+
+    python bench_startup.py --runs 5
+    python bench_startup.py --runs 5 --auto-migrate --auth remote
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from fakes import FAKE_JWT_SECRET, FakeOpenAI, FakeSupabaseAuth, make_service_role_key, make_token
+
+IMPORT_PROBE = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_import(env: dict) -> float:
+    result = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def measure_first_request(env: dict) -> tuple:
+    """Spawn uvicorn; return (seconds until it accepts connections, seconds until the first /chat reply)."""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        # uvicorn only binds its socket once the lifespan startup has finished
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError("server exited during startup")
+                time.sleep(0.005)
+        ready = time.perf_counter() - start
+
+        response = httpx.post(f"http://127.0.0.1:{port}/chat", json={"message": "What is my baggage allowance?"},
+                              headers={"Authorization": f"Bearer {make_token()}"}, timeout=60)
+        response.raise_for_status()
+        return ready, time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+def report(label: str, samples: list) -> None:
+    print(f"{label:<28} median={statistics.median(samples) * 1000:>8.1f}ms  "
+          f"min={min(samples) * 1000:>8.1f}ms  max={max(samples) * 1000:>8.1f}ms")
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--auth", choices=("local", "remote"), default="local")
+    parser.add_argument("--auto-migrate", action="store_true", help="create tables at startup instead of beforehand")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    with FakeOpenAI() as fake_openai, FakeSupabaseAuth() as fake_auth:
+        env = dict(
+            os.environ,
+            DATABASE_URL=args.database_url or f"sqlite:///{tmpdir}/bench_startup.db",
+            SUPABASE_URL=fake_auth.url,
+            SUPABASE_SERVICE_ROLE_KEY=make_service_role_key(),
+            JWT_SECRET_KEY=FAKE_JWT_SECRET,
+            AUTH_VERIFY_MODE=args.auth,
+            OPENAI_API_KEY="fake",
+            OPENAI_BASE_URL=fake_openai.url + "/v1",
+            AUTO_MIGRATE="true" if args.auto_migrate else "false",
+        )
+        if not args.auto_migrate:
+            subprocess.run([sys.executable, "migrate.py"], env=env, capture_output=True, check=True)
+
+        imports, ready, first_reply = [], [], []
+        for _ in range(args.runs):
+            imports.append(measure_import(env))
+            accepting, replied = measure_first_request(env)
+            ready.append(accepting)
+            first_reply.append(replied)
+
+    print(f"{args.runs} cold starts (auth={args.auth}, auto_migrate={args.auto_migrate})")
+    report("import main", imports)
+    report("spawn -> accepting", ready)
+    report("spawn -> first /chat reply", first_reply)
+
+if __name__ == "__main__":
+    main_cli()
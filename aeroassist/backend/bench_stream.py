@@ -0,0 +1,78 @@
+"""Benchmark time-to-first-token and concurrency of /chat vs /chat/stream.
+
+Runs the app under uvicorn against a fake OpenAI Responses server that
+streams its reply with a configurable first-token latency and token gap.
+
+    python bench_stream.py --concurrency 50 --latency-ms 300 --token-interval-ms 20
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+from openai import AsyncOpenAI
+
+import main
+from fakes import FAKE_JWT_SECRET, AppServer, FakeOpenAI, make_token
+
+async def blocking_turn(client: httpx.AsyncClient, headers: dict) -> float:
+    start = time.perf_counter()
+    response = await client.post("/chat", json={"message": "What is my baggage allowance?"}, headers=headers)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+async def streaming_turn(client: httpx.AsyncClient, headers: dict) -> float:
+    start = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/chat/stream", json={"message": "What is my baggage allowance?"},
+                             headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line.startswith("data:") and '"delta"' in line:
+                first_token = time.perf_counter() - start
+    return first_token
+
+async def drive(turn, base_url: str, concurrency: int) -> tuple:
+    headers = {"Authorization": f"Bearer {make_token()}"}
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(turn(client, headers) for _ in range(concurrency)))
+        return sorted(samples), time.perf_counter() - start
+
+def _drive_in_process(turn_name: str, base_url: str, concurrency: int) -> tuple:
+    return asyncio.run(drive(globals()[turn_name], base_url, concurrency))
+
+def run(label: str, turn, base_url: str, concurrency: int, pool: ProcessPoolExecutor) -> None:
+    # The load generator runs in its own process so it doesn't compete with
+    # the server for the GIL
+    samples, elapsed = pool.submit(_drive_in_process, turn.__name__, base_url, concurrency).result()
+    print(f"{label:<28} p50={statistics.median(samples) * 1000:>8.1f}ms  "
+          f"p95={samples[int(len(samples) * 0.95) - 1] * 1000:>8.1f}ms  "
+          f"{concurrency / elapsed:>7.1f} req/s")
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake time to first token")
+    parser.add_argument("--token-interval-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+
+    pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+    with pool, FakeOpenAI(args.latency_ms, args.token_interval_ms) as fake, AppServer(main.app) as server:
+        main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1")
+        run("warm-up", blocking_turn, server.url, 1, pool)
+        print(f"{args.concurrency} concurrent requests on one worker")
+        run("/chat (full reply)", blocking_turn, server.url, args.concurrency, pool)
+        run("/chat/stream (first token)", streaming_turn, server.url, args.concurrency, pool)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,209 @@
+"""Benchmark WebSocket chat: idle connection footprint, per-turn overhead and cancel.
+
+Runs the app under uvicorn with a temporary SQLite database in this
+process, against a fake OpenAI Responses server, and drives it from a
+client subprocess (this script with --client) so the server's memory is
+measured on its own:
+
+- holds --connections authenticated connections open and idle, each bound
+  to its own session, and reports the server's resident memory per
+  connection and how long they took to open
+- plays --turns sequential turns through POST /chat and the same number
+  over one WebSocket against a fake with no latency, so the difference is
+  the per-turn cost of the connection handling, authentication included
+- cancels --cancels replies after their first token, with the fake
+  streaming a token every --token-interval-ms, and reports how soon the
+  cancel is acknowledged
+
+    python bench_websocket.py --connections 10000 --turns 300
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.0
+
+def rss_bytes() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+# ---------------------------------------------------------------------------
+# Client side, run in a subprocess
+# ---------------------------------------------------------------------------
+
+def report(**values) -> None:
+    print(json.dumps(values), flush=True)
+
+async def open_chat(url: str, token: str, session_id: str = None):
+    from websockets.asyncio.client import connect
+
+    query = f"?session_id={session_id}" if session_id else ""
+    ws = await connect(f"{url}/ws/chat{query}", additional_headers={"Authorization": f"Bearer {token}"},
+                       max_queue=4, ping_interval=None)
+    ready = json.loads(await ws.recv())
+    assert ready["type"] == "ready", ready
+    return ws
+
+async def hold(url: str, connections: int) -> None:
+    """Open connections (a user each) and keep them idle until stdin closes."""
+    from fakes import make_token
+
+    opening = asyncio.Semaphore(64)
+    sockets = []
+
+    async def one(i: int) -> None:
+        async with opening:
+            sockets.append(await open_chat(url, make_token(user_id=f"ws-bench-{i}")))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(connections)))
+    report(opened=len(sockets), seconds=time.perf_counter() - start)
+    await asyncio.to_thread(sys.stdin.read)
+    await asyncio.gather(*(ws.close() for ws in sockets))
+
+async def turns(url: str, count: int) -> None:
+    """Time count /chat turns and count WebSocket turns, each in a session of its own."""
+    import httpx
+    from fakes import make_token
+
+    token = make_token(user_id="ws-bench-turns")
+    http = []
+    async with httpx.AsyncClient(base_url=url, headers={"Authorization": f"Bearer {token}"}) as client:
+        session_id = None
+        for i in range(count + 1):
+            start = time.perf_counter()
+            response = await client.post("/chat", json={"message": f"question {i}", "session_id": session_id})
+            response.raise_for_status()
+            http.append(time.perf_counter() - start)
+            session_id = response.json()["session_id"]
+
+    ws_turns = []
+    ws = await open_chat(url.replace("http", "ws", 1), token)
+    for i in range(count + 1):
+        start = time.perf_counter()
+        await ws.send(json.dumps({"type": "message", "content": f"question {i}"}))
+        while (event := json.loads(await ws.recv()))["type"] == "delta":
+            pass
+        assert event["type"] == "done", event
+        ws_turns.append(time.perf_counter() - start)
+    await ws.close()
+    # The first of each is a warm-up
+    report(http=http[1:], ws=ws_turns[1:])
+
+async def cancels(url: str, count: int) -> None:
+    from fakes import make_token
+
+    ws = await open_chat(url.replace("http", "ws", 1), make_token(user_id="ws-bench-cancel"))
+    acks = []
+    for i in range(count):
+        await ws.send(json.dumps({"type": "message", "content": f"long answer please {i}"}))
+        assert json.loads(await ws.recv())["type"] == "delta"
+        start = time.perf_counter()
+        await ws.send(json.dumps({"type": "cancel"}))
+        while (event := json.loads(await ws.recv()))["type"] == "delta":
+            pass
+        assert event["type"] == "cancelled", event
+        acks.append(time.perf_counter() - start)
+    await ws.close()
+    report(acks=acks)
+
+def client_main(args) -> None:
+    logging.disable(logging.CRITICAL)
+    ws_url = args.url.replace("http", "ws", 1)
+    if args.client == "hold":
+        asyncio.run(hold(ws_url, args.connections))
+    elif args.client == "turns":
+        asyncio.run(turns(args.url, args.turns))
+    else:
+        asyncio.run(cancels(args.url, args.cancels))
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+def spawn(url: str, mode: str, args) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--client", mode, "--url", url,
+         "--connections", str(args.connections), "--turns", str(args.turns), "--cancels", str(args.cancels)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def run_client(url: str, mode: str, args) -> dict:
+    client = spawn(url, mode, args)
+    output, _ = client.communicate()
+    if client.returncode:
+        raise SystemExit(f"client {mode} failed")
+    return json.loads(output.splitlines()[-1])
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--cancels", type=int, default=20)
+    parser.add_argument("--token-interval-ms", type=float, default=20.0, help="fake streaming pace for cancels")
+    parser.add_argument("--client", choices=("hold", "turns", "cancel"), help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client:
+        client_main(args)
+        return
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_websocket.db')}"
+    os.environ["AUTO_MIGRATE"] = "true"
+    os.environ.setdefault("WS_MAX_CONNECTIONS", str(args.connections + 10))
+    logging.disable(logging.CRITICAL)
+    import main
+    from openai import AsyncOpenAI
+    from fakes import FAKE_JWT_SECRET, AppServer, FakeOpenAI
+
+    main.LOCAL_JWT_SECRET = FAKE_JWT_SECRET
+    main.response_cache = None
+    main.upstream_scheduler = main.UpstreamScheduler(64, 0, 0, 30, 10000, 3, 0.05, 1.0)
+
+    with FakeOpenAI() as fake, AppServer(main.app, backlog=4096, ws_max_size=main.WS_MAX_MESSAGE_BYTES,
+                                               ws_per_message_deflate=main.WS_PER_MESSAGE_DEFLATE) as server:
+        main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1", max_retries=0)
+
+        timings = run_client(server.url, "turns", args)
+        fake.token_interval_ms = args.token_interval_ms
+        acks = run_client(server.url, "cancel", args)["acks"]
+        fake.token_interval_ms = 0
+
+        time.sleep(0.5)
+        before = rss_bytes()
+        client = spawn(server.url, "hold", args)
+        opened = json.loads(client.stdout.readline())
+        time.sleep(1.0)
+        held = rss_bytes()
+        stats = main.chat_connections.stats()
+        client.stdin.close()
+        client.wait()
+
+    print(f"Idle connections: {opened['opened']} opened in {opened['seconds']:.1f}s "
+          f"({opened['opened'] / opened['seconds']:.0f}/s), {stats['connections']} open on the server")
+    print(f"  server RSS {before / 2**20:.0f} MB -> {held / 2**20:.0f} MB, "
+          f"{(held - before) / max(1, stats['connections']) / 1024:.1f} KB per connection")
+
+    print(f"\n{len(timings['http'])} sequential turns, fake with no latency")
+    print(f"{'':<22} {'p50 ms':>7} {'p95 ms':>7} {'mean ms':>8}")
+    for label, samples in (("POST /chat", timings["http"]), ("WebSocket turn", timings["ws"])):
+        print(f"{label:<22} {percentile(samples, 50) * 1000:>7.2f} {percentile(samples, 95) * 1000:>7.2f} "
+              f"{sum(samples) / len(samples) * 1000:>8.2f}")
+
+    print(f"\nCancel after the first token ({args.token_interval_ms:g} ms per token): acknowledged in "
+          f"p50 {percentile(acks, 50) * 1000:.1f} ms, max {max(acks) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,121 @@
+"""Benchmark requests/sec per core, single-process development mode vs production workers.
+
+Launches `python main.py` the way it is deployed, once with RUN_MODE=development
+(one process, auto-reload) and once per --workers value with
+RUN_MODE=production, against the local Supabase/OpenAI fakes and a temporary
+SQLite database (or --database-url). Several client processes drive /chat
+for a fixed time after a warm-up.
+
+    python bench_workers.py --duration 20 --concurrency 64 --workers 2 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+from fakes import FAKE_JWT_SECRET, FakeOpenAI, make_token
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _drive(base_url: str, concurrency: int, duration: float) -> tuple:
+    headers = {"Authorization": f"Bearer {make_token()}"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    completed, errors = 0, 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal completed, errors
+        turn = 0
+        while time.perf_counter() < deadline:
+            turn += 1
+            try:
+                response = await client.post("/chat", json={"message": f"Turn {turn}: is my flight on time?"},
+                                             headers=headers)
+                response.raise_for_status()
+                completed += 1
+            except Exception:
+                errors += 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return completed, errors
+
+def _drive_in_process(base_url: str, concurrency: int, duration: float) -> tuple:
+    return asyncio.run(_drive(base_url, concurrency, duration))
+
+def load(pool: ProcessPoolExecutor, processes: int, base_url: str, concurrency: int, duration: float) -> tuple:
+    futures = [pool.submit(_drive_in_process, base_url, concurrency // processes, duration) for _ in range(processes)]
+    results = [future.result() for future in futures]
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+def run_mode(label: str, env: dict, args, pool: ProcessPoolExecutor, cores: int) -> None:
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "main.py"], env=dict(env, PORT=str(port)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            try:
+                if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                if server.poll() is not None:
+                    raise RuntimeError(f"{label}: server exited during startup")
+                time.sleep(0.05)
+
+        load(pool, args.client_processes, base_url, args.concurrency, args.warmup)
+        completed, errors = load(pool, args.client_processes, base_url, args.concurrency, args.duration)
+        rps = completed / args.duration
+        print(f"{label:<26} {rps:>9.1f} req/s  {rps / cores:>9.1f} req/s/core  errors={errors}")
+    finally:
+        server.terminate()
+        server.wait()
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1],
+                        help="production worker counts to try")
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent clients in total")
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per mode")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="fake OpenAI latency")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    cpus = os.cpu_count() or 1
+    pool = ProcessPoolExecutor(args.client_processes, mp_context=multiprocessing.get_context("spawn"))
+    with pool, FakeOpenAI(args.latency_ms) as fake_openai:
+        env = dict(
+            os.environ,
+            DATABASE_URL=args.database_url or f"sqlite:///{tmpdir}/bench_workers.db",
+            JWT_SECRET_KEY=FAKE_JWT_SECRET,
+            AUTH_VERIFY_MODE="local",
+            OPENAI_API_KEY="fake",
+            OPENAI_BASE_URL=fake_openai.url + "/v1",
+            RESPONSE_CACHE_ENABLED="false",
+        )
+        subprocess.run([sys.executable, "migrate.py"], env=env, capture_output=True, check=True)
+
+        print(f"/chat for {args.duration:.0f}s at {args.concurrency} concurrent clients, {cpus} CPU(s)")
+        run_mode("development (1 process)", dict(env, RUN_MODE="development"), args, pool, 1)
+        for workers in args.workers:
+            run_mode(f"production ({workers} workers)",
+                     dict(env, RUN_MODE="production", WEB_CONCURRENCY=str(workers)), args, pool,
+                     min(workers, cpus))
+
+if __name__ == "__main__":
+    main_cli()
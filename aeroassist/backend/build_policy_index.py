@@ -0,0 +1,45 @@
+"""Build the policy retrieval index from a directory of policy documents.
+
+Every .md and .txt file under the directory is split into chunks of about
+--chunk-words words, along paragraphs and Markdown headings, and indexed
+for BM25 into one memory-mappable file. Nothing leaves the machine. Running
+servers pick the new file up within POLICY_RELOAD_SECONDS:
+
+    python build_policy_index.py policies/
+    python build_policy_index.py policies/ --output /srv/aeroassist/policy.idx
+    python build_policy_index.py --query "can I take a stroller on board"
+"""
+
+import argparse
+import sys
+import time
+
+import main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?", help="directory of policy documents")
+    parser.add_argument("--output", default=main.POLICY_INDEX_PATH)
+    parser.add_argument("--chunk-words", type=int, default=main.POLICY_CHUNK_WORDS)
+    parser.add_argument("--query", help="print the top chunks for a question from the index")
+    parser.add_argument("--top-k", type=int, default=main.POLICY_TOP_K)
+    args = parser.parse_args()
+    if not args.source and not args.query:
+        parser.error("give a source directory, --query, or both")
+
+    if args.source:
+        start = time.perf_counter()
+        stats = main.build_policy_index(args.source, args.output, args.chunk_words)
+        if not stats["chunks"]:
+            print(f"No .md or .txt documents found under {args.source}")
+            sys.exit(1)
+        print(f"Indexed {stats['chunks']} chunks, {stats['terms']} terms into {args.output} "
+              f"({stats['bytes'] / 1024:.0f} KB) in {time.perf_counter() - start:.1f}s")
+
+    if args.query:
+        index = main.PolicyIndex(args.output)
+        start = time.perf_counter()
+        hits = index.search(args.query, args.top_k)
+        print(f"{len(hits)} chunks in {(time.perf_counter() - start) * 1000:.2f} ms")
+        for hit in hits:
+            print(f"\n{hit['score']:.2f}  {hit['source']} - {hit['heading']}\n{hit['text']}")
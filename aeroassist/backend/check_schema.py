@@ -20,9 +20,12 @@ if DATABASE_URL:
         
         print("=== Database Schema Check ===")
         
-        # Check if tables exist
+        # Check if tables exist (a partitioned chat_messages is a view on SQLite)
         tables = inspector.get_table_names()
+        views = inspector.get_view_names()
         print(f"Available tables: {tables}")
+        if views:
+            print(f"Available views: {views}")
         
         # Check chat_sessions table structure
         if 'chat_sessions' in tables:
@@ -32,29 +35,47 @@ if DATABASE_URL:
                 print(f"  {col['name']}: {col['type']}")
         
         # Check chat_messages table structure
-        if 'chat_messages' in tables:
+        if 'chat_messages' in tables + views:
             print("\n=== chat_messages table structure ===")
             columns = inspector.get_columns('chat_messages')
             for col in columns:
                 print(f"  {col['name']}: {col['type']}")
         
-        # Check if there are any data in the tables
+        # Row counts are estimates so this stays cheap on large tables:
+        # planner statistics on Postgres, the highest rowid on SQLite
+        def estimated_rows(conn, table):
+            if engine.dialect.name == "postgresql":
+                return conn.execute(text(
+                    "SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0)::BIGINT FROM pg_class "
+                    "WHERE oid = to_regclass(:t) OR oid IN "
+                    "(SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:t))"
+                ), {"t": table}).scalar()
+            return conn.execute(text(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}")).scalar()
+        
         with engine.connect() as conn:
-            # Check chat_sessions
-            result = conn.execute(text("SELECT COUNT(*) FROM chat_sessions"))
-            session_count = result.scalar()
-            print(f"\nchat_sessions count: {session_count}")
+            print(f"\nchat_sessions rows (estimated): {estimated_rows(conn, 'chat_sessions')}")
             
-            # Check chat_messages
-            result = conn.execute(text("SELECT COUNT(*) FROM chat_messages"))
-            message_count = result.scalar()
-            print(f"chat_messages count: {message_count}")
+            partitions = [name for name in tables if name.startswith("chat_messages_p")]
+            if partitions:
+                print(f"chat_messages partitions: {partitions}")
+                for name in partitions:
+                    print(f"  {name} rows (estimated): {estimated_rows(conn, name)}")
+            else:
+                print(f"chat_messages rows (estimated): {estimated_rows(conn, 'chat_messages')}")
             
-            # Show recent messages
-            if message_count > 0:
-                result = conn.execute(text("SELECT * FROM chat_messages ORDER BY id DESC LIMIT 5"))
+            # Show the latest messages of the most recently active session; with
+            # archived_at present both steps are index lookups
+            active = ("WHERE archived_at IS NULL"
+                      if 'archived_at' in [col['name'] for col in inspector.get_columns('chat_sessions')] else "")
+            result = conn.execute(text(
+                "SELECT * FROM chat_messages WHERE session_id = "
+                f"(SELECT id FROM chat_sessions {active} ORDER BY updated_at DESC LIMIT 1) "
+                "ORDER BY seq DESC LIMIT 5"
+            ))
+            rows = result.fetchall()
+            if rows:
                 print("\nRecent messages:")
-                for row in result:
+                for row in rows:
                     print(f"  {row}")
                     
     except Exception as e:
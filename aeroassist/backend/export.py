@@ -0,0 +1,42 @@
+"""Export a user's chat sessions and messages as NDJSON, streamed from the database.
+
+Same records as GET /export/{user_id}, for support and compliance requests
+handled outside the API. Memory use stays flat however long the history is:
+
+    python export.py USER_ID > history.ndjson
+    python export.py USER_ID --gzip --output history.ndjson.gz
+"""
+
+import argparse
+import asyncio
+import sys
+
+import main
+
+async def export(user_id: str, output, compress: bool) -> bool:
+    await main.init_database()
+    if main.engine is None:
+        return False
+    try:
+        async for chunk in main.ndjson_chunks(main.export_user_history(main.SessionLocal, user_id), compress):
+            output.write(chunk)
+    finally:
+        await main.engine.dispose()
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("user_id")
+    parser.add_argument("--output", help="file to write, defaults to stdout")
+    parser.add_argument("--gzip", action="store_true", help="gzip-compress the output")
+    args = parser.parse_args()
+    main.configure_logging()
+
+    if not main.ASYNC_DATABASE_URL:
+        print("No DATABASE_URL available", file=sys.stderr)
+        sys.exit(1)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    with output:
+        if not asyncio.run(export(args.user_id, output, args.gzip)):
+            print("Export failed - see the log above", file=sys.stderr)
+            sys.exit(1)
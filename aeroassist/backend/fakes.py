@@ -0,0 +1,422 @@
+"""Local stand-ins for the external services used by the AeroAssist backend.
+
+These run on 127.0.0.1 in a background thread so benchmarks can exercise
+main.py without touching live Supabase or OpenAI. They are not used by the
+application itself.
+"""
+
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Union
+
+from jose import jwt
+
+FAKE_JWT_SECRET = "fake-supabase-jwt-secret"
+
+def make_token(user_id: Optional[str] = None, email: str = "traveller@example.com",
+               expires_in: int = 3600, secret: str = FAKE_JWT_SECRET, audience: str = "authenticated",
+               algorithm: str = "HS256", kid: Optional[str] = None) -> str:
+    """Mint a Supabase-style access token, signed with HS256 unless given an ES256 key and its kid."""
+    now = int(time.time())
+    claims = {
+        "sub": user_id or str(uuid.uuid4()),
+        "email": email,
+        "role": "authenticated",
+        "aud": audience,
+        "iat": now,
+        "exp": now + expires_in,
+    }
+    return jwt.encode(claims, secret, algorithm=algorithm, headers={"kid": kid} if kid else None)
+
+def make_service_role_key(secret: str = FAKE_JWT_SECRET) -> str:
+    """Mint a service-role key; supabase-py rejects keys that aren't JWT-shaped."""
+    return jwt.encode({"role": "service_role", "iss": "supabase"}, secret, algorithm="HS256")
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (cancelled or hedged calls) are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionError, socket.timeout)):
+            super().handle_error(request, client_address)
+
+def lognormal_latency(median_ms: float, sigma: float = 0.5, seed: Optional[int] = None) -> Callable[[], float]:
+    """Latency sampler (ms) with a lognormal body and a long right tail."""
+    rng = random.Random(seed)
+    return lambda: rng.lognormvariate(0, sigma) * median_ms
+
+def stall_latency(base: Callable[[], float], stall_ms: float, share: float,
+                  seed: Optional[int] = None) -> Callable[[], float]:
+    """Latency sampler (ms) that adds stall_ms to a share of the samples drawn from base."""
+    rng = random.Random(seed)
+    return lambda: base() + (stall_ms if rng.random() < share else 0.0)
+
+class _FakeServer:
+    """Run a handler class on an ephemeral local port for the life of a `with` block."""
+
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self, latency_ms: Union[float, Callable[[], float]] = 0.0):
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "_FakeServer":
+        fake = self
+
+        class Handler(self.handler_class):
+            server_fake = fake
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def wait(self) -> None:
+        """Count a request and sleep for its latency, fixed or drawn from a sampler."""
+        self.requests += 1
+        latency_ms = self.latency_ms() if callable(self.latency_ms) else self.latency_ms
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+
+class _SupabaseAuthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, code: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server_fake.wait()
+        if self.path.rstrip("/") == "/auth/v1/.well-known/jwks.json":
+            self.server_fake.jwks_requests += 1
+            self._send_json(200, {"keys": self.server_fake.jwks})
+            return
+        if self.path.rstrip("/") != "/auth/v1/user":
+            self._send_json(404, {"msg": "not found"})
+            return
+
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        try:
+            claims = jwt.decode(token, FAKE_JWT_SECRET, algorithms=["HS256"], audience="authenticated")
+        except Exception:
+            self._send_json(401, {"msg": "invalid JWT"})
+            return
+
+        self._send_json(200, {
+            "id": claims["sub"],
+            "aud": "authenticated",
+            "role": claims.get("role", "authenticated"),
+            "email": claims.get("email"),
+            "app_metadata": {},
+            "user_metadata": {},
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        })
+
+class FakeSupabaseAuth(_FakeServer):
+    """Answers `GET /auth/v1/user` for tokens minted by make_token(), and
+    serves `jwks` (public JWKs, e.g. from make_signing_key()) as the project's JWKS."""
+
+    handler_class = _SupabaseAuthHandler
+
+    def __init__(self, latency_ms: Union[float, Callable[[], float]] = 0.0):
+        super().__init__(latency_ms)
+        self.jwks: list = []
+        self.jwks_requests = 0
+
+def make_signing_key(kid: str) -> tuple:
+    """An ES256 key pair; returns (private PEM for make_token, public JWK for FakeSupabaseAuth.jwks)."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from jose import jwk
+
+    private = ec.generate_private_key(ec.SECP256R1())
+    private_pem = private.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                        serialization.NoEncryption()).decode()
+    public_pem = private.public_key().public_bytes(serialization.Encoding.PEM,
+                                                   serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private_pem, dict(jwk.construct(public_pem, "ES256").to_dict(), kid=kid, use="sig", alg="ES256")
+
+FAKE_REPLY = ("Your checked baggage allowance on economy fares is one bag up to 23 kg. "
+              "Cabin baggage is limited to one carry-on and one personal item.")
+
+def _response_object(text: str, input_tokens: int, output_tokens: int, model: str) -> dict:
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "usage": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+def _prompt_item(item) -> tuple:
+    """(digest, tokens) of one prompt item, at ~4 characters per token."""
+    text = json.dumps(item, sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=8).digest(), max(1, len(text) // 4)
+
+class _OpenAIResponsesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_event(self, payload: dict) -> None:
+        chunk = f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode()
+        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        fake = self.server_fake
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        fake.bodies.append(body)
+        if not fake.admit():
+            self._send_rate_limited()
+            return
+        try:
+            self._respond(fake, body)
+        finally:
+            fake.release()
+
+    def _send_error(self, code: int, error: dict) -> None:
+        payload = json.dumps({"error": error}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_server_error(self) -> None:
+        self._send_error(500, {
+            "message": "The server had an error processing your request", "type": "server_error",
+            "param": None, "code": None,
+        })
+
+    def _send_rate_limited(self) -> None:
+        fake = self.server_fake
+        payload = json.dumps({"error": {
+            "message": "Rate limit reached", "type": "requests", "param": None, "code": "rate_limit_exceeded",
+        }}).encode()
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Retry-After", f"{fake.retry_after:g}")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _respond(self, fake, body: dict) -> None:
+        fake.wait()
+        if fake.fail():
+            self._send_server_error()
+            return
+
+        if self.path.rstrip("/") != "/v1/responses":
+            self.send_error(404)
+            return
+
+        # The prompt is the instructions, then a stored conversation being
+        # continued, then the new input items
+        items = body.get("input", "")
+        items = [items] if isinstance(items, str) else items
+        conversation = [_prompt_item(item) for item in items]
+        previous = body.get("previous_response_id")
+        if previous:
+            with fake._lock:
+                stored = fake.stored.get(previous)
+            if stored is None:
+                self._send_error(400, {
+                    "message": f"Previous response with id '{previous}' not found.",
+                    "type": "invalid_request_error", "param": "previous_response_id",
+                    "code": "previous_response_not_found",
+                })
+                return
+            conversation = stored + conversation
+        prompt = [_prompt_item(body.get("instructions") or "")] + conversation
+        input_tokens, cached_tokens = fake.prefill(prompt)
+
+        words = fake.reply.split(" ")
+        deltas = [w + (" " if i < len(words) - 1 else "") for i, w in enumerate(words)]
+        response = _response_object(fake.reply, input_tokens, len(deltas), body.get("model", ""))
+        response["usage"]["input_tokens_details"] = {"cached_tokens": cached_tokens}
+        if body.get("store", True):
+            with fake._lock:
+                fake.stored[response["id"]] = conversation + [_prompt_item({"role": "assistant", "content": fake.reply})]
+
+        if not body.get("stream"):
+            time.sleep(fake.token_interval_ms * len(deltas) / 1000)
+            payload = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        created = dict(response, status="in_progress", output=[], usage=None)
+        self._send_event({"type": "response.created", "sequence_number": 0, "response": created})
+        item_id = response["output"][0]["id"]
+        for seq, delta in enumerate(deltas, start=1):
+            self._send_event({
+                "type": "response.output_text.delta", "sequence_number": seq, "item_id": item_id,
+                "output_index": 0, "content_index": 0, "delta": delta, "logprobs": [],
+            })
+            if fake.token_interval_ms:
+                time.sleep(fake.token_interval_ms / 1000)
+        self._send_event({"type": "response.completed", "sequence_number": len(deltas) + 1, "response": response})
+        self.wfile.write(b"0\r\n\r\n")
+
+class FakeOpenAI(_FakeServer):
+    """Serves `POST /v1/responses`, streaming or not, with configurable timing.
+
+    latency_ms is the delay before the first byte (time to first token),
+    either fixed or a callable drawing one per request (lognormal_latency,
+    stall_latency), and token_interval_ms the gap between streamed deltas.
+    With max_concurrency set, requests beyond that many in flight get a 429
+    with Retry-After, counted in `throttled`; failure_rate is the share
+    answered with a 500 after the latency, counted in `failed`. Responses
+    are stored unless the request says `store: false`, and can be continued
+    with previous_response_id until forget() drops them. Prompt tokens,
+    stored ones included, take prefill_ms_per_1k_tokens each, except a
+    prefix of at least PROMPT_CACHE_MIN_TOKENS already seen in an earlier
+    prompt, which is cached as OpenAI's prompt caching would; each prompt's
+    (input tokens, cached tokens) is appended to `prompts`. Point the SDK at
+    it with `base_url=fake.url + "/v1"`.
+    """
+
+    handler_class = _OpenAIResponsesHandler
+
+    def __init__(self, latency_ms: Union[float, Callable[[], float]] = 0.0, token_interval_ms: float = 0.0,
+                 reply: str = FAKE_REPLY, max_concurrency: Optional[int] = None, retry_after: float = 1.0,
+                 failure_rate: float = 0.0, seed: Optional[int] = None, prefill_ms_per_1k_tokens: float = 0.0):
+        super().__init__(latency_ms)
+        self.token_interval_ms = token_interval_ms
+        self.reply = reply
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.bodies: list = []
+        self.throttled = 0
+        self.failure_rate = failure_rate
+        self.failed = 0
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self.stored: Dict[str, list] = {}
+        self.prompts: list = []
+        self._prefixes: set = set()
+        self._rng = random.Random(seed)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        with self._lock:
+            if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+                self.throttled += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def prefill(self, prompt: list) -> tuple:
+        """Account for and wait out the prefill of a prompt; returns (input tokens, cached tokens)."""
+        prefix = b""
+        tokens = cached = 0
+        with self._lock:
+            for digest, item_tokens in prompt:
+                prefix = hashlib.blake2b(prefix + digest, digest_size=8).digest()
+                tokens += item_tokens
+                if prefix in self._prefixes:
+                    cached = tokens
+                self._prefixes.add(prefix)
+            cached = cached if cached >= PROMPT_CACHE_MIN_TOKENS else 0
+            self.prompts.append((tokens, cached))
+        if self.prefill_ms_per_1k_tokens:
+            time.sleep(self.prefill_ms_per_1k_tokens * (tokens - cached) / 1_000_000)
+        return tokens, cached
+
+    def forget(self) -> None:
+        """Drop every stored response, as if they had expired."""
+        with self._lock:
+            self.stored.clear()
+
+    def fail(self) -> bool:
+        with self._lock:
+            if self.failure_rate and self._rng.random() < self.failure_rate:
+                self.failed += 1
+                return True
+            return False
+
+class AppServer:
+    """Serve an ASGI app with uvicorn on an ephemeral local port in a background thread."""
+
+    def __init__(self, app, **uvicorn_options):
+        import uvicorn
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", **uvicorn_options)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "AppServer":
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
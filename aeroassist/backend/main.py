@@ -1,40 +1,251 @@
 """AeroAssist Backend - Complete consolidated FastAPI application."""
 
 import logging
+import atexit
+import queue
 import uuid
 import os
-from datetime import datetime
-from typing import List, Optional, Dict, Any
-from contextlib import asynccontextmanager
+import time
+import hashlib
+import threading
+import asyncio
+import gzip
+import sqlite3
+import struct
+import zlib
+import collections
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager, closing
+from contextvars import ContextVar
 import json
+import base64
+import bisect
+import re
+import heapq
+import itertools
+import math
+import mmap
+import random
+import sys
+from email.utils import parsedate_to_datetime
+from logging.handlers import QueueHandler, QueueListener
 
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy import create_engine, text, Column, String, DateTime, Text, Integer, func, ForeignKey
+from sqlalchemy import DDL, event, text, select, insert, update, delete, bindparam, case, tuple_, Boolean, Column, String, DateTime, Text, Integer, BigInteger, Index, func, ForeignKey, MetaData, CheckConstraint
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import OperationalError
 from pydantic import BaseModel
 from jose import JWTError, jwt
-from supabase import create_client, Client
-import openai
-import uvicorn
+import httpx
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+# Log calls only put the record on a queue; a listener thread formats and
+# writes it, so request handlers never wait on log I/O. LOG_FORMAT is json
+# (one object per line) or text.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Share of per-request hot-path messages kept, by level, e.g. "debug=0,info=0.05";
+# levels not listed keep every message
+LOG_SAMPLE_RATES = {
+    logging.getLevelName(level.strip().upper()): float(rate)
+    for level, rate in (item.split("=") for item in os.getenv("LOG_SAMPLE_RATES", "info=0.1").split(",") if item.strip())
+}
+
+# Correlates log lines with the request being handled; set by RequestIdMiddleware
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_CONFIGURED_SECRETS = tuple(
+    value for value in (os.getenv(name) for name in ("OPENAI_API_KEY", "SUPABASE_SERVICE_ROLE_KEY", "JWT_SECRET_KEY"))
+    if value and len(value) >= 8
+)
+_SECRET_PATTERNS = (
+    (re.compile(r"eyJ[\w-]*\.[\w-]+\.[\w-]*"), "[REDACTED]"),  # JWTs
+    (re.compile(r"(?i)\b(bearer\s+)[\w.~+/-]+=*"), r"\1[REDACTED]"),
+    (re.compile(r"\bsk-[\w-]{8,}"), "[REDACTED]"),  # OpenAI keys
+    (re.compile(r"(://[^:/@\s]+:)[^@\s]+@"), r"\1[REDACTED]@"),  # passwords in URLs
+    (re.compile(r"(?i)\b((?:password|secret|api[_-]?key|access[_-]?token)[\"']?\s*[:=]\s*[\"']?)[^\s\"',}]+"), r"\1[REDACTED]"),
+)
+
+def redact(text: str) -> str:
+    """Mask configured secrets and anything shaped like a token, key or password."""
+    for secret in _CONFIGURED_SECRETS:
+        text = text.replace(secret, "[REDACTED]")
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, secrets redacted."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "sample_rate", None):
+            entry["sample_rate"] = record.sample_rate
+        if record.exc_info:
+            entry["exc_info"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The basicConfig layout plus the request ID, secrets redacted."""
+
+    def __init__(self):
+        super().__init__("%(levelname)s:%(name)s:%(request_id)s:%(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not getattr(record, "request_id", None):
+            record.request_id = "-"
+        return redact(super().format(record))
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener unformatted, dropping them past max_size queued.
+
+    The stock QueueHandler formats each message on the calling thread so
+    the record can be pickled; this queue never leaves the process, so
+    formatting is left to the listener. Only the request ID is captured
+    here, since the listener thread can't see the request's context.
+    SimpleQueue is unbounded but its put is a single C call, so the bound
+    is checked here instead.
+    """
+
+    def __init__(self, log_queue: "queue.SimpleQueue", max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.max_size and self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+log_handler = NonBlockingQueueHandler(queue.SimpleQueue(), LOG_QUEUE_SIZE)
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+log_listener = QueueListener(log_handler.queue, _log_output)
+_logging_configured = False
 logger = logging.getLogger(__name__)
 
+def configure_logging() -> None:
+    """Send the process's logging through the queue and start the listener thread.
+
+    Called by lifespan and the command-line tools rather than at import, so
+    importing this module leaves the host's logging alone. Safe to call twice.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    # Neither format uses the caller, thread or process fields, so skip collecting
+    # them for every record (see "Optimization" in the logging HOWTO)
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.basicConfig(level=LOG_LEVEL, handlers=[log_handler])
+    # httpx logs every upstream request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    log_listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(stop_logging)
+
+def stop_logging() -> None:
+    """Write out whatever is still queued and stop the listener thread."""
+    global _logging_configured
+    if not _logging_configured:
+        return
+    _logging_configured = False
+    log_listener.stop()
+    logging.getLogger().removeHandler(log_handler)
+
+def log_sampled(level: int, msg: str, *args) -> None:
+    """Log a per-request hot-path message, keeping LOG_SAMPLE_RATES of them at its level."""
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE_RATES.get(level, 1.0)
+    if rate < 1.0:
+        if random.random() >= rate:
+            return
+        logger.log(level, msg, *args, extra={"sample_rate": rate})
+    else:
+        logger.log(level, msg, *args)
+
+_REQUEST_ID_PATTERN = re.compile(r"[\w.:-]{1,128}")
+
+class RequestIdMiddleware:
+    """Give each request an ID for its log lines and echo it in X-Request-ID.
+
+    A well-formed X-Request-ID from the client or a proxy is kept, so logs
+    can be followed across services.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _REQUEST_ID_PATTERN.fullmatch(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        header = (b"x-request-id", request_id.encode())
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [header])
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 # Supabase Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -45,6 +256,23 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Token verification mode: "local" validates Supabase JWTs in-process against
+# JWT_SECRET_KEY (HS256) or the project's JWKS, "remote" asks Supabase Auth.
+# Either way verified claims are cached, so the network is only hit on a miss.
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local").lower()
+LOCAL_JWT_SECRET = JWT_SECRET_KEY if os.getenv("JWT_SECRET_KEY") else None
+JWT_AUDIENCE = os.getenv("JWT_AUDIENCE", "authenticated")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or (
+    f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None
+)
+JWKS_CACHE_TTL_SECONDS = int(os.getenv("JWKS_CACHE_TTL_SECONDS", 600))
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", 300))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000))
+
+# Operational endpoints (e.g. dropping cached answers) are open to tokens with
+# the service_role role and to these user ids (comma-separated)
+ADMIN_USER_IDS = frozenset(filter(None, (part.strip() for part in os.getenv("ADMIN_USER_IDS", "").split(","))))
+
 # Database Configuration - Use Supabase PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -61,8 +289,187 @@ if not DATABASE_URL:
             logger.warning("SUPABASE_SERVICE_ROLE_KEY not set - cannot construct DATABASE_URL")
             DATABASE_URL = None
 
+def to_async_database_url(url: str) -> str:
+    """Map a sync database URL onto its async driver (asyncpg / aiosqlite)."""
+    scheme, _, rest = url.partition("://")
+    if scheme in ("postgres", "postgresql", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+ASYNC_DATABASE_URL = to_async_database_url(DATABASE_URL) if DATABASE_URL else None
+
+# Create missing tables at startup. Off by default: run `python migrate.py`
+# (or supabase_tables.sql) once per deployment instead.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+
+# Context window: the prompt sent per turn is capped at CONTEXT_TOKEN_BUDGET.
+# Recent turns are kept verbatim, older ones are folded into a rolling summary
+# of at most CONTEXT_SUMMARY_TOKENS.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 400))
+CONTEXT_SUMMARY_CACHE_SIZE = int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", 10000))
+
+# Hot conversation cache: the last CONVERSATION_CACHE_WINDOW messages of
+# recently active sessions, kept in process (or in Redis when
+# CONVERSATION_CACHE_URL is set, so all workers share one copy)
+CONVERSATION_CACHE_WINDOW = int(os.getenv("CONVERSATION_CACHE_WINDOW", 200))
+CONVERSATION_CACHE_MAX_SESSIONS = int(os.getenv("CONVERSATION_CACHE_MAX_SESSIONS", 5000))
+CONVERSATION_CACHE_MAX_BYTES = int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CONVERSATION_CACHE_TTL_SECONDS = int(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", 1800))
+CONVERSATION_CACHE_URL = os.getenv("CONVERSATION_CACHE_URL")
+
+# Persistence: "sync" commits every write on the request path, "write_behind"
+# queues writes and bulk-inserts them from a background task every
+# WRITE_BEHIND_FLUSH_MS or WRITE_BEHIND_BATCH_ROWS rows, whichever comes first.
+# Queued writes are also appended to WRITE_BEHIND_SPILL_PATH (if set) and
+# replayed at startup, so a crash doesn't lose them. A batch the database
+# keeps refusing is retried WRITE_BEHIND_MAX_RETRIES times, then written row
+# by row; rows that still fail are appended to WRITE_BEHIND_REJECT_PATH, in
+# the spill file's format, instead of holding up every later write.
+PERSISTENCE_MODE = os.getenv("PERSISTENCE_MODE", "sync").lower()
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", 50))
+WRITE_BEHIND_BATCH_ROWS = int(os.getenv("WRITE_BEHIND_BATCH_ROWS", 500))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", 10000))
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH")
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 5))
+WRITE_BEHIND_REJECT_PATH = os.getenv("WRITE_BEHIND_REJECT_PATH", "write_behind.rejected.ndjson")
+
+# Retention: archive.py moves the messages of sessions idle for
+# ARCHIVE_AFTER_DAYS into NDJSON.gz files under ARCHIVE_DIR (shared storage
+# when there are several hosts); they are restored on the session's next
+# read. When chat_messages is partitioned by month, the job also keeps
+# MESSAGE_PARTITIONS_AHEAD months of partitions ready and drops emptied ones.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_BATCH_SESSIONS = int(os.getenv("ARCHIVE_BATCH_SESSIONS", 500))
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", 2))
+
+# Answer cache for first-turn questions with no history. Exact matching on
+# normalized text, plus MinHash near-duplicate matching when enabled.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000))
+RESPONSE_CACHE_NEAR_DUPLICATES = os.getenv("RESPONSE_CACHE_NEAR_DUPLICATES", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.8))
+
+# Policy retrieval: build_policy_index.py compiles a directory of policy
+# documents into the BM25 index at POLICY_INDEX_PATH. Each turn gets the top
+# POLICY_TOP_K chunks scoring at least POLICY_MIN_SCORE, up to
+# POLICY_CONTEXT_TOKENS, added to its instructions. The file is checked every
+# POLICY_RELOAD_SECONDS and a rebuilt index is swapped in without a restart.
+POLICY_INDEX_PATH = os.getenv("POLICY_INDEX_PATH", "policy.idx")
+POLICY_TOP_K = int(os.getenv("POLICY_TOP_K", 3))
+POLICY_MIN_SCORE = float(os.getenv("POLICY_MIN_SCORE", 1.0))
+POLICY_CONTEXT_TOKENS = int(os.getenv("POLICY_CONTEXT_TOKENS", 600))
+POLICY_RELOAD_SECONDS = float(os.getenv("POLICY_RELOAD_SECONDS", 10))
+
+# Share one upstream OpenAI call between identical concurrent requests
+LLM_COALESCING_ENABLED = os.getenv("LLM_COALESCING_ENABLED", "true").lower() == "true"
+
+# Upstream scheduling of OpenAI calls (per worker; 0 disables a rate limit)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 64))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 200000))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 300))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 10))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 1000))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20))
+
+# Model routing: LLM_ROUTES lists the models to use in order, comma-separated,
+# each as model[@base_url][=timeout_seconds] (base_url for another
+# OpenAI-compatible endpoint taking the same key). A call fails over to the
+# next route when one errors or times out. With hedging on, a duplicate goes
+# to the next route (the same one if there is only one) once the first has
+# run past that route's LLM_HEDGE_PERCENTILE latency; the first answer wins
+# and the other is cancelled. At most LLM_HEDGE_MAX_RATIO of calls are
+# hedged. A route whose recent error share reaches LLM_ROUTE_ERROR_THRESHOLD
+# is tried last for LLM_ROUTE_COOLDOWN_SECONDS.
+LLM_ROUTES = os.getenv("LLM_ROUTES") or OPENAI_MODEL
+LLM_ROUTE_TIMEOUT_SECONDS = float(os.getenv("LLM_ROUTE_TIMEOUT_SECONDS", 30))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", 0.05))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", 0.1))
+LLM_ROUTE_ERROR_THRESHOLD = float(os.getenv("LLM_ROUTE_ERROR_THRESHOLD", 0.5))
+LLM_ROUTE_COOLDOWN_SECONDS = float(os.getenv("LLM_ROUTE_COOLDOWN_SECONDS", 30))
+
+# Server-side conversation state: with LLM_CHAIN_RESPONSES on, replies are
+# stored by OpenAI and a turn sends only the new message, continuing from
+# the session's last response with previous_response_id. The context is
+# rebuilt from the database instead (and a new chain started) when there is
+# no usable chain: a new session, a reply from the answer cache or from a
+# route with its own base_url, a last turn older than LLM_CHAIN_MAX_AGE_DAYS
+# (OpenAI keeps stored responses for 30 days), a chained prompt that grew
+# past LLM_CHAIN_MAX_INPUT_TOKENS, or a chain OpenAI no longer knows. A
+# chained prompt is the whole stored conversation, so it is billed and rate
+# limited in full even though most of it comes from the prompt cache.
+LLM_CHAIN_RESPONSES = os.getenv("LLM_CHAIN_RESPONSES", "false").lower() == "true"
+LLM_CHAIN_MAX_AGE_DAYS = float(os.getenv("LLM_CHAIN_MAX_AGE_DAYS", 29))
+LLM_CHAIN_MAX_INPUT_TOKENS = int(os.getenv("LLM_CHAIN_MAX_INPUT_TOKENS") or 2 * CONTEXT_TOKEN_BUDGET)
+
+# WebSocket chat (/ws/chat): a connection authenticates once and carries any
+# number of turns. Its token's expiry is checked every WS_AUTH_CHECK_SECONDS
+# (clients send a fresh token to stay connected). Limits are per worker:
+# WS_MAX_CONNECTIONS in all, WS_MAX_CONNECTIONS_PER_USER per user. Each
+# connection keeps at most WS_MAX_HISTORY_BYTES of conversation in memory,
+# oldest messages first to go, takes frames of up to WS_MAX_MESSAGE_BYTES,
+# and is closed after WS_IDLE_TIMEOUT_SECONDS without any frame.
+# WS_PER_MESSAGE_DEFLATE compresses frames, at some 250 KB of zlib state per
+# connection for token deltas that barely compress; off unless set.
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", 10000))
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", 5))
+WS_MAX_HISTORY_BYTES = int(os.getenv("WS_MAX_HISTORY_BYTES", 64 * 1024))
+WS_MAX_MESSAGE_BYTES = int(os.getenv("WS_MAX_MESSAGE_BYTES", 16 * 1024))
+WS_AUTH_TIMEOUT_SECONDS = float(os.getenv("WS_AUTH_TIMEOUT_SECONDS", 10))
+WS_AUTH_CHECK_SECONDS = float(os.getenv("WS_AUTH_CHECK_SECONDS", 30))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", 900))
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "false").lower() == "true"
+
+# Batch chat jobs (/chat/batch, batch.py): a JSONL file of prompts, spooled
+# under BATCH_SPOOL_DIR (shared by the workers), read a line at a time and
+# answered BATCH_CONCURRENCY at a time, behind interactive turns. Results are
+# inserted BATCH_FLUSH_ROWS at a time (or every BATCH_FLUSH_SECONDS) with the
+# job's checkpoint in the same commit. A job whose worker stops renewing its
+# BATCH_LEASE_SECONDS lease is resumed from its checkpoint by another one.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_FLUSH_ROWS = int(os.getenv("BATCH_FLUSH_ROWS", 500))
+BATCH_FLUSH_SECONDS = float(os.getenv("BATCH_FLUSH_SECONDS", 5))
+BATCH_LEASE_SECONDS = float(os.getenv("BATCH_LEASE_SECONDS", 60))
+BATCH_SPOOL_DIR = os.getenv("BATCH_SPOOL_DIR", "batches")
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 512 * 1024 * 1024))
+BATCH_MAX_PROMPT_BYTES = int(os.getenv("BATCH_MAX_PROMPT_BYTES", 32 * 1024))
+
+# Per-user usage ledger and quotas (per worker; 0 disables a quota). Token
+# and turn counts are flushed to the usage rollup tables every USAGE_FLUSH_SECONDS.
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", 30))
+USER_REQUESTS_PER_MINUTE = int(os.getenv("USER_REQUESTS_PER_MINUTE", 0))
+USER_TOKENS_PER_DAY = int(os.getenv("USER_TOKENS_PER_DAY", 0))
+USAGE_TRACKED_USERS = int(os.getenv("USAGE_TRACKED_USERS", 100000))
+
+# Metrics: report per-stage timings of each request in a Server-Timing header
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
 # Server Configuration
 PORT = int(os.getenv("PORT", 8000))
+# development: one process with auto-reload; production: WEB_CONCURRENCY workers
+RUN_MODE = os.getenv("RUN_MODE", "development").lower()
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY") or ((os.cpu_count() or 1) if RUN_MODE == "production" else 1))
+
+# Database connection pool. DB_CONNECTION_BUDGET is the total across all
+# workers; each worker's pool gets an equal share unless DB_POOL_SIZE is set.
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", 20))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or max(1, DB_CONNECTION_BUDGET // WEB_CONCURRENCY))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 0))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 300))
+
+# Keep-alive connections to OpenAI, per worker
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", 30))
 
 # CORS Configuration
 ALLOWED_ORIGINS = [
@@ -70,22 +477,665 @@ ALLOWED_ORIGINS = [
     "https://aeroassist-chatbot-frontend.onrender.com"
 ]
 
+# ============================================================================
+# CACHING
+# ============================================================================
+
+class TTLCache:
+    """Thread-safe bounded LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl_seconds if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class ConversationStore(ABC):
+    """Per-session window of recent messages, oldest first.
+
+    Messages are dicts with seq, role and content. Implementations only have
+    to be a cache: get() returning None means "load from the database".
+    `total` is the session's message_count. A store that only sees this
+    process's writes keeps the count it was filled at and treats a different
+    one as a miss, so turns served by another worker are never left out.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    async def get(self, session_id: str, total: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    async def set(self, session_id: str, messages: List[Dict[str, Any]], total: Optional[int] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        """Add messages to a session that is already cached; no-op otherwise."""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+class InMemoryConversationStore(ConversationStore):
+    """In-process LRU bounded by session count and approximate bytes, with TTL."""
+
+    MESSAGE_OVERHEAD_BYTES = 100
+
+    def __init__(self, window: int, max_sessions: int, max_bytes: int, ttl_seconds: float):
+        super().__init__(window)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self.stale = 0
+        self.bytes = 0
+        # session_id -> [expires_at, size_bytes, messages, message_count or None]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+
+    def _size(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(len(m["content"]) + self.MESSAGE_OVERHEAD_BYTES for m in messages)
+
+    def _store(self, session_id: str, messages: List[Dict[str, Any]], total: Optional[int]) -> None:
+        self._drop(session_id)
+        messages = messages[-self.window:]
+        size = self._size(messages)
+        self._entries[session_id] = [time.monotonic() + self.ttl_seconds, size, messages, total]
+        self.bytes += size
+        while self._entries and (len(self._entries) > self.max_sessions or self.bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry:
+            self.bytes -= entry[1]
+
+    async def get(self, session_id: str, total: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(session_id)
+        stale = entry is not None and None not in (total, entry[3]) and entry[3] != total
+        if entry is None or stale or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._drop(session_id)
+            self.stale += stale
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return list(entry[2])
+
+    async def set(self, session_id: str, messages: List[Dict[str, Any]], total: Optional[int] = None) -> None:
+        self._store(session_id, list(messages), total)
+
+    async def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            total = entry[3] + len(messages) if entry[3] is not None else None
+            self._store(session_id, entry[2] + list(messages), total)
+
+    async def delete(self, session_id: str) -> None:
+        self._drop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), sessions=len(self._entries), bytes=self.bytes, evictions=self.evictions,
+                    stale=self.stale)
+
+class RedisConversationStore(ConversationStore):
+    """Shared store for multi-worker deployments: one Redis list per session.
+
+    `client` is a `redis.asyncio.Redis` (or anything with the same list
+    commands), created with decode_responses=True.
+    """
+
+    def __init__(self, client: Any, window: int, ttl_seconds: int, prefix: str = "aeroassist:conversation:"):
+        super().__init__(window)
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    async def get(self, session_id: str, total: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        # Every worker writes through to the same list, so it is never behind
+        items = await self.client.lrange(self.prefix + session_id, 0, -1)
+        if not items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [json.loads(item) for item in items]
+
+    async def _push(self, key: str, messages: List[Dict[str, Any]], only_if_exists: bool) -> None:
+        pipe = self.client.pipeline()
+        values = [json.dumps(m) for m in messages]
+        if only_if_exists:
+            pipe.rpushx(key, *values)
+        else:
+            pipe.delete(key)
+            pipe.rpush(key, *values)
+        pipe.ltrim(key, -self.window, -1)
+        pipe.expire(key, self.ttl_seconds)
+        await pipe.execute()
+
+    async def set(self, session_id: str, messages: List[Dict[str, Any]], total: Optional[int] = None) -> None:
+        # Redis can't hold an empty list; an empty session simply misses
+        if messages:
+            await self._push(self.prefix + session_id, messages, only_if_exists=False)
+
+    async def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        if messages:
+            await self._push(self.prefix + session_id, messages, only_if_exists=True)
+
+    async def delete(self, session_id: str) -> None:
+        await self.client.delete(self.prefix + session_id)
+
+def create_conversation_store() -> ConversationStore:
+    """Use Redis when CONVERSATION_CACHE_URL is set and redis is installed, else memory."""
+    if CONVERSATION_CACHE_URL:
+        try:
+            import redis.asyncio as redis_asyncio
+            client = redis_asyncio.from_url(CONVERSATION_CACHE_URL, decode_responses=True)
+            logger.info("Using shared Redis conversation cache")
+            return RedisConversationStore(client, CONVERSATION_CACHE_WINDOW, CONVERSATION_CACHE_TTL_SECONDS)
+        except ImportError:
+            logger.warning("CONVERSATION_CACHE_URL set but redis is not installed - using in-process cache")
+    return InMemoryConversationStore(
+        CONVERSATION_CACHE_WINDOW,
+        CONVERSATION_CACHE_MAX_SESSIONS,
+        CONVERSATION_CACHE_MAX_BYTES,
+        CONVERSATION_CACHE_TTL_SECONDS
+    )
+
+conversation_store = create_conversation_store()
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+class ResponseCache:
+    """Answers to context-free questions, with TTL and LRU size eviction.
+
+    Lookups match the normalized question exactly, whoever asked it. With
+    near_duplicates on, a miss falls back to MinHash over word unigrams and
+    bigrams, bucketed by LSH bands, and accepts the closest entry whose
+    estimated Jaccard similarity reaches `similarity`. Near matches only
+    come from the same owner's questions: a differently worded question can
+    carry different details, and one user must not get another's answer to
+    it. Everything is local; no embedding calls.
+    """
+
+    NUM_PERMUTATIONS = 64
+    BAND_SIZE = 4
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, max_entries: int, ttl_seconds: float, near_duplicates: bool = False,
+                 similarity: float = 0.8, namespace: str = ""):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_duplicates = near_duplicates
+        self.similarity = similarity
+        self.namespace = namespace
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # key -> (expires_at, reply, signature, owner)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bands: Dict[tuple, set] = {}
+        seeds = [hashlib.blake2b(f"{namespace}{i}".encode(), digest_size=16).digest() for i in range(self.NUM_PERMUTATIONS)]
+        self._permutations = [
+            (int.from_bytes(seed[:8], "little") | 1, int.from_bytes(seed[8:], "little")) for seed in seeds
+        ]
+
+    def key(self, question: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{normalize_question(question)}".encode()).hexdigest()
+
+    def _signature(self, normalized: str) -> tuple:
+        words = normalized.split()
+        shingles = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles]
+        if not hashes:
+            return ()
+        return tuple(min((a * h + b) % self._PRIME for h in hashes) for a, b in self._permutations)
+
+    def _band_keys(self, signature: tuple) -> List[tuple]:
+        return [(i, signature[i:i + self.BAND_SIZE]) for i in range(0, len(signature), self.BAND_SIZE)]
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry and entry[2]:
+            for band in self._band_keys(entry[2]):
+                bucket = self._bands.get(band)
+                if bucket:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band]
+
+    def _live(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, question: str, owner: Optional[str] = None) -> Optional[str]:
+        key = self.key(question)
+        entry = self._live(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if self.near_duplicates:
+            signature = self._signature(normalize_question(question))
+            candidates = set()
+            for band in self._band_keys(signature):
+                candidates |= self._bands.get(band, set())
+            best_key, best_score = None, self.similarity
+            for candidate in candidates:
+                other = self._live(candidate)
+                if other is None or other[3] != owner:
+                    continue
+                score = sum(x == y for x, y in zip(signature, other[2])) / len(signature)
+                if score >= best_score:
+                    best_key, best_score = candidate, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                return self._entries[best_key][1]
+
+        self.misses += 1
+        return None
+
+    def set(self, question: str, reply: str, owner: Optional[str] = None) -> None:
+        if self.max_entries <= 0 or not reply:
+            return
+        key = self.key(question)
+        self._remove(key)
+        signature = self._signature(normalize_question(question)) if self.near_duplicates else ()
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, reply, signature, owner)
+        for band in self._band_keys(signature) if signature else []:
+            self._bands.setdefault(band, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, question: str) -> bool:
+        """Drop the cached answer for a question; True if there was one."""
+        key = self.key(question)
+        found = key in self._entries
+        self._remove(key)
+        self.invalidations += found
+        return found
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bands.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _label_set(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic counter, one series per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_label_set(self.labels, key)} {value}" for key, value in values]
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout.
+
+    Each series is a flat list of per-bucket counts (the last one being +Inf)
+    followed by the running sum, so observe() is a bisect and two additions.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                bucket_labels = _label_set(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_set(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_label_set(self.labels, key)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Point-in-time values read from a callback when metrics are scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple, collect):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_label_set(self.labels, key)} {value}" for key, value in self.collect().items()]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.register(Histogram(
+    "aeroassist_stage_duration_seconds", "Time spent in each stage of a request.", ("stage",)))
+stage_errors = metrics.register(Counter(
+    "aeroassist_stage_errors_total", "Stages that ended with an exception.", ("stage",)))
+request_seconds = metrics.register(Histogram(
+    "aeroassist_request_duration_seconds", "HTTP request latency, including streamed bodies.", ("route",)))
+requests_total = metrics.register(Counter(
+    "aeroassist_requests_total", "HTTP requests by route and status code.", ("route", "status")))
+db_queries = metrics.register(Counter(
+    "aeroassist_db_queries_total", "SQL statements executed."))
+db_commits = metrics.register(Counter(
+    "aeroassist_db_commits_total", "Database transactions committed."))
+upstream_tokens = metrics.register(Counter(
+    "aeroassist_upstream_tokens_total", "Tokens billed by OpenAI.", ("kind",)))
+llm_queue_wait = metrics.register(Histogram(
+    "aeroassist_llm_queue_wait_seconds", "Time OpenAI calls waited for admission.", ("priority",)))
+llm_retries = metrics.register(Counter(
+    "aeroassist_llm_retries_total", "OpenAI calls retried after a failure.", ("reason",)))
+llm_rejected = metrics.register(Counter(
+    "aeroassist_llm_rejected_total", "OpenAI calls refused by the scheduler with a 503.", ("reason",)))
+
+# Stage timings of the current request, when Server-Timing is enabled
+_server_timings: ContextVar[Optional[list]] = ContextVar("server_timings", default=None)
+
+class StageTimer:
+    """Time a block as one request stage: `with StageTimer("history"): ...`.
+
+    Records into stage_seconds (and stage_errors if the block raises) and,
+    when the request collects Server-Timing entries, into those as well.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        elapsed = time.perf_counter() - self.start
+        stage_seconds.observe(elapsed, self.stage)
+        if exc_type is not None:
+            stage_errors.inc(self.stage)
+        timings = _server_timings.get()
+        if timings is not None:
+            timings.append((self.stage, elapsed))
+        return False
+
+def instrument_engine(async_engine) -> None:
+    """Count statements and commits issued through an engine."""
+    sync_engine = async_engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", lambda *args: db_queries.inc())
+    event.listen(sync_engine, "commit", lambda conn: db_commits.inc())
+
+def _pool_gauges() -> Dict[tuple, int]:
+    pool = engine.sync_engine.pool if engine is not None else None
+    if pool is None or not hasattr(pool, "checkedout"):
+        return {}
+    return {
+        ("size",): pool.size(),
+        ("checked_out",): pool.checkedout(),
+        ("checked_in",): pool.checkedin(),
+        ("overflow",): pool.overflow(),
+    }
+
+metrics.register(Gauge(
+    "aeroassist_db_pool_connections", "Connection pool state of the database engine.", ("state",), _pool_gauges))
+metrics.register(Gauge(
+    "aeroassist_write_behind_queue_depth", "Writes queued for the database in write-behind mode.", (),
+    lambda: {(): write_behind.queue_depth()} if write_behind is not None else {}))
+write_behind_rejected = metrics.register(Counter(
+    "aeroassist_write_behind_rejected_total", "Write-behind records the database refused, set aside in the reject file."))
+
+metrics.register(Gauge(
+    "aeroassist_log_queue_depth", "Log records waiting for the listener thread.", (),
+    lambda: {(): log_handler.queue.qsize()}))
+metrics.register(Gauge(
+    "aeroassist_log_records_dropped", "Log records dropped because the log queue was full.", (),
+    lambda: {(): log_handler.dropped}))
+
+class MetricsMiddleware:
+    """Count and time HTTP requests, adding a Server-Timing header when enabled.
+
+    Plain ASGI rather than BaseHTTPMiddleware, so the stage list set here is
+    the one the endpoint and its dependencies append to. For streamed
+    responses the header only covers stages finished before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = [] if SERVER_TIMING_ENABLED else None
+        token = _server_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if timings:
+                    header = ", ".join(f"{stage};dur={elapsed * 1000:.2f}" for stage, elapsed in timings)
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _server_timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            request_seconds.observe(time.perf_counter() - start, path)
+            requests_total.inc(path, str(status_code))
+
 # ============================================================================
 # OPENAI CLIENT INITIALIZATION
 # ============================================================================
 
-# Initialize OpenAI client
+# Created by init_openai_client() at startup; even importing the SDK takes a
+# few hundred milliseconds, so that is deferred too.
 openai_client = None
-try:
-    from openai import OpenAI
-    if OPENAI_API_KEY:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        logger.info("OpenAI client initialized successfully")
-    else:
-        logger.warning("OPENAI_API_KEY not set - OpenAI client not initialized")
-except Exception as e:
-    logger.error(f"Failed to initialize OpenAI client: {e}")
-    openai_client = None
+
+def _warm_openai_sdk() -> None:
+    """Parse one canned response and stream through a throwaway client.
+
+    The SDK builds its pydantic validators on first use, which otherwise adds
+    about half a second to the first chat turn. The canned replies come from
+    an in-memory transport, so nothing leaves the process.
+    """
+    from openai import AsyncOpenAI
+
+    response = {
+        "id": "resp_warmup", "object": "response", "created_at": 0, "model": OPENAI_MODEL,
+        "status": "completed", "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+        "output": [{
+            "type": "message", "id": "msg_warmup", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": "ok", "annotations": []}],
+        }],
+        "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+    }
+    events = [
+        {"type": "response.output_text.delta", "sequence_number": 0, "item_id": "msg_warmup",
+         "output_index": 0, "content_index": 0, "delta": "ok", "logprobs": []},
+        {"type": "response.completed", "sequence_number": 1, "response": response},
+    ]
+    stream_body = "".join(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if json.loads(request.content).get("stream"):
+            return httpx.Response(200, text=stream_body, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=response)
+
+    async def warm() -> None:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http_client:
+            client = AsyncOpenAI(api_key="warmup", base_url="http://warmup/v1", http_client=http_client, max_retries=0)
+            await client.responses.create(model=OPENAI_MODEL, input="ok")
+            async for _ in await client.responses.create(model=OPENAI_MODEL, input="ok", stream=True):
+                pass
+
+    asyncio.run(warm())
+
+def init_openai_client() -> None:
+    """Create the async OpenAI client (async, so completions never block the event loop)."""
+    global openai_client
+    try:
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        if OPENAI_API_KEY:
+            # One client per worker, so connections stay alive across requests
+            http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_SECONDS
+            ))
+            # Retries are left to the upstream scheduler, which also paces the queue
+            openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+            logger.info("OpenAI client initialized successfully")
+        else:
+            logger.warning("OPENAI_API_KEY not set - OpenAI client not initialized")
+    except Exception as e:
+        logger.error("Failed to initialize OpenAI client: %s", e)
+        openai_client = None
+
+async def warm_openai_sdk() -> None:
+    """Run _warm_openai_sdk in a worker thread, logging rather than raising on failure."""
+    try:
+        await asyncio.to_thread(_warm_openai_sdk)
+        logger.info("OpenAI SDK warmed up")
+    except Exception as e:
+        logger.warning("OpenAI SDK warm-up failed: %s", e)
 
 # ============================================================================
 # DATABASE MODELS
@@ -93,6 +1143,17 @@ except Exception as e:
 
 Base = declarative_base()
 
+_seq_lock = threading.Lock()
+_last_seq = 0
+
+def next_message_seq() -> int:
+    """Strictly increasing message sequence: microseconds since the epoch,
+    bumped by one when two messages land in the same microsecond."""
+    global _last_seq
+    with _seq_lock:
+        _last_seq = max(_last_seq + 1, time.time_ns() // 1000)
+        return _last_seq
+
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
     
@@ -100,269 +1161,3879 @@ class ChatSession(Base):
     user_id = Column(String, nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), default=func.now())
     updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+    # Denormalized so listing sessions never has to count chat_messages
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Running token total, maintained by the usage ledger
+    tokens_used = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # Set while the session's messages are in the cold archive instead of chat_messages
+    archived_at = Column(DateTime(timezone=True), nullable=True)
+    # Last stored OpenAI response, continued by the next turn (LLM_CHAIN_RESPONSES)
+    last_response_id = Column(String, nullable=True)
     
     # Relationship
     messages = relationship("ChatMessage", back_populates="session")
 
+    __table_args__ = (
+        Index("idx_chat_sessions_user_updated", "user_id", "updated_at", "id"),
+        # Archive candidates; archived sessions drop out, so it stays small
+        Index("idx_chat_sessions_active_updated", "updated_at",
+              postgresql_where=text("archived_at IS NULL"), sqlite_where=text("archived_at IS NULL")),
+    )
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False, index=True)
+    session_id = Column(String, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(String, nullable=False, index=True)
     role = Column(String, nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
+    timestamp = Column(DateTime(timezone=True), default=func.now())
+    tokens_used = Column(Integer, default=0)
+    # Conversation order; ids are random UUIDs and can't be sorted on
+    seq = Column(BigInteger, nullable=False, default=next_message_seq)
     
     # Relationship
     session = relationship("ChatSession", back_populates="messages")
 
+    __table_args__ = (
+        Index("idx_chat_messages_session_seq", "session_id", "seq", unique=True),
+        # Per-user full-text search (see MESSAGE SEARCH); SQLite gets an FTS5 table instead
+        Index("idx_chat_messages_search", "user_id", text("to_tsvector('english', content)"),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+# A GIN index can only lead with user_id through btree_gin
+event.listen(ChatMessage.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS btree_gin").execute_if(dialect="postgresql"))
+
+class UsageHourly(Base):
+    """Tokens and chat turns per user per UTC hour, written by the usage ledger."""
+    __tablename__ = "usage_hourly"
+
+    user_id = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    tokens = Column(BigInteger, nullable=False, default=0, server_default="0")
+    requests = Column(Integer, nullable=False, default=0, server_default="0")
+
+class UsageDaily(Base):
+    """Tokens and chat turns per user per UTC day, written by the usage ledger."""
+    __tablename__ = "usage_daily"
+
+    user_id = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    tokens = Column(BigInteger, nullable=False, default=0, server_default="0")
+    requests = Column(Integer, nullable=False, default=0, server_default="0")
+
+class ChatBatch(Base):
+    """A batch chat job: the prompts of a JSONL file, answered offline."""
+    __tablename__ = "chat_batches"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, nullable=False, index=True)
+    # queued, running, completed, cancelled or failed
+    status = Column(String, nullable=False, default="queued")
+    source = Column(String, nullable=False)
+    # Prompts in the file, blank lines aside
+    total = Column(Integer, nullable=False, default=0)
+    # Every line before this one has its result stored
+    checkpoint = Column(Integer, nullable=False, default=0, server_default="0")
+    succeeded = Column(Integer, nullable=False, default=0, server_default="0")
+    failed = Column(Integer, nullable=False, default=0, server_default="0")
+    tokens_used = Column(BigInteger, nullable=False, default=0, server_default="0")
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # Held by the worker running the job, which renews it
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+
+class ChatBatchResult(Base):
+    """The reply to one line of a batch, or why there is none."""
+    __tablename__ = "chat_batch_results"
+
+    batch_id = Column(String, ForeignKey("chat_batches.id", ondelete="CASCADE"), primary_key=True)
+    line = Column(Integer, primary_key=True)
+    custom_id = Column(String, nullable=True)
+    reply = Column(Text, nullable=True)
+    tokens_used = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+# ============================================================================
+# PYDANTIC MODELS
+# ============================================================================
+
+class ChatMessageRequest(BaseModel):
+    role: str
+    content: str
+    timestamp: Optional[str] = None
+
+class ChatRequest(BaseModel):
+    message: str
+    # Only used when the server runs without a database; otherwise the
+    # history is loaded server-side and need not be uploaded
+    conversation_history: Optional[List[ChatMessageRequest]] = []
+    session_id: Optional[str] = None
+
+class ChatResponse(BaseModel):
+    reply: str
+    timestamp: str
+    session_id: str
+    tokens_used: int
+
+class User(BaseModel):
+    id: str
+    email: str
+    role: str = "user"
+
+# ============================================================================
+# DATABASE SETUP
+# ============================================================================
+
+# The engine is created and checked by init_database() during startup, so
+# importing this module never touches the database.
+engine = None
+SessionLocal = None
+
+def create_database_engine():
+    """Create the async engine for ASYNC_DATABASE_URL; connections are opened on demand."""
+    if ASYNC_DATABASE_URL.startswith("sqlite"):
+        # SQLite allows one writer at a time; wait for the lock instead of failing.
+        # Its connections aren't pooled, so the pool settings don't apply.
+        options: Dict[str, Any] = {"connect_args": {"timeout": 30}}
+    else:
+        options = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        }
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+        echo=False,  # Set to True for SQL debugging
+        **options
+    )
+    instrument_engine(async_engine)
+    return async_engine
+
+async def init_database(create_tables: bool = False):
+    """Create the engine and test the connection, disabling storage on failure.
+
+    Tables are only created with create_tables (AUTO_MIGRATE or migrate.py).
+    """
+    global engine, SessionLocal
+    if not ASYNC_DATABASE_URL:
+        logger.warning("DATABASE_URL not configured - running without database")
+        return
+
+    try:
+        engine = create_database_engine()
+        logger.info("Attempting to connect to database...")
+        async with engine.begin() as conn:
+            await conn.execute(text("SELECT 1"))
+            logger.info("Database connection test successful")
+
+            if create_tables:
+                await conn.run_sync(Base.metadata.create_all)
+                if engine.dialect.name == "sqlite":
+                    await conn.run_sync(ensure_sqlite_search_index)
+                logger.info("Database tables created/verified successfully")
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    except Exception as e:
+        logger.error("Database connection failed: %s", e)
+        logger.warning("Running without database - chat will work but messages won't be stored")
+        if engine is not None:
+            await engine.dispose()
+        engine = None
+        SessionLocal = None
+
+def insert_ignoring_duplicates(table):
+    """INSERT that skips rows already present, for replays and restores.
+
+    On SQLite this is INSERT OR IGNORE rather than an upsert, because the
+    partitioned chat_messages is a view, and the outer statement's conflict
+    policy carries through its insert trigger.
+    """
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing()
+    return insert(table).prefix_with("OR IGNORE")
+
+async def get_db():
+    """Database session dependency."""
+    if SessionLocal is None:
+        # Yield a mock database session that does nothing
+        class MockResult:
+            def scalar_one_or_none(self): return None
+            def scalars(self): return self
+            def all(self): return []
+        class MockDB:
+            def add(self, obj): pass
+            async def commit(self): pass
+            async def rollback(self): pass
+            async def close(self): pass
+            async def execute(self, statement): return MockResult()
+            async def scalar(self, statement): return None
+        yield MockDB()
+        return
+
+    async with SessionLocal() as db:
+        yield db
+
+# ============================================================================
+# WRITE-BEHIND PERSISTENCE
+# ============================================================================
+
+class WriteBehindWriter:
+    """Batches session and message writes off the request path.
+
+    Records are dicts with a "kind" of "session" (insert a session),
+    "message" (insert a message and bump its session's message_count; one
+    with a "response_id" also sets the session's last_response_id) or
+    "touch" (update a session's last activity). Touches and counts are
+    aggregated per session within a batch. Callers that read a session or user with writes still in
+    the queue call sync() first, which flushes immediately, so reads always
+    see their own writes. A batch that fails max_retries times is written
+    record by record, and the records that fail on their own go to
+    reject_path, so one bad row can't hold up every later write.
+    """
+
+    def __init__(self, session_factory, flush_ms: int, batch_rows: int, max_queue: int, spill_path: Optional[str] = None,
+                 max_retries: int = 5, reject_path: Optional[str] = None):
+        self.session_factory = session_factory
+        self.flush_interval = flush_ms / 1000
+        self.batch_rows = batch_rows
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.reject_path = reject_path
+        self.rows_written = 0
+        self.rejected = 0
+        self.flushes = 0
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._pending: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._not_empty = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._spill = None
+        # Spill lines waiting for the spill task, which appends them off the event loop
+        self._spill_lines: List[str] = []
+        self._spill_ready = asyncio.Event()
+        self._spill_lock = asyncio.Lock()
+        self._spill_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.spill_path:
+            await self._replay_spill()
+            self._spill = open(self.spill_path, "a", encoding="utf-8")
+            self._spill_task = asyncio.create_task(self._run_spill())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still queued; called from the lifespan shutdown.
+
+        The background task is asked to finish rather than cancelled: it
+        has already taken its batch off the queue, and cancelling it mid-write
+        would lose that batch.
+        """
+        self._stopping = True
+        self._not_empty.set()
+        if self._task:
+            await self._task
+        await self.flush()
+        if self._spill:
+            # Not while a thread is writing to the file
+            async with self._spill_lock:
+                self._spill_task.cancel()
+                self._spill.close()
+
+    def pending_keys(self, record: Dict[str, Any]) -> List[str]:
+        return [f"session:{record['session_id']}", f"user:{record['user_id']}"]
+
+    async def add(self, record: Dict[str, Any]) -> None:
+        """Queue a write, waiting for room when the queue is full."""
+        if self._spill:
+            self._spill_lines.append(json.dumps(record, default=str) + "\n")
+            self._spill_ready.set()
+        for key in self.pending_keys(record):
+            self._pending[key] = self._pending.get(key, 0) + 1
+        await self._queue.put(record)
+        self._not_empty.set()
+
+    async def sync(self, session_id: Optional[str] = None, user_id: Optional[str] = None) -> None:
+        """Flush now if the session or user has writes that haven't reached the database."""
+        if (session_id and self._pending.get(f"session:{session_id}")) or (user_id and self._pending.get(f"user:{user_id}")):
+            await self.flush()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await self._not_empty.wait()
+            # Give the batch until the flush interval to fill up
+            deadline = time.monotonic() + self.flush_interval
+            while (not self._stopping and self._queue.qsize() < self.batch_rows
+                   and time.monotonic() < deadline):
+                await asyncio.sleep(min(deadline - time.monotonic(), 0.005))
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            batch = []
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._not_empty.clear()
+            for attempt in itertools.count(1):
+                if not batch:
+                    break
+                try:
+                    await self._write(batch)
+                    break
+                except Exception as e:
+                    logger.error("Write-behind flush of %s rows failed (attempt %s of %s): %s",
+                                 len(batch), attempt, self.max_retries + 1, e)
+                if attempt > self.max_retries:
+                    await self._write_each(batch)
+                    break
+                await asyncio.sleep(1.0)
+
+            for record in batch:
+                for key in self.pending_keys(record):
+                    if self._pending.get(key, 0) <= 1:
+                        self._pending.pop(key, None)
+                    else:
+                        self._pending[key] -= 1
+
+            # Everything logged so far is in the database, start a fresh spill file
+            if self._spill and batch and self._queue.empty():
+                async with self._spill_lock:
+                    self._spill_lines = []
+                    await asyncio.to_thread(self._spill.truncate, 0)
+
+    async def _run_spill(self) -> None:
+        while True:
+            await self._spill_ready.wait()
+            self._spill_ready.clear()
+            async with self._spill_lock:
+                lines, self._spill_lines = self._spill_lines, []
+                if lines:
+                    await asyncio.to_thread(self._append_spill, lines)
+
+    def _append_spill(self, lines: List[str]) -> None:
+        self._spill.write("".join(lines))
+        self._spill.flush()
+
+    async def _write(self, batch: List[Dict[str, Any]], replay: bool = False) -> None:
+        sessions = [r for r in batch if r["kind"] == "session"]
+        messages = [r for r in batch if r["kind"] == "message"]
+        touches: Dict[str, Dict[str, Any]] = {}
+        for r in batch:
+            if r["kind"] in ("touch", "message"):
+                updated_at = r["updated_at"] if r["kind"] == "touch" else r["timestamp"]
+                touch = touches.setdefault(r["session_id"], {"b_id": r["session_id"], "b_count": 0, "b_updated_at": updated_at,
+                                                             "b_chain": False, "b_response_id": None})
+                touch["b_count"] += 1 if r["kind"] == "message" else 0
+                touch["b_updated_at"] = max(touch["b_updated_at"], updated_at)
+                if "response_id" in r:
+                    touch["b_chain"], touch["b_response_id"] = True, r["response_id"]
+
+        session_table = ChatSession.__table__
+        message_table = ChatMessage.__table__
+        async with self.session_factory() as db:
+            if sessions:
+                await db.execute(self._insert(session_table, replay), [
+                    {"id": r["session_id"], "user_id": r["user_id"], "created_at": r["created_at"], "updated_at": r["updated_at"]}
+                    for r in sessions
+                ])
+            if messages:
+                await db.execute(self._insert(message_table, replay), [
+                    {k: r[k] for k in ("id", "session_id", "user_id", "role", "content", "timestamp", "tokens_used", "seq")}
+                    for r in messages
+                ])
+            if touches and not replay:
+                await db.execute(
+                    update(session_table).where(session_table.c.id == bindparam("b_id")).values(
+                        message_count=session_table.c.message_count + bindparam("b_count"),
+                        updated_at=bindparam("b_updated_at"),
+                        last_response_id=case(
+                            (bindparam("b_chain", type_=Boolean), bindparam("b_response_id", type_=String)),
+                            else_=session_table.c.last_response_id
+                        )
+                    ),
+                    list(touches.values())
+                )
+            elif touches:
+                # Replayed rows may already have been counted; recount from
+                # scratch, and rebuild the context next turn rather than trust
+                # a response chain that may predate them
+                counts = select(func.count()).where(message_table.c.session_id == session_table.c.id).scalar_subquery()
+                await db.execute(
+                    update(session_table).where(session_table.c.id.in_(list(touches))).values(
+                        message_count=counts, last_response_id=None
+                    )
+                )
+            await db.commit()
+        self.rows_written += len(sessions) + len(messages) + len(touches)
+        self.flushes += 1
+
+    async def _write_each(self, batch: List[Dict[str, Any]]) -> None:
+        """Write records one at a time and set aside the ones the database refuses."""
+        rejected = []
+        for record in batch:
+            try:
+                await self._write([record])
+            except Exception as e:
+                logger.error("Write-behind %s record for session %s rejected: %s",
+                             record["kind"], record["session_id"], e)
+                rejected.append(record)
+        if not rejected:
+            return
+        self.rejected += len(rejected)
+        write_behind_rejected.inc(amount=len(rejected))
+        if self.reject_path:
+            await asyncio.to_thread(self._append_rejects, rejected)
+            logger.error("%s write-behind records set aside in %s", len(rejected), self.reject_path)
+
+    def _append_rejects(self, records: List[Dict[str, Any]]) -> None:
+        with open(self.reject_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def _insert(self, table, replay: bool):
+        # Rows in the spill file may already have been written before a crash
+        return insert_ignoring_duplicates(table) if replay else insert(table)
+
+    async def _replay_spill(self) -> None:
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        if records:
+            for record in records:
+                for key in ("created_at", "updated_at", "timestamp"):
+                    if record.get(key):
+                        record[key] = datetime.fromisoformat(record[key])
+            logger.info("Replaying %s write-behind records from %s", len(records), self.spill_path)
+            await self._write(records, replay=True)
+        open(self.spill_path, "w").close()
+
+write_behind: Optional[WriteBehindWriter] = None
+
+# ============================================================================
+# USAGE LEDGER AND QUOTAS
+# ============================================================================
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+
+def _bucket_epoch(value: datetime) -> float:
+    # SQLite hands timestamps back without a zone; the rollups are in UTC
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+class SlidingWindowCounter:
+    """Approximate total over the last `window` seconds in O(1) time and memory.
+
+    Keeps the totals of the current and previous fixed windows and counts
+    the previous one in proportion to how much of it the sliding window
+    still overlaps.
+    """
+
+    __slots__ = ("window", "start", "current", "previous")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.start = 0.0
+        self.current = 0
+        self.previous = 0
+
+    def _roll(self, now: float) -> None:
+        start = now - now % self.window
+        if start != self.start:
+            self.previous = self.current if start - self.start == self.window else 0
+            self.current = 0
+            self.start = start
+
+    def count(self, now: float) -> float:
+        self._roll(now)
+        return self.previous * (1 - (now - self.start) / self.window) + self.current
+
+    def add(self, amount: int, now: float) -> None:
+        self._roll(now)
+        self.current += amount
+
+    def retry_after(self, limit: int, now: float) -> float:
+        """Seconds until one more unit fits under limit, if nothing else is added."""
+        self._roll(now)
+        room = limit - 1
+        if self.current > room:
+            # Wait for this window to become the previous one and decay enough
+            until = self.start + self.window * (2 - room / self.current)
+        else:
+            until = self.start + self.window * (1 - (room - self.current) / self.previous) if self.previous else now
+        return max(0.0, until - now)
+
+class QuotaExceeded(Exception):
+    """Raised when a user is over a usage quota; maps to a 429."""
+
+    def __init__(self, quota: str, retry_after: float):
+        super().__init__(quota)
+        self.quota = quota
+        self.retry_after = retry_after
+
+class _UserWindows:
+    __slots__ = ("requests", "tokens")
+
+    def __init__(self):
+        self.requests = SlidingWindowCounter(60)
+        self.tokens = SlidingWindowCounter(DAY_SECONDS)
+
+class UsageLedger:
+    """Per-user and per-session token accounting, plus per-user quotas.
+
+    record() only adds to in-memory totals keyed by user and UTC hour/day
+    and by session. Every flush interval those totals are added to the
+    usage_hourly and usage_daily rollups with one upsert per table, and to
+    chat_sessions.tokens_used with one batched update, so the number of
+    writes depends on active users rather than messages. Totals from a
+    failed flush are kept for the next one.
+
+    check_quota() enforces requests per minute and tokens per day with
+    sliding-window counters kept per user in this process. The daily window
+    is seeded from usage_daily when a user is first seen, so a restart
+    doesn't reset anyone's quota.
+    """
+
+    def __init__(self, session_factory, flush_seconds: float, requests_per_minute: int, tokens_per_day: int,
+                 max_users: int):
+        self.session_factory = session_factory
+        self.flush_interval = flush_seconds
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_day = tokens_per_day
+        self.rows_written = 0
+        self.flushes = 0
+        # (user_id, bucket start epoch) -> [tokens, requests]
+        self._hourly: Dict[tuple, List[int]] = {}
+        self._daily: Dict[tuple, List[int]] = {}
+        self._sessions: Dict[str, int] = {}
+        # Totals taken by a flush that hasn't committed yet
+        self._flushing: tuple = ({}, {})
+        self._windows = TTLCache(max_users, DAY_SECONDS)
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.session_factory is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush what is still in memory; called from the lifespan shutdown."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def pending_rows(self) -> int:
+        return len(self._hourly) + len(self._daily) + len(self._sessions)
+
+    async def check_quota(self, user_id: str) -> None:
+        """Count a chat turn against the user's quotas, raising QuotaExceeded if over one."""
+        if not (self.requests_per_minute or self.tokens_per_day):
+            return
+        windows = self._windows.get(user_id)
+        if windows is None:
+            windows = await self._load_windows(user_id)
+
+        now = time.time()
+        if self.tokens_per_day and windows.tokens.count(now) + 1 > self.tokens_per_day:
+            raise QuotaExceeded("tokens_per_day", windows.tokens.retry_after(self.tokens_per_day, now))
+        if self.requests_per_minute:
+            if windows.requests.count(now) + 1 > self.requests_per_minute:
+                raise QuotaExceeded("requests_per_minute", windows.requests.retry_after(self.requests_per_minute, now))
+            windows.requests.add(1, now)
+
+    def record(self, user_id: str, session_id: Optional[str], tokens: int) -> None:
+        """Account one answered chat turn, or batch prompt (which has no session)."""
+        now = time.time()
+        windows = self._windows.get(user_id)
+        if windows is not None and tokens:
+            windows.tokens.add(tokens, now)
+        if self.session_factory is None:
+            return
+
+        for pending, width in ((self._hourly, HOUR_SECONDS), (self._daily, DAY_SECONDS)):
+            totals = pending.setdefault((user_id, now - now % width), [0, 0])
+            totals[0] += tokens
+            totals[1] += 1
+        if tokens and session_id is not None:
+            self._sessions[session_id] = self._sessions.get(session_id, 0) + tokens
+
+    async def _load_windows(self, user_id: str) -> _UserWindows:
+        windows = _UserWindows()
+        if self.tokens_per_day:
+            now = time.time()
+            today = now - now % DAY_SECONDS
+            days = {today - DAY_SECONDS: 0, today: 0}
+            if self.session_factory is not None:
+                try:
+                    async with self.session_factory() as db:
+                        rows = await db.execute(
+                            select(UsageDaily.bucket_start, UsageDaily.tokens).where(
+                                UsageDaily.user_id == user_id,
+                                UsageDaily.bucket_start >= datetime.fromtimestamp(today - DAY_SECONDS, timezone.utc)
+                            )
+                        )
+                        for start, tokens in rows:
+                            days[_bucket_epoch(start)] = days.get(_bucket_epoch(start), 0) + tokens
+                except Exception as e:
+                    logger.warning("Could not load usage for %s, starting its quota from zero: %s", user_id, e)
+            for pending in (self._daily, self._flushing[1]):
+                for day in days:
+                    days[day] += pending.get((user_id, day), [0, 0])[0]
+            windows.tokens.start = today
+            windows.tokens.previous = days[today - DAY_SECONDS]
+            windows.tokens.current = days[today]
+
+        # Another request for the same user may have loaded it meanwhile
+        existing = self._windows.get(user_id)
+        if existing is not None:
+            return existing
+        self._windows.set(user_id, windows)
+        return windows
+
+    async def usage(self, user_id: str, granularity: str, since: float) -> List[Dict[str, Any]]:
+        """Per-bucket totals from `since` on: the rollups plus whatever hasn't been flushed."""
+        model, width, index = (UsageHourly, HOUR_SECONDS, 0) if granularity == "hour" else (UsageDaily, DAY_SECONDS, 1)
+        since -= since % width
+        buckets: Dict[float, List[int]] = {}
+        if self.session_factory is not None:
+            async with self.session_factory() as db:
+                rows = await db.execute(
+                    select(model.bucket_start, model.tokens, model.requests).where(
+                        model.user_id == user_id,
+                        model.bucket_start >= datetime.fromtimestamp(since, timezone.utc)
+                    )
+                )
+                for start, tokens, requests in rows:
+                    buckets[_bucket_epoch(start)] = [tokens, requests]
+        for pending in ((self._hourly, self._daily)[index], self._flushing[index]):
+            for (pending_user, start), (tokens, requests) in list(pending.items()):
+                if pending_user == user_id and start >= since:
+                    totals = buckets.setdefault(start, [0, 0])
+                    totals[0] += tokens
+                    totals[1] += requests
+        return [
+            {"start": datetime.fromtimestamp(start, timezone.utc).isoformat(), "tokens": tokens, "requests": requests}
+            for start, (tokens, requests) in sorted(buckets.items())
+        ]
+
+    async def flush(self) -> None:
+        if self.session_factory is None:
+            return
+        async with self._lock:
+            hourly, daily, sessions = self._hourly, self._daily, self._sessions
+            if not (hourly or daily or sessions):
+                return
+            self._hourly, self._daily, self._sessions = {}, {}, {}
+            self._flushing = (hourly, daily)
+            try:
+                await self._write(hourly, daily, sessions)
+            except Exception as e:
+                logger.error("Usage flush of %s rows failed, retrying later: %s",
+                             len(hourly) + len(daily) + len(sessions), e)
+                for pending, taken in ((self._hourly, hourly), (self._daily, daily)):
+                    for key, (tokens, requests) in taken.items():
+                        totals = pending.setdefault(key, [0, 0])
+                        totals[0] += tokens
+                        totals[1] += requests
+                for session_id, tokens in sessions.items():
+                    self._sessions[session_id] = self._sessions.get(session_id, 0) + tokens
+            finally:
+                self._flushing = ({}, {})
+
+    async def _write(self, hourly: Dict[tuple, List[int]], daily: Dict[tuple, List[int]], sessions: Dict[str, int]) -> None:
+        if write_behind is not None:
+            # Sessions still queued have to exist before their totals can be added
+            await write_behind.flush()
+
+        session_table = ChatSession.__table__
+        async with self.session_factory() as db:
+            for table, pending in ((UsageHourly.__table__, hourly), (UsageDaily.__table__, daily)):
+                if pending:
+                    await db.execute(self._upsert(table), [
+                        {
+                            "user_id": user_id,
+                            "bucket_start": datetime.fromtimestamp(start, timezone.utc),
+                            "tokens": tokens,
+                            "requests": requests
+                        }
+                        for (user_id, start), (tokens, requests) in pending.items()
+                    ])
+            if sessions:
+                # Not session activity, so updated_at stays as it was
+                await db.execute(
+                    update(session_table).where(session_table.c.id == bindparam("b_id")).values(
+                        tokens_used=session_table.c.tokens_used + bindparam("b_tokens"),
+                        updated_at=session_table.c.updated_at
+                    ),
+                    [{"b_id": session_id, "b_tokens": tokens} for session_id, tokens in sessions.items()]
+                )
+            await db.commit()
+        self.rows_written += len(hourly) + len(daily) + len(sessions)
+        self.flushes += 1
+
+    def _upsert(self, table):
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.bucket_start],
+            set_={
+                "tokens": table.c.tokens + statement.excluded.tokens,
+                "requests": table.c.requests + statement.excluded.requests
+            }
+        )
+
+usage_ledger: Optional[UsageLedger] = None
+
+quota_rejected = metrics.register(Counter(
+    "aeroassist_quota_rejected_total", "Chat requests refused with a 429 by a per-user quota.", ("quota",)))
+metrics.register(Gauge(
+    "aeroassist_usage_pending_rows", "Usage rollup and session rows waiting for the next ledger flush.", (),
+    lambda: {(): usage_ledger.pending_rows()} if usage_ledger is not None else {}))
+
+async def enforce_quota(user_id: str) -> None:
+    """Count a chat turn against the user's quotas, raising a 429 when over one."""
+    if usage_ledger is None:
+        return
+    try:
+        await usage_ledger.check_quota(user_id)
+    except QuotaExceeded as e:
+        quota_rejected.inc(e.quota)
+        logger.warning("User %s is over their %s quota", user_id, e.quota)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Usage quota exceeded ({e.quota}), please try again later",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+
+# ============================================================================
+# MESSAGE PARTITIONING AND ARCHIVAL
+# ============================================================================
+
+# chat_messages can be split into monthly partitions on seq (UTC months), so
+# months that archival has emptied are dropped whole instead of leaving
+# dead rows and index entries behind. Postgres uses declarative range
+# partitioning; on SQLite, used for development and tests, the same layout
+# is emulated by a UNION ALL view over one table per month, with INSTEAD OF
+# triggers routing inserts and deletes. Rows outside every monthly range go
+# to the default partition.
+MESSAGE_PARTITION_PREFIX = "chat_messages_p"
+MESSAGE_DEFAULT_PARTITION = MESSAGE_PARTITION_PREFIX + "default"
+MESSAGE_COLUMNS = [column.name for column in ChatMessage.__table__.columns]
+
+def seq_at(moment: datetime) -> int:
+    """The message seq of a moment: microseconds since the epoch."""
+    return int(moment.timestamp()) * 1_000_000 + moment.microsecond
+
+def month_start(moment: datetime) -> datetime:
+    """Start of the UTC month containing moment (naive values are local time)."""
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(start: datetime) -> datetime:
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+def message_partition_name(start: datetime) -> str:
+    return f"{MESSAGE_PARTITION_PREFIX}{start:%Y%m}"
+
+def message_partition_bounds(name: str) -> tuple:
+    """(first seq, first seq of the next month) of a monthly partition."""
+    start = datetime.strptime(name[len(MESSAGE_PARTITION_PREFIX):], "%Y%m").replace(tzinfo=timezone.utc)
+    return seq_at(start), seq_at(next_month(start))
+
+def message_partitioning_enabled(conn) -> bool:
+    if conn.dialect.name == "postgresql":
+        query = "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('chat_messages')"
+    else:
+        query = "SELECT type = 'view' FROM sqlite_master WHERE name = 'chat_messages'"
+    return bool(conn.exec_driver_sql(query).scalar())
+
+def list_message_partitions(conn) -> List[str]:
+    """Names of the monthly partitions of chat_messages, oldest first."""
+    if conn.dialect.name == "postgresql":
+        query = ("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                 "WHERE i.inhparent = to_regclass('chat_messages')")
+    else:
+        query = "SELECT name FROM sqlite_master WHERE type = 'table'"
+    names = [row[0] for row in conn.exec_driver_sql(query)]
+    return sorted(
+        name for name in names
+        if name.startswith(MESSAGE_PARTITION_PREFIX) and name[len(MESSAGE_PARTITION_PREFIX):].isdigit()
+    )
+
+def _sqlite_create_message_table(conn, name: str, bounds: Optional[tuple] = None) -> None:
+    # Same columns and indexes as ChatMessage, with the index names made unique
+    metadata = MetaData()
+    ChatSession.__table__.to_metadata(metadata)
+    table = ChatMessage.__table__.to_metadata(metadata, name=name)
+    for index in list(table.indexes):
+        if index.name == "idx_chat_messages_search":
+            # Postgres only; the FTS5 table covers every partition
+            table.indexes.discard(index)
+        elif name not in index.name:
+            index.name = index.name.replace("chat_messages", name, 1)
+    if bounds is not None:
+        table.append_constraint(CheckConstraint(f"seq >= {bounds[0]} AND seq < {bounds[1]}"))
+    table.create(conn, checkfirst=True)
+
+def _sqlite_rebuild_message_view(conn) -> None:
+    partitions = list_message_partitions(conn)
+    columns = ", ".join(MESSAGE_COLUMNS)
+    values = ", ".join(f"NEW.{column}" for column in MESSAGE_COLUMNS)
+    ranges = {name: "NEW.seq >= %d AND NEW.seq < %d" % message_partition_bounds(name) for name in partitions}
+    routes = [f"INSERT INTO {name} ({columns}) SELECT {values} WHERE {ranges[name]};" for name in partitions]
+    routes.append(
+        f"INSERT INTO {MESSAGE_DEFAULT_PARTITION} ({columns}) SELECT {values} "
+        f"WHERE NOT ({' OR '.join(f'({condition})' for condition in ranges.values()) or '0'});"
+    )
+    deletes = [f"DELETE FROM {name} WHERE id = OLD.id;" for name in partitions + [MESSAGE_DEFAULT_PARTITION]]
+
+    # Dropping the view drops its triggers too
+    conn.exec_driver_sql("DROP VIEW IF EXISTS chat_messages")
+    conn.exec_driver_sql("CREATE VIEW chat_messages AS " + " UNION ALL ".join(
+        f"SELECT {columns} FROM {name}" for name in partitions + [MESSAGE_DEFAULT_PARTITION]
+    ))
+    conn.exec_driver_sql(
+        "CREATE TRIGGER chat_messages_insert INSTEAD OF INSERT ON chat_messages BEGIN " + " ".join(routes) + " END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER chat_messages_delete INSTEAD OF DELETE ON chat_messages BEGIN " + " ".join(deletes) + " END"
+    )
+    if conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'chat_messages_search'").first() is not None:
+        _sqlite_create_search_triggers(conn)
+
+def ensure_message_partitions(conn, months_ahead: int, now: Optional[datetime] = None,
+                              since: Optional[datetime] = None) -> List[str]:
+    """Create any missing monthly partitions from `since` (default: this month)
+    through months_ahead months from now; returns the ones created.
+
+    Rows of a new month already sitting in the default partition are moved
+    into it.
+    """
+    now = now or datetime.now(timezone.utc)
+    start, end = month_start(since or now), month_start(now)
+    for _ in range(months_ahead):
+        end = next_month(end)
+
+    existing = set(list_message_partitions(conn))
+    created = []
+    while start <= end:
+        name = message_partition_name(start)
+        if name not in existing:
+            low, high = message_partition_bounds(name)
+            if conn.dialect.name == "postgresql":
+                conn.exec_driver_sql(f"CREATE TABLE {name} (LIKE chat_messages INCLUDING DEFAULTS)")
+                conn.exec_driver_sql(
+                    f"WITH moved AS (DELETE FROM {MESSAGE_DEFAULT_PARTITION} WHERE seq >= {low} AND seq < {high} "
+                    f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+                )
+                conn.exec_driver_sql(
+                    f"ALTER TABLE chat_messages ATTACH PARTITION {name} FOR VALUES FROM ({low}) TO ({high})"
+                )
+            else:
+                _sqlite_create_message_table(conn, name, (low, high))
+                columns = ", ".join(MESSAGE_COLUMNS)
+                moved = f"FROM {MESSAGE_DEFAULT_PARTITION} WHERE seq >= {low} AND seq < {high}"
+                conn.exec_driver_sql(f"INSERT INTO {name} ({columns}) SELECT {columns} {moved}")
+                conn.exec_driver_sql(f"DELETE {moved}")
+            created.append(name)
+        start = next_month(start)
+
+    if created and conn.dialect.name != "postgresql":
+        _sqlite_rebuild_message_view(conn)
+    return created
+
+def drop_empty_message_partitions(conn, before: datetime) -> List[str]:
+    """Drop the monthly partitions that end before `before` and hold no rows."""
+    cutoff = seq_at(month_start(before))
+    dropped = []
+    for name in list_message_partitions(conn):
+        if message_partition_bounds(name)[1] > cutoff:
+            break
+        if conn.dialect.name == "postgresql":
+            # Held until commit, so a concurrent restore can't slip rows in
+            conn.exec_driver_sql(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE")
+        if conn.exec_driver_sql(f"SELECT 1 FROM {name} LIMIT 1").first() is not None:
+            continue
+        if conn.dialect.name == "postgresql":
+            conn.exec_driver_sql(f"ALTER TABLE chat_messages DETACH PARTITION {name}")
+        conn.exec_driver_sql(f"DROP TABLE {name}")
+        dropped.append(name)
+
+    if dropped and conn.dialect.name != "postgresql":
+        _sqlite_rebuild_message_view(conn)
+    return dropped
+
+def partition_message_table(conn, months_ahead: int) -> List[str]:
+    """Convert chat_messages to monthly partitions in place, or just add any
+    missing partitions if it already is one; returns the partitions created.
+
+    Every row is copied inside the caller's transaction, so run the
+    conversion in a maintenance window (`python migrate.py --partition-messages`).
+    """
+    if message_partitioning_enabled(conn):
+        return ensure_message_partitions(conn, months_ahead)
+
+    first_seq = conn.exec_driver_sql("SELECT MIN(seq) FROM chat_messages").scalar()
+    if conn.dialect.name != "postgresql":
+        # Moved onto the renamed table otherwise, and the view's couldn't take their names
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS chat_messages_search_insert")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS chat_messages_search_delete")
+    conn.exec_driver_sql("ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned")
+    columns = ", ".join(MESSAGE_COLUMNS)
+    if conn.dialect.name == "postgresql":
+        # Free the index names for the new parent (older names from supabase_tables.sql included)
+        conn.exec_driver_sql("ALTER TABLE chat_messages_unpartitioned RENAME CONSTRAINT chat_messages_pkey "
+                             "TO chat_messages_unpartitioned_pkey")
+        for index in ("idx_chat_messages_session_seq", "ix_chat_messages_session_id", "ix_chat_messages_user_id",
+                      "idx_chat_messages_search", "idx_chat_messages_session_id", "idx_chat_messages_user_id"):
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index}")
+        # The partition key has to be part of every unique constraint
+        conn.exec_driver_sql(
+            "CREATE TABLE chat_messages (LIKE chat_messages_unpartitioned INCLUDING DEFAULTS, "
+            "PRIMARY KEY (id, seq), "
+            "FOREIGN KEY (session_id) REFERENCES chat_sessions (id) ON DELETE CASCADE) PARTITION BY RANGE (seq)"
+        )
+        conn.exec_driver_sql("CREATE UNIQUE INDEX idx_chat_messages_session_seq ON chat_messages (session_id, seq)")
+        conn.exec_driver_sql("CREATE INDEX ix_chat_messages_session_id ON chat_messages (session_id)")
+        conn.exec_driver_sql("CREATE INDEX ix_chat_messages_user_id ON chat_messages (user_id)")
+        conn.exec_driver_sql(f"CREATE INDEX idx_chat_messages_search ON chat_messages "
+                             f"USING GIN (user_id, to_tsvector('{SEARCH_CONFIG}', content))")
+        conn.exec_driver_sql(f"CREATE TABLE {MESSAGE_DEFAULT_PARTITION} PARTITION OF chat_messages DEFAULT")
+    else:
+        _sqlite_create_message_table(conn, MESSAGE_DEFAULT_PARTITION)
+
+    since = datetime.fromtimestamp(first_seq / 1_000_000, timezone.utc) if first_seq is not None else None
+    created = ensure_message_partitions(conn, months_ahead, since=since)
+    if conn.dialect.name != "postgresql" and not created:
+        _sqlite_rebuild_message_view(conn)
+    conn.exec_driver_sql(f"INSERT INTO chat_messages ({columns}) SELECT {columns} FROM chat_messages_unpartitioned")
+    conn.exec_driver_sql("DROP TABLE chat_messages_unpartitioned")
+    return created
+
+class MessageArchive:
+    """Compressed cold storage for the messages of archived sessions.
+
+    Each archival batch becomes one NDJSON.gz file in which every session is
+    its own gzip member, so one session is restored with a seek and a small
+    decompress, while `zcat` still reads the whole file. index.sqlite3 maps
+    session ids to (file, offset, length). Files are written under a
+    temporary name, synced and renamed before they are indexed, so an index
+    entry never points at a partial file.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.sqlite3")
+
+    def _index(self) -> sqlite3.Connection:
+        os.makedirs(self.directory, exist_ok=True)
+        index = sqlite3.connect(self.index_path, timeout=30)
+        index.execute(
+            "CREATE TABLE IF NOT EXISTS archived_sessions ("
+            "session_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, file TEXT NOT NULL, "
+            "offset INTEGER NOT NULL, length INTEGER NOT NULL, messages INTEGER NOT NULL, "
+            "first_seq INTEGER, last_seq INTEGER, archived_at TEXT NOT NULL)"
+        )
+        index.execute("CREATE INDEX IF NOT EXISTS archived_sessions_file ON archived_sessions (file)")
+        return index
+
+    def write(self, sessions: Dict[str, List[Dict[str, Any]]]) -> str:
+        """Store sessions' messages ({session_id: [message rows]}) as a new file and index them."""
+        now = datetime.now(timezone.utc)
+        name = f"messages-{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.ndjson.gz"
+        path = os.path.join(self.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with open(path + ".tmp", "wb") as f:
+            for session_id, messages in sessions.items():
+                payload = "".join(json.dumps(message, separators=(",", ":")) + "\n" for message in messages)
+                offset = f.tell()
+                f.write(gzip.compress(payload.encode(), mtime=0))
+                entries.append((
+                    session_id, messages[0]["user_id"], name, offset, f.tell() - offset, len(messages),
+                    messages[0]["seq"], messages[-1]["seq"], now.isoformat()
+                ))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        with closing(self._index()) as index, index:
+            index.executemany("INSERT OR REPLACE INTO archived_sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", entries)
+        return name
+
+    def read(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        """A session's archived messages in seq order, or None if it isn't archived."""
+        if not os.path.exists(self.index_path):
+            return None
+        with closing(self._index()) as index:
+            entry = index.execute(
+                "SELECT file, offset, length FROM archived_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if entry is None:
+            return None
+        with open(os.path.join(self.directory, entry[0]), "rb") as f:
+            f.seek(entry[1])
+            payload = gzip.decompress(f.read(entry[2]))
+        return [json.loads(line) for line in payload.splitlines()]
+
+    def remove(self, session_ids: List[str]) -> None:
+        """Forget sessions, deleting files none of the remaining entries point into."""
+        if not session_ids or not os.path.exists(self.index_path):
+            return
+        placeholders = ", ".join("?" * len(session_ids))
+        with closing(self._index()) as index, index:
+            files = [row[0] for row in index.execute(
+                f"SELECT DISTINCT file FROM archived_sessions WHERE session_id IN ({placeholders})", session_ids
+            )]
+            index.execute(f"DELETE FROM archived_sessions WHERE session_id IN ({placeholders})", session_ids)
+            unused = [
+                name for name in files
+                if index.execute("SELECT 1 FROM archived_sessions WHERE file = ? LIMIT 1", (name,)).fetchone() is None
+            ]
+        for name in unused:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        if not os.path.exists(self.index_path):
+            return {"sessions": 0, "messages": 0, "files": 0, "bytes": 0}
+        with closing(self._index()) as index:
+            sessions, messages, files = index.execute(
+                "SELECT COUNT(*), COALESCE(SUM(messages), 0), COUNT(DISTINCT file) FROM archived_sessions"
+            ).fetchone()
+        size = sum(
+            os.path.getsize(os.path.join(self.directory, name))
+            for name in os.listdir(self.directory) if name.endswith(".ndjson.gz")
+        )
+        return {"sessions": sessions, "messages": messages, "files": files, "bytes": size}
+
+message_archive = MessageArchive(ARCHIVE_DIR)
+
+sessions_rehydrated = metrics.register(Counter(
+    "aeroassist_sessions_rehydrated_total", "Archived sessions restored to chat_messages when read."))
+
+async def archive_idle_sessions(session_factory, archive: MessageArchive, idle_days: float, batch_sessions: int,
+                                now: Optional[datetime] = None) -> Dict[str, int]:
+    """Move the messages of sessions idle for idle_days out of chat_messages into the archive.
+
+    A batch is written to the archive before the sessions are marked and
+    their rows deleted. Sessions active again since they were selected are
+    left alone: any activity moves updated_at past the cutoff, and rows newer
+    than the batch are never deleted.
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=idle_days)
+    session_table = ChatSession.__table__
+    message_table = ChatMessage.__table__
+    totals = {"sessions": 0, "messages": 0}
+    while True:
+        async with session_factory() as db:
+            candidates = list((await db.execute(
+                select(session_table.c.id).where(
+                    session_table.c.archived_at.is_(None), session_table.c.updated_at < cutoff
+                ).order_by(session_table.c.updated_at).limit(batch_sessions)
+            )).scalars())
+            if not candidates:
+                return totals
+            rows = (await db.execute(
+                select(message_table).where(message_table.c.session_id.in_(candidates))
+                .order_by(message_table.c.session_id, message_table.c.seq)
+            )).mappings().all()
+
+        sessions: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            message = dict(row)
+            message["timestamp"] = message["timestamp"].isoformat() if message["timestamp"] else None
+            sessions.setdefault(message["session_id"], []).append(message)
+        if sessions:
+            await asyncio.to_thread(archive.write, sessions)
+
+        async with session_factory() as db:
+            # Archiving isn't activity, so updated_at stays as it was
+            archived = list((await db.execute(
+                update(session_table).where(
+                    session_table.c.id.in_(candidates),
+                    session_table.c.archived_at.is_(None),
+                    session_table.c.updated_at < cutoff
+                ).values(archived_at=datetime.now(timezone.utc), updated_at=session_table.c.updated_at)
+                .returning(session_table.c.id)
+            )).scalars())
+            if rows and archived:
+                await db.execute(delete(message_table).where(
+                    message_table.c.session_id.in_(archived),
+                    message_table.c.seq <= max(row["seq"] for row in rows)
+                ))
+            await db.commit()
+
+        skipped = set(sessions) - set(archived)
+        if skipped:
+            await asyncio.to_thread(archive.remove, list(skipped))
+        totals["sessions"] += len(archived)
+        totals["messages"] += sum(len(sessions.get(session_id, ())) for session_id in archived)
+
+async def run_archival(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """One pass of the retention job: archive idle sessions, then keep partitions
+    MESSAGE_PARTITIONS_AHEAD months ahead and drop the old ones left empty."""
+    summary: Dict[str, Any] = await archive_idle_sessions(
+        SessionLocal, message_archive, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SESSIONS, now
+    )
+    summary["partitions_created"], summary["partitions_dropped"] = [], []
+    async with engine.begin() as conn:
+        if await conn.run_sync(message_partitioning_enabled):
+            summary["partitions_created"] = await conn.run_sync(
+                ensure_message_partitions, MESSAGE_PARTITIONS_AHEAD, now
+            )
+            summary["partitions_dropped"] = await conn.run_sync(
+                drop_empty_message_partitions, (now or datetime.now()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+            )
+    return summary
+
+async def rehydrate_session(db: AsyncSession, session: ChatSession) -> None:
+    """Restore an archived session's messages to chat_messages and clear archived_at."""
+    start = time.perf_counter()
+    try:
+        messages = await asyncio.to_thread(message_archive.read, session.id)
+    except Exception as e:
+        logger.error("Reading archived session %s failed: %s", session.id, e)
+        raise HTTPException(status_code=503, detail="Archived conversation is unavailable, please try again later")
+
+    session_table = ChatSession.__table__
+    if messages is None:
+        # Either another worker restored it and removed the entry meanwhile, or the
+        # archive lost it; the session stays archived rather than coming back empty
+        archived_at = (await db.execute(
+            select(session_table.c.archived_at).where(session_table.c.id == session.id)
+        )).scalar_one_or_none()
+        if archived_at is None:
+            set_committed_value(session, "archived_at", None)
+            return
+        logger.error("Archived session %s has no entry in the archive index", session.id)
+        raise HTTPException(status_code=503, detail="Archived conversation is unavailable, please try again later")
+
+    # Another worker may have restored it already; duplicates are skipped
+    for message in messages:
+        message["timestamp"] = datetime.fromisoformat(message["timestamp"]) if message["timestamp"] else None
+    if messages:
+        await db.execute(insert_ignoring_duplicates(ChatMessage.__table__), messages)
+    await db.execute(
+        update(session_table).where(session_table.c.id == session.id).values(
+            archived_at=None, updated_at=session_table.c.updated_at
+        )
+    )
+    await db.commit()
+    set_committed_value(session, "archived_at", None)
+    await asyncio.to_thread(message_archive.remove, [session.id])
+    sessions_rehydrated.inc()
+    logger.info("Rehydrated archived session %s (%s messages) in %.1fms",
+                session.id, len(messages), (time.perf_counter() - start) * 1000)
+
+# ============================================================================
+# AUTHENTICATION
+# ============================================================================
+
+# Supabase client, created on first use by get_supabase() (or at startup when
+# every token has to be verified remotely)
+supabase: Optional["Client"] = None
+_supabase_attempted = False
+_supabase_lock = threading.Lock()
+
+def get_supabase() -> Optional["Client"]:
+    """Return the Supabase client, creating it on first call."""
+    global supabase, _supabase_attempted
+    if supabase is not None or _supabase_attempted:
+        return supabase
+
+    with _supabase_lock:
+        if supabase is not None or _supabase_attempted:
+            return supabase
+        _supabase_attempted = True
+        try:
+            if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+                from supabase import create_client
+                supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+                logger.info("Supabase client initialized successfully")
+            else:
+                logger.warning("Supabase credentials not configured - authentication will fail")
+                logger.warning("Please set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables")
+        except Exception as e:
+            logger.error("Failed to initialize Supabase client: %s", e)
+            supabase = None
+    return supabase
+
+# Security
+security = HTTPBearer()
+
+# Verified claims keyed by SHA-256 of the token, and JWKS signing keys by kid
+auth_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+jwks_cache = TTLCache(64, JWKS_CACHE_TTL_SECONDS)
+_jwks_lock = threading.Lock()
+# Created on the first JWKS fetch and reused, so refetches skip the TLS handshake
+_jwks_http: Optional[httpx.Client] = None
+
+class LocalVerificationUnavailable(Exception):
+    """Raised when a token can't be checked in-process and needs Supabase."""
+
+def _get_jwks_key(kid: Optional[str]) -> Dict[str, Any]:
+    """Return the JWKS signing key for kid, refetching once on a miss (key rotation)."""
+    global _jwks_http
+    key = jwks_cache.get(kid or "")
+    if key is not None:
+        return key
+    if not SUPABASE_JWKS_URL:
+        raise LocalVerificationUnavailable("JWKS URL not configured")
+
+    with _jwks_lock:
+        key = jwks_cache.get(kid or "")
+        if key is not None:
+            return key
+        headers = {"apikey": SUPABASE_SERVICE_ROLE_KEY} if SUPABASE_SERVICE_ROLE_KEY else {}
+        if _jwks_http is None:
+            _jwks_http = httpx.Client(timeout=5.0)
+        response = _jwks_http.get(SUPABASE_JWKS_URL, headers=headers)
+        response.raise_for_status()
+        keys = response.json().get("keys", [])
+        for jwk in keys:
+            jwks_cache.set(jwk.get("kid") or "", jwk)
+        if len(keys) == 1 and not kid:
+            return keys[0]
+
+    key = jwks_cache.get(kid or "")
+    if key is None:
+        raise JWTError(f"Signing key {kid} not found in JWKS")
+    return key
+
+def _verify_token_local(token: str) -> Dict[str, Any]:
+    """Validate signature, expiry and audience of a Supabase JWT in-process."""
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get("alg")
+    if algorithm == ALGORITHM:
+        if not LOCAL_JWT_SECRET:
+            raise LocalVerificationUnavailable("JWT_SECRET_KEY not configured")
+        key: Any = LOCAL_JWT_SECRET
+    elif algorithm in ("RS256", "ES256"):
+        key = _get_jwks_key(header.get("kid"))
+    else:
+        raise JWTError(f"Unsupported token algorithm: {algorithm}")
+
+    claims = jwt.decode(token, key, algorithms=[algorithm], audience=JWT_AUDIENCE)
+    if not claims.get("sub"):
+        raise JWTError("Token has no subject")
+    return claims
+
+def _verify_token_remote(token: str) -> Dict[str, Any]:
+    """Verify a token by asking Supabase Auth for its user."""
+    supabase = get_supabase()
+    if not supabase:
+        logger.error("Supabase client not initialized")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Authentication service not available"
+        )
+
+    # Get user directly from Supabase (more reliable)
+    try:
+        log_sampled(logging.INFO, "Verifying token with Supabase")
+        user_response = supabase.auth.get_user(token)
+        user_data = user_response.user
+
+        if not user_data:
+            logger.error("Supabase returned no user data")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid user credentials"
+            )
+
+        log_sampled(logging.INFO, "Verified user %s with Supabase", user_data.id)
+        claims = jwt.get_unverified_claims(token)
+        return {
+            "sub": user_data.id,
+            "email": user_data.email,
+            "role": getattr(user_data, 'role', None) or 'user',
+            "exp": claims.get("exp"),
+        }
+
+    except Exception as e:
+        logger.error("Supabase user verification failed: %s (%s)", e, type(e).__name__)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid user credentials"
+        )
+
+def verify_token_claims(token: str) -> Dict[str, Any]:
+    """Return verified claims for a token, consulting the claims cache first."""
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    claims = auth_cache.get(cache_key)
+    if claims is not None:
+        return claims
+
+    claims = None
+    if AUTH_VERIFY_MODE == "local":
+        try:
+            claims = _verify_token_local(token)
+        except LocalVerificationUnavailable as e:
+            logger.warning("Local token verification unavailable (%s), using Supabase", e)
+    if claims is None:
+        claims = _verify_token_remote(token)
+
+    # Never cache past the token's own expiry
+    ttl = float(AUTH_CACHE_TTL_SECONDS)
+    if claims.get("exp"):
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        auth_cache.set(cache_key, claims, ttl)
+    return claims
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    """Verify JWT token and return user information."""
+    try:
+        with StageTimer("auth"):
+            claims = verify_token_claims(credentials.credentials)
+        return User(
+            id=claims["sub"],
+            email=claims.get("email") or "",
+            role=claims.get("role") or "user"
+        )
+
+    except Exception as e:
+        logger.error("Token verification error: %s (%s)", e, type(e).__name__)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+def require_admin(user: User = Depends(verify_token)) -> User:
+    """Let through the service role and ADMIN_USER_IDS only."""
+    if user.role != "service_role" and user.id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return user
+
+# ============================================================================
+# SESSION MANAGEMENT
+# ============================================================================
+
+async def get_user_session(db: AsyncSession, session_id: str, user_id: str) -> Optional[ChatSession]:
+    """Return the session if it exists and belongs to the user."""
+    if write_behind is not None:
+        await write_behind.sync(session_id=session_id)
+    result = await db.execute(
+        select(ChatSession).where(
+            ChatSession.id == session_id,
+            ChatSession.user_id == user_id
+        )
+    )
+    session = result.scalar_one_or_none()
+    if session is not None and session.archived_at is not None:
+        await rehydrate_session(db, session)
+    return session
+
+async def get_session_messages(
+    db: AsyncSession,
+    session_id: str,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[ChatMessage]:
+    """Return messages of a session in conversation order.
+
+    With a limit, `after` pages forward from a seq, otherwise the newest page
+    (optionally older than `before`) is returned. Both walk the
+    (session_id, seq) index, so a page costs O(limit) regardless of history.
+    """
+    query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    if before is not None:
+        query = query.where(ChatMessage.seq < before)
+    if after is not None:
+        query = query.where(ChatMessage.seq > after)
+
+    if limit is None or after is not None:
+        query = query.order_by(ChatMessage.seq.asc()).limit(limit)
+        return list((await db.execute(query)).scalars().all())
+
+    query = query.order_by(ChatMessage.seq.desc()).limit(limit)
+    return list(reversed((await db.execute(query)).scalars().all()))
+
+async def save_message(db: AsyncSession, session_id: str, user_id: str, role: str, content: str, tokens_used: int = 0,
+                       response_id: Optional[str] = None) -> ChatMessage:
+    """Store one chat message, bump the session's message_count and commit.
+
+    With LLM_CHAIN_RESPONSES on, an assistant message also records
+    response_id (None when the reply can't be continued from) as the
+    session's last_response_id. In write-behind mode the message is queued
+    instead and db is not used.
+    """
+    chain = role == "assistant" and LLM_CHAIN_RESPONSES
+    if write_behind is not None:
+        message = ChatMessage(
+            id=str(uuid.uuid4()),
+            session_id=session_id,
+            user_id=user_id,
+            role=role,
+            content=content,
+            timestamp=datetime.now(),
+            tokens_used=tokens_used,
+            seq=next_message_seq()
+        )
+        await write_behind.add({
+            "kind": "message",
+            **{column: getattr(message, column) for column in (
+                "id", "session_id", "user_id", "role", "content", "timestamp", "tokens_used", "seq"
+            )},
+            **({"response_id": response_id} if chain else {})
+        })
+        await conversation_store.append(session_id, [message_to_dict(message)])
+        return message
+
+    message = ChatMessage(
+        session_id=session_id,
+        user_id=user_id,
+        role=role,
+        content=content,
+        tokens_used=tokens_used
+    )
+    db.add(message)
+    await db.execute(
+        update(ChatSession).where(
+            ChatSession.id == session_id
+        ).values(
+            message_count=ChatSession.message_count + 1,
+            updated_at=datetime.now(),
+            **({"last_response_id": response_id} if chain else {})
+        )
+    )
+    await db.commit()
+    await conversation_store.append(session_id, [message_to_dict(message)])
+    return message
+
+def message_to_dict(message: ChatMessage) -> Dict[str, Any]:
+    return {"seq": message.seq, "role": message.role, "content": message.content}
+
+async def load_history(db: AsyncSession, session_id: str) -> List[Dict[str, Any]]:
+    """Recent messages of a session, from the conversation cache or the database.
+
+    The session row was just read by get_or_create_session, after this
+    worker's queued writes were flushed, so its message_count tells whether
+    another worker has added messages since this one cached the session.
+    """
+    # No query: get_or_create_session already loaded it into this db session
+    session = await db.get(ChatSession, session_id)
+    total = session.message_count if session is not None else None
+    history = await conversation_store.get(session_id, total)
+    if history is None:
+        messages = await get_session_messages(db, session_id, limit=CONVERSATION_CACHE_WINDOW)
+        history = [message_to_dict(msg) for msg in messages]
+        await conversation_store.set(session_id, history, total)
+    return history
+
+async def response_chain(db: AsyncSession, session_id: str, history: List[Dict[str, Any]]) -> Optional[str]:
+    """The stored response a turn can continue from, or None to send the full context.
+
+    A chain only holds while the session's last message is the reply that
+    was stored, and that reply is recent enough for OpenAI to still keep it.
+    """
+    if not LLM_CHAIN_RESPONSES or SessionLocal is None or not history or history[-1]["role"] != "assistant":
+        return None
+    # seq is microseconds since the epoch
+    if time.time() - history[-1]["seq"] / 1_000_000 > LLM_CHAIN_MAX_AGE_DAYS * DAY_SECONDS:
+        return None
+    # Already loaded by get_or_create_session
+    session = await db.get(ChatSession, session_id)
+    return session.last_response_id if session is not None else None
+
+def client_history(request: ChatRequest) -> List[Dict[str, Any]]:
+    """Client-supplied history, only used when there is no database."""
+    return [
+        {"seq": index, "role": msg.role, "content": msg.content}
+        for index, msg in enumerate(request.conversation_history or [])
+    ]
+
+def encode_session_cursor(session: ChatSession) -> str:
+    """Opaque keyset cursor pointing just past a session in the sessions list."""
+    raw = json.dumps([session.updated_at.isoformat(), session.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_session_cursor(cursor: str) -> tuple:
+    try:
+        updated_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), session_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_user_sessions(db: AsyncSession, user_id: str, limit: int, cursor: Optional[str] = None) -> tuple:
+    """Return one page of a user's sessions, most recently active first, and the next cursor."""
+    if write_behind is not None:
+        await write_behind.sync(user_id=user_id)
+    query = select(ChatSession).where(ChatSession.user_id == user_id)
+    if cursor:
+        query = query.where(
+            tuple_(ChatSession.updated_at, ChatSession.id) < decode_session_cursor(cursor)
+        )
+    query = query.order_by(ChatSession.updated_at.desc(), ChatSession.id.desc()).limit(limit + 1)
+
+    sessions = list((await db.execute(query)).scalars().all())
+    next_cursor = encode_session_cursor(sessions[limit - 1]) if len(sessions) > limit else None
+    return sessions[:limit], next_cursor
+
+async def get_or_create_session(user_id: str, session_id: Optional[str], db: AsyncSession) -> str:
+    """Get existing session or create new one."""
+    # If database is not available, generate a simple session ID
+    if SessionLocal is None:
+        if session_id:
+            return session_id
+        else:
+            return str(uuid.uuid4())
+    
+    if session_id:
+        # Check if session exists and belongs to user
+        session = await get_user_session(db, session_id, user_id)
+        if session:
+            # Update last activity
+            if write_behind is not None:
+                await write_behind.add({"kind": "touch", "session_id": session_id, "user_id": user_id, "updated_at": datetime.now()})
+                return session_id
+            session.updated_at = datetime.now()
+            await db.commit()
+            return session_id
+    
+    # Create new session. Timestamps are set here rather than by the database
+    # so the keyset cursor compares like with like on every backend.
+    now = datetime.now()
+    new_session = ChatSession(id=str(uuid.uuid4()), user_id=user_id, created_at=now, updated_at=now)
+    if write_behind is not None:
+        await write_behind.add({"kind": "session", "session_id": new_session.id, "user_id": user_id, "created_at": now, "updated_at": now})
+    else:
+        db.add(new_session)
+        await db.commit()
+    await conversation_store.set(new_session.id, [], 0)
+    return new_session.id
+
+# ============================================================================
+# HISTORY EXPORT
+# ============================================================================
+
+# Rows fetched per round trip from the server-side cursor, and the size of
+# the chunks handed to the response
+EXPORT_FETCH_ROWS = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+async def export_user_history(session_factory, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """Every session of a user, each followed by its messages, as export records.
+
+    Sessions come most recently active first, messages in seq order. It is
+    one joined query read through a server-side cursor EXPORT_FETCH_ROWS rows
+    at a time, so memory stays flat however long the history is. Archived
+    sessions are read from the archive without being restored. The last
+    record, {"type": "end", ...}, has the totals, so a truncated export
+    can be told from a complete one.
+    """
+    if write_behind is not None:
+        await write_behind.sync(user_id=user_id)
+
+    session_table = ChatSession.__table__
+    message_table = ChatMessage.__table__
+    query = (
+        select(
+            session_table.c.id, session_table.c.created_at, session_table.c.updated_at,
+            session_table.c.message_count, session_table.c.tokens_used, session_table.c.archived_at,
+            message_table.c.seq, message_table.c.role, message_table.c.content, message_table.c.timestamp,
+            message_table.c.tokens_used.label("message_tokens")
+        )
+        .select_from(session_table.outerjoin(message_table, message_table.c.session_id == session_table.c.id))
+        .where(session_table.c.user_id == user_id)
+        .order_by(session_table.c.updated_at.desc(), session_table.c.id.desc(), message_table.c.seq)
+        .execution_options(yield_per=EXPORT_FETCH_ROWS)
+    )
+
+    sessions = messages = 0
+    current = None
+    async with session_factory() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            for row in rows:
+                if row.id != current:
+                    current = row.id
+                    sessions += 1
+                    yield {
+                        "type": "session",
+                        "id": row.id,
+                        "created_at": row.created_at.isoformat() if row.created_at else None,
+                        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+                        "message_count": row.message_count,
+                        "tokens_used": row.tokens_used,
+                        "archived": row.archived_at is not None
+                    }
+                    if row.archived_at is not None:
+                        for message in await asyncio.to_thread(message_archive.read, row.id) or ():
+                            messages += 1
+                            yield {
+                                "type": "message", "session_id": row.id, "seq": message["seq"],
+                                "role": message["role"], "content": message["content"],
+                                "timestamp": message["timestamp"], "tokens_used": message["tokens_used"] or 0
+                            }
+                if row.seq is not None:
+                    messages += 1
+                    yield {
+                        "type": "message", "session_id": row.id, "seq": row.seq, "role": row.role,
+                        "content": row.content, "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                        "tokens_used": row.message_tokens or 0
+                    }
+    yield {"type": "end", "user_id": user_id, "sessions": sessions, "messages": messages}
+
+async def ndjson_chunks(records: AsyncIterator[Dict[str, Any]], compress: bool = False) -> AsyncIterator[bytes]:
+    """Encode records as NDJSON in chunks of about EXPORT_CHUNK_BYTES, gzipped as they go with compress."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer: List[bytes] = []
+    size = 0
+    async for record in records:
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+# ============================================================================
+# MESSAGE SEARCH
+# ============================================================================
+
+# Full-text search over a user's messages. On Postgres it is served by a GIN
+# index on (user_id, to_tsvector(SEARCH_CONFIG, content)) (btree_gin), so a
+# user's matches come straight from the index. SQLite uses FTS5 over a side
+# table that triggers on chat_messages keep in step; every row carries an
+# owner token, so the user scoping happens inside the full-text index as
+# well. Archived sessions are only searchable again once restored.
+SEARCH_CONFIG = "english"  # also part of idx_chat_messages_search, don't change one without the other
+SEARCH_MARK = "**"
+SEARCH_SNIPPET_WORDS = 16
+
+def _sqlite_create_search_triggers(conn) -> None:
+    # chat_messages is a table, or a view when it is partitioned
+    timing = "INSTEAD OF" if message_partitioning_enabled(conn) else "AFTER"
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS chat_messages_search_insert {timing} INSERT ON chat_messages BEGIN "
+        "INSERT OR IGNORE INTO chat_messages_search "
+        "(message_id, user_id, session_id, seq, role, timestamp, content, owner) VALUES "
+        "(NEW.id, NEW.user_id, NEW.session_id, NEW.seq, NEW.role, NEW.timestamp, NEW.content, 'u' || hex(NEW.user_id)); "
+        "END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS chat_messages_search_delete {timing} DELETE ON chat_messages BEGIN "
+        "DELETE FROM chat_messages_search WHERE message_id = OLD.id; "
+        "END"
+    )
+
+def ensure_sqlite_search_index(conn) -> None:
+    """Create the FTS5 search index and its triggers if missing, indexing existing messages once."""
+    if conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'chat_messages_search'").first() is None:
+        conn.exec_driver_sql(
+            "CREATE TABLE chat_messages_search ("
+            "search_id INTEGER PRIMARY KEY, message_id TEXT NOT NULL UNIQUE, user_id TEXT NOT NULL, "
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, timestamp TEXT, "
+            "content TEXT NOT NULL, owner TEXT NOT NULL)"
+        )
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE chat_messages_fts USING fts5(content, owner, "
+            "content='chat_messages_search', content_rowid='search_id', tokenize='porter unicode61')"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER chat_messages_search_fts_insert AFTER INSERT ON chat_messages_search BEGIN "
+            "INSERT INTO chat_messages_fts (rowid, content, owner) VALUES (NEW.search_id, NEW.content, NEW.owner); "
+            "END"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER chat_messages_search_fts_delete AFTER DELETE ON chat_messages_search BEGIN "
+            "INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content, owner) "
+            "VALUES ('delete', OLD.search_id, OLD.content, OLD.owner); "
+            "END"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO chat_messages_search (message_id, user_id, session_id, seq, role, timestamp, content, owner) "
+            "SELECT id, user_id, session_id, seq, role, timestamp, content, 'u' || hex(user_id) FROM chat_messages"
+        )
+    _sqlite_create_search_triggers(conn)
+
+def fts5_match(user_id: str, query: str) -> Optional[str]:
+    """FTS5 expression for the user's messages containing every word of query
+    (a trailing * makes a word a prefix), or None if it has no words."""
+    terms = [f'"{word}"{star}' for word, star in re.findall(r"(\w+)(\*?)", query)]
+    if not terms:
+        return None
+    owner = "u" + user_id.encode().hex().upper()
+    return f'owner: "{owner}" AND content: ({" ".join(terms)})'
+
+def encode_search_cursor(hit: Dict[str, Any]) -> str:
+    raw = json.dumps([hit["score"], hit["seq"], hit["session_id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_search_cursor(cursor: str) -> tuple:
+    try:
+        score, seq, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), int(seq), str(session_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def search_messages(db: AsyncSession, user_id: str, query: str, limit: int,
+                          cursor: Optional[str] = None) -> tuple:
+    """Return one page of the user's messages matching query, best match first, and the next cursor.
+
+    Ties in score go to the newer message. The keyset cursor carries the
+    last hit's (score, seq, session_id), so later pages cost the same as
+    the first.
+    """
+    if write_behind is not None:
+        await write_behind.sync(user_id=user_id)
+    params: Dict[str, Any] = {"user_id": user_id, "limit": limit + 1}
+    if cursor:
+        params["after_score"], params["after_seq"], params["after_session"] = decode_search_cursor(cursor)
+
+    if engine.dialect.name == "postgresql":
+        score = f"ts_rank_cd(to_tsvector('{SEARCH_CONFIG}', m.content), q.query)"
+        keyset = f"AND ({score}, m.seq, m.session_id) < (:after_score, :after_seq, :after_session)" if cursor else ""
+        # Headlines are costly, so only the page gets them
+        rows = (await db.execute(text(f"""
+            SELECT page.session_id, page.seq, page.role, page.timestamp, page.score,
+                   ts_headline('{SEARCH_CONFIG}', page.content, page.query, :headline) AS snippet
+            FROM (
+                SELECT m.session_id, m.seq, m.role, m.timestamp, m.content, q.query, {score} AS score
+                FROM chat_messages m, websearch_to_tsquery('{SEARCH_CONFIG}', :query) AS q(query)
+                WHERE m.user_id = :user_id AND to_tsvector('{SEARCH_CONFIG}', m.content) @@ q.query {keyset}
+                ORDER BY score DESC, m.seq DESC, m.session_id DESC
+                LIMIT :limit
+            ) page
+            ORDER BY page.score DESC, page.seq DESC, page.session_id DESC
+        """), dict(params, query=query, headline=(
+            f"StartSel={SEARCH_MARK}, StopSel={SEARCH_MARK}, MaxWords={SEARCH_SNIPPET_WORDS}, "
+            f"MinWords={SEARCH_SNIPPET_WORDS // 2}, MaxFragments=2"
+        )))).mappings().all()
+    else:
+        match = fts5_match(user_id, query)
+        if match is None:
+            return [], None
+        try:
+            score = "-bm25(chat_messages_fts, 1.0, 0.0)"
+            keyset = f"AND ({score}, s.seq, s.session_id) < (:after_score, :after_seq, :after_session)" if cursor else ""
+            page = (await db.execute(text(f"""
+                SELECT s.search_id, s.session_id, s.seq, s.role, s.timestamp, {score} AS score
+                FROM chat_messages_fts JOIN chat_messages_search s ON s.search_id = chat_messages_fts.rowid
+                WHERE chat_messages_fts MATCH :match AND s.user_id = :user_id {keyset}
+                ORDER BY score DESC, s.seq DESC, s.session_id DESC
+                LIMIT :limit
+            """), dict(params, match=match))).mappings().all()
+            # SQLite would build a snippet for every match before sorting, so only the page gets one
+            snippets = dict((await db.execute(
+                text(f"""
+                    SELECT rowid, snippet(chat_messages_fts, 0, :mark, :mark, '…', {SEARCH_SNIPPET_WORDS})
+                    FROM chat_messages_fts WHERE chat_messages_fts MATCH :match AND rowid IN :ids
+                """).bindparams(bindparam("ids", expanding=True)),
+                {"match": match, "mark": SEARCH_MARK, "ids": [row["search_id"] for row in page]}
+            )).all()) if page else {}
+        except OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            raise HTTPException(status_code=503, detail="Search index not set up, run migrate.py")
+        rows = [dict(row, snippet=snippets.get(row["search_id"])) for row in page]
+
+    hits = [
+        {
+            "session_id": row["session_id"],
+            "seq": row["seq"],
+            "role": row["role"],
+            "snippet": row["snippet"],
+            "timestamp": (datetime.fromisoformat(row["timestamp"]) if isinstance(row["timestamp"], str)
+                          else row["timestamp"]).isoformat() if row["timestamp"] else None,
+            "score": row["score"]
+        }
+        for row in rows
+    ]
+    next_cursor = encode_search_cursor(hits[limit - 1]) if len(hits) > limit else None
+    return hits[:limit], next_cursor
+
+# ============================================================================
+# POLICY RETRIEVAL
+# ============================================================================
+
+# Policy documents are chunked and indexed offline (build_policy_index.py)
+# into one file that workers memory-map read-only, so it costs no parse at
+# load and its pages are shared between workers through the page cache.
+# Terms are stored as 64-bit hashes with precomputed BM25 weights per chunk:
+# a query is a binary search per term and a sum over its postings.
+#
+# Layout, native byte order: header, sorted term hashes (u64), posting
+# starts per term (u32, one extra), posting chunk ids (u32), posting weights
+# (f32), chunk record offsets (u64, one extra), then the chunk records as
+# JSON. Sections are 8-byte aligned.
+POLICY_INDEX_MAGIC = b"AAPOLIX1"
+POLICY_INDEX_HEADER = struct.Struct("=8sBxxxIII6Q")
+POLICY_CHUNK_WORDS = 150
+POLICY_DOCUMENT_SUFFIXES = (".md", ".txt")
+POLICY_MAX_QUERY_TERMS = 32
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_POLICY_TOKEN = re.compile(r"[a-z0-9]+")
+POLICY_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in is it its me my no not "
+    "of on or our so that the their then there these they this to was we what when where which "
+    "will with would you your".split()
+)
+
+def _policy_stem(term: str) -> str:
+    # Light suffix folding so "bags", "rebooked" and "changing" meet "bag",
+    # "rebook" and "change"; both sides of the index use the same folding
+    if len(term) > 5 and term.endswith("ing"):
+        term = term[:-3]
+    elif len(term) > 4 and term.endswith("ies"):
+        term = term[:-3] + "y"
+    elif len(term) > 4 and term.endswith("ed"):
+        term = term[:-2]
+    elif len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        term = term[:-1]
+    return term[:-1] if len(term) > 3 and term.endswith("e") else term
+
+def policy_terms(text: str) -> List[str]:
+    return [_policy_stem(t) for t in _POLICY_TOKEN.findall(text.lower()) if t not in POLICY_STOPWORDS]
+
+def policy_term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), "little")
+
+def chunk_policy_document(text: str, chunk_words: int = POLICY_CHUNK_WORDS) -> List[tuple]:
+    """Split a document into (heading, text) chunks of about chunk_words words.
+
+    Chunks follow paragraph boundaries and never span a Markdown heading;
+    a paragraph longer than chunk_words is split on word boundaries.
+    """
+    chunks = []
+    heading, paragraphs, words = "", [], 0
+
+    def flush() -> None:
+        nonlocal paragraphs, words
+        if paragraphs:
+            chunks.append((heading, "\n\n".join(paragraphs)))
+        paragraphs, words = [], 0
+
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        if re.match(r"#{1,6}\s", block):
+            flush()
+            title, _, block = block.partition("\n")
+            heading = title.lstrip("#").strip()
+            block = block.strip()
+            if not block:
+                continue
+        block_words = block.split()
+        if len(block_words) > chunk_words:
+            flush()
+            while len(block_words) > chunk_words:
+                chunks.append((heading, " ".join(block_words[:chunk_words])))
+                block_words = block_words[chunk_words:]
+            block = " ".join(block_words)
+        if words + len(block_words) > chunk_words:
+            flush()
+        paragraphs.append(block)
+        words += len(block_words)
+    flush()
+    return chunks
+
+def build_policy_index(source_dir: str, output_path: str, chunk_words: int = POLICY_CHUNK_WORDS) -> Dict[str, Any]:
+    """Chunk and index every .md/.txt file under source_dir into output_path.
+
+    The index is written next to output_path and renamed over it, so
+    workers still mapping the old file keep reading it until they reload.
+    """
+    records, postings = [], {}
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(POLICY_DOCUMENT_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8") as f:
+                document = f.read()
+            source = os.path.relpath(path, source_dir)
+            for heading, chunk in chunk_policy_document(document, chunk_words):
+                terms = policy_terms(f"{heading}\n{chunk}")
+                if not terms:
+                    continue
+                chunk_id = len(records)
+                records.append((json.dumps({"source": source, "heading": heading, "text": chunk}).encode(), len(terms)))
+                for term, tf in collections.Counter(terms).items():
+                    postings.setdefault(term, []).append((chunk_id, tf))
+
+    chunk_count = len(records)
+    average_length = sum(length for _, length in records) / chunk_count if chunk_count else 1.0
+    hashes = array("Q")
+    starts = array("I", [0])
+    chunk_ids = array("I")
+    weights = array("f")
+    for term_hash, term in sorted((policy_term_hash(term), term) for term in postings):
+        if hashes and hashes[-1] == term_hash:
+            raise ValueError(f"Term hash collision on {term!r}; rename the term in the documents")
+        entries = postings[term]
+        idf = math.log(1 + (chunk_count - len(entries) + 0.5) / (len(entries) + 0.5))
+        hashes.append(term_hash)
+        for chunk_id, tf in entries:
+            length = records[chunk_id][1]
+            chunk_ids.append(chunk_id)
+            weights.append(idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)))
+        starts.append(len(chunk_ids))
+
+    offsets = array("Q", [0])
+    for record, _ in records:
+        offsets.append(offsets[-1] + len(record))
+    sections = [hashes.tobytes(), starts.tobytes(), chunk_ids.tobytes(), weights.tobytes(), offsets.tobytes(),
+                b"".join(record for record, _ in records)]
+    positions, position = [], POLICY_INDEX_HEADER.size
+    for section in sections:
+        position += -position % 8
+        positions.append(position)
+        position += len(section)
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(POLICY_INDEX_HEADER.pack(POLICY_INDEX_MAGIC, sys.byteorder == "little", chunk_count,
+                                         len(hashes), len(chunk_ids), *positions))
+        for section, position in zip(sections, positions):
+            f.write(b"\0" * (position - f.tell()))
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return {"chunks": chunk_count, "terms": len(hashes), "postings": len(chunk_ids), "bytes": position}
+
+class PolicyIndex:
+    """A built policy index, memory-mapped read-only.
+
+    search() works on views into the mapping; only the chunk records it
+    returns are decoded.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        (magic, little_endian, self.chunk_count, term_count, posting_count,
+         *positions) = POLICY_INDEX_HEADER.unpack_from(self._mmap)
+        if magic != POLICY_INDEX_MAGIC or bool(little_endian) != (sys.byteorder == "little"):
+            raise ValueError(f"{path} is not a policy index built for this platform")
+        view = memoryview(self._mmap)
+
+        def section(index: int, length: int, fmt: str, size: int) -> memoryview:
+            start = positions[index]
+            if start + length * size > len(view):
+                raise ValueError(f"{path} is truncated")
+            return view[start:start + length * size].cast(fmt)
+
+        self._hashes = section(0, term_count, "Q", 8)
+        self._starts = section(1, term_count + 1, "I", 4)
+        self._chunk_ids = section(2, posting_count, "I", 4)
+        self._weights = section(3, posting_count, "f", 4)
+        self._offsets = section(4, self.chunk_count + 1, "Q", 8)
+        self._records = view[positions[5]:]
+        self.term_count = term_count
+        if hasattr(self._mmap, "madvise"):
+            # Fault the pages in now rather than on the first queries
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+
+    def chunk(self, chunk_id: int) -> Dict[str, Any]:
+        return json.loads(bytes(self._records[self._offsets[chunk_id]:self._offsets[chunk_id + 1]]))
+
+    def search(self, query: str, k: int, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """The k best chunks for query by BM25, as dicts with source, heading, text and score."""
+        scores: Dict[int, float] = {}
+        terms = list(dict.fromkeys(policy_terms(query)))[:POLICY_MAX_QUERY_TERMS]
+        for term in terms:
+            term_hash = policy_term_hash(term)
+            index = bisect.bisect_left(self._hashes, term_hash)
+            if index == self.term_count or self._hashes[index] != term_hash:
+                continue
+            start, end = self._starts[index], self._starts[index + 1]
+            for chunk_id, weight in zip(self._chunk_ids[start:end], self._weights[start:end]):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [dict(self.chunk(chunk_id), score=round(score, 3)) for chunk_id, score in best if score >= min_score]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "chunks": self.chunk_count, "terms": self.term_count, "bytes": len(self._mmap)}
+
+policy_index: Optional[PolicyIndex] = None
+policy_reloads = metrics.register(Counter(
+    "aeroassist_policy_index_reloads_total", "Policy index loads by outcome.", ("result",)))
+metrics.register(Gauge(
+    "aeroassist_policy_index_chunks", "Chunks in the loaded policy index.", (),
+    lambda: {(): policy_index.chunk_count} if policy_index is not None else {}))
+
+def _load_policy_index(path: str, current: Optional[PolicyIndex]) -> Optional[PolicyIndex]:
+    """Map the index at path if it is new or has been rebuilt, else return None."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if current is not None and current.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+        return None
+    return PolicyIndex(path)
+
+async def reload_policy_index(path: Optional[str] = None) -> bool:
+    """Swap in the index at path if it changed; the load runs in a thread.
+
+    Requests keep using the previous index until the new one is mapped, and
+    a bad file leaves the previous one in place.
+    """
+    global policy_index
+    try:
+        loaded = await asyncio.to_thread(_load_policy_index, path or POLICY_INDEX_PATH, policy_index)
+    except Exception as e:
+        policy_reloads.inc("error")
+        logger.error("Policy index reload failed, keeping the current one: %s", e)
+        return False
+    if loaded is None:
+        return False
+    policy_index = loaded
+    policy_reloads.inc("loaded")
+    if response_cache is not None:
+        # Cached answers were grounded in the previous policies
+        response_cache.clear()
+    logger.info("Policy index loaded: %s chunks, %s terms from %s", loaded.chunk_count, loaded.term_count, loaded.path)
+    return True
+
+async def watch_policy_index() -> None:
+    while True:
+        await asyncio.sleep(POLICY_RELOAD_SECONDS)
+        await reload_policy_index()
+
+def retrieve_policy_context(user_message: str, messages: List[Dict[str, str]]) -> str:
+    """Policy excerpts for a turn, formatted for the instructions, or "" if none match.
+
+    The query is the new message plus the previous user turn, so follow-ups
+    like "and for infants?" still find the policy under discussion.
+    """
+    index = policy_index
+    if index is None:
+        return ""
+    previous = next((msg["content"] for msg in reversed(messages) if msg["role"] == "user"), "")
+    with StageTimer("retrieval"):
+        hits = index.search(f"{user_message}\n{previous}", POLICY_TOP_K, POLICY_MIN_SCORE)
+    excerpts, used = [], 0
+    for hit in hits:
+        excerpt = f"[{hit['source']}{' - ' + hit['heading'] if hit['heading'] else ''}]\n{hit['text']}"
+        cost = estimate_tokens(excerpt)
+        if used + cost > POLICY_CONTEXT_TOKENS:
+            break
+        excerpts.append(excerpt)
+        used += cost
+    if not excerpts:
+        return ""
+    return ("\n\nAnswer from these airline policy excerpts when they apply, and say so when they "
+            "don't cover the question:\n\n" + "\n\n".join(excerpts))
+
+# ============================================================================
+# AI PROCESSING
+# ============================================================================
+
+SYSTEM_PROMPT = "You are AeroAssist, a helpful airline assistant. Help users with flight information, bookings, and travel questions."
+
+# Keyed by the route list and system prompt, so changing either starts a fresh cache
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_NEAR_DUPLICATES,
+    RESPONSE_CACHE_SIMILARITY,
+    namespace=f"{LLM_ROUTES}\x00{SYSTEM_PROMPT}"
+) if RESPONSE_CACHE_ENABLED else None
+
+# Optional exact tokenizer, loaded by load_token_encoding() at startup; the
+# character heuristic is close enough for budgeting
+_token_encoding = None
+
+def load_token_encoding() -> None:
+    """Load tiktoken's encoding; blocking (it may download its file), so run it in a thread."""
+    global _token_encoding
+    try:
+        import tiktoken
+        _token_encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("tiktoken unavailable, estimating token counts: %s", e)
+
+def estimate_tokens(content: str) -> int:
+    """Count tokens with tiktoken when it loaded at startup, else estimate ~4 characters per token."""
+    if _token_encoding is not None:
+        return len(_token_encoding.encode(content))
+    return len(content) // 4 + 1
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    # Each message carries a few tokens of role/framing overhead
+    return estimate_tokens(message["content"]) + 4
+
+# session_id -> (last seq folded into the summary, summary lines)
+summary_cache = TTLCache(CONTEXT_SUMMARY_CACHE_SIZE, 3600)
+
+def _summary_line(message: Dict[str, str], max_words: int = 30) -> str:
+    words = message["content"].split()
+    text = " ".join(words[:max_words]) + (" ..." if len(words) > max_words else "")
+    return f"{message['role']}: {text}"
+
+def assemble_context(
+    history: List[Dict[str, str]],
+    user_message: str,
+    summary: Optional[tuple] = None
+) -> tuple:
+    """Fit history into the token budget for one turn.
+
+    The newest messages are kept verbatim while they fit. Anything older is
+    folded into a rolling extractive summary, which keeps the newest lines
+    that fit CONTEXT_SUMMARY_TOKENS. `summary` is the state returned by the
+    previous turn; messages already folded into it are never re-read, so a
+    turn costs O(new messages) rather than O(session length).
+
+    History messages carry a `seq`; the summary state records the last seq
+    folded in, so it stays valid when history is a sliding window.
+
+    Returns (messages for the model, new summary state).
+    """
+    covered_seq, lines = summary if summary else (-1, [])
+    if history and covered_seq > history[-1]["seq"]:
+        # History was reset underneath the summary (client-supplied history)
+        covered_seq, lines = -1, []
+    summarized = bisect.bisect_right(history, covered_seq, key=lambda msg: msg["seq"])
+
+    available = (
+        CONTEXT_TOKEN_BUDGET
+        - estimate_tokens(SYSTEM_PROMPT)
+        - (POLICY_CONTEXT_TOKENS if policy_index is not None else 0)
+        - estimate_message_tokens({"role": "user", "content": user_message})
+        - (CONTEXT_SUMMARY_TOKENS if lines or history else 0)
+    )
+    keep_from = len(history)
+    used = 0
+    while keep_from > summarized:
+        cost = estimate_message_tokens(history[keep_from - 1])
+        if used + cost > available:
+            break
+        used += cost
+        keep_from -= 1
+
+    if keep_from > summarized:
+        covered_seq = history[keep_from - 1]["seq"]
+        lines = lines + [_summary_line(msg) for msg in history[summarized:keep_from]]
+        total = 0
+        for start in range(len(lines) - 1, -1, -1):
+            total += estimate_tokens(lines[start]) + 1
+            if total > CONTEXT_SUMMARY_TOKENS:
+                lines = lines[start + 1:]
+                break
+
+    messages = []
+    if lines:
+        messages.append({
+            "role": "system",
+            "content": "Summary of the earlier conversation:\n" + "\n".join(lines)
+        })
+    messages.extend({"role": msg["role"], "content": msg["content"]} for msg in history[keep_from:])
+    return messages, (covered_seq, lines)
+
+def prepare_context(session_id: str, history: List[Dict[str, str]], user_message: str) -> List[Dict[str, str]]:
+    """Assemble a session's context within budget, reusing its cached summary."""
+    messages, summary = assemble_context(history, user_message, summary_cache.get(session_id))
+    if summary[1]:
+        summary_cache.set(session_id, summary)
+    return messages
+
+def build_openai_request(messages: List[Dict[str, str]], user_message: str) -> Dict[str, Any]:
+    """Build the Responses API arguments for a chat turn.
+
+    `messages` is the already budgeted context; the system prompt travels
+    once, as `instructions`, with the policy excerpts retrieved for the turn.
+    """
+    conversation_messages = list(messages)
+    conversation_messages.append({"role": "user", "content": user_message})
+
+    log_sampled(logging.INFO, "Processing chat request with %s messages in context", len(conversation_messages))
+
+    request_args = {
+        "model": OPENAI_MODEL,
+        "input": conversation_messages,
+        "instructions": SYSTEM_PROMPT + retrieve_policy_context(user_message, messages),
+        "temperature": 0.7,
+    }
+    if LLM_CHAIN_RESPONSES:
+        # Every reply may become the start of a chain
+        request_args["store"] = True
+    return request_args
+
+class SingleFlight:
+    """Coalesces identical in-flight upstream calls.
+
+    The first caller for a key starts the call as its own task; callers that
+    arrive while it runs await the same task, so cancelling any one request
+    doesn't cancel the call for the rest. Streams are shared through a
+    replay buffer, so late joiners still receive every event from the start,
+    and the upstream stream is cancelled once its last subscriber leaves.
+    Every caller reports the call's token usage, so each is billed and
+    counted against its quota as if it had made the call;
+    coalesced_tokens totals what the followers reported on top of upstream.
+    """
+
+    def __init__(self):
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.coalesced_tokens = 0
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, "_StreamBroadcast"] = {}
+
+    async def do(self, key: str, call) -> tuple:
+        """Await call() once per key; returns (result, whether this caller started it)."""
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            self.upstream_calls += 1
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task), leader
+
+    def stream(self, key: str, source_factory) -> tuple:
+        """Subscribe to the shared stream for key; returns (event iterator, whether this caller started it)."""
+        broadcast = self._streams.get(key)
+        # One whose subscribers all left is being cancelled, so it can't be joined
+        leader = broadcast is None or broadcast.abandoned
+        if leader:
+            self.upstream_calls += 1
+            broadcast = _StreamBroadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(broadcast.pump(source_factory()))
+            broadcast.task.add_done_callback(
+                lambda _: self._streams.pop(key) if self._streams.get(key) is broadcast else None)
+        else:
+            self.coalesced += 1
+        return broadcast.subscribe(), leader
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "coalesced_tokens": self.coalesced_tokens,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+class _StreamBroadcast:
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def pump(self, source: AsyncIterator[Dict[str, Any]]) -> None:
+        try:
+            async for event in source:
+                self.events.append(event)
+                self._notify()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        index = 0
+        self.subscribers += 1
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done and self.task is not None:
+                # Nobody is left to read the rest, so stop paying for it
+                self.abandoned = True
+                self.task.cancel()
+
+llm_flights = SingleFlight()
+
+def request_fingerprint(request_args: Dict[str, Any], previous_response_id: Optional[str] = None) -> str:
+    """Identity of an upstream request: model, instructions, assembled input, sampling settings and chain."""
+    if previous_response_id:
+        request_args = dict(request_args, previous_response_id=previous_response_id)
+    return hashlib.sha256(json.dumps(request_args, sort_keys=True).encode()).hexdigest()
+
+def record_upstream_usage(usage) -> None:
+    if usage is not None:
+        upstream_tokens.inc("input", amount=getattr(usage, 'input_tokens', 0) or 0)
+        upstream_tokens.inc("output", amount=getattr(usage, 'output_tokens', 0) or 0)
+
+class UpstreamBusy(Exception):
+    """Raised when an upstream call can't be admitted in time; maps to a 503."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class ResponseChainBroken(Exception):
+    """Raised when OpenAI no longer has the response a turn continues from."""
+
+response_chain_turns = metrics.register(Counter(
+    "aeroassist_response_chain_turns_total",
+    "Turns with LLM_CHAIN_RESPONSES on: chained, sent with the full context, or chained but rebuilt.", ("outcome",)))
+
+class TokenBucket:
+    """Refills rate_per_minute units a minute, holding at most a minute's worth. 0 means unlimited."""
+
+    def __init__(self, rate_per_minute: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount can be taken; requests larger than the bucket wait for a full one."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        """Remove amount; may go negative to record usage above an estimate."""
+        if self.rate:
+            self._refill()
+            self.level -= amount
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Seconds to wait from retry-after-ms or Retry-After (seconds or an HTTP date)."""
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+PRIORITY_FOLLOW_UP = 0
+PRIORITY_NEW_SESSION = 1
+# Offline batch prompts, which nobody is waiting on
+PRIORITY_BATCH = 2
+
+class UpstreamScheduler:
+    """Admission control, rate limiting and retries for OpenAI calls.
+
+    Callers queue in a heap ordered by (priority, arrival), so follow-up turns
+    overtake new sessions. The head is admitted once an in-flight slot is
+    free and both the requests-per-minute and tokens-per-minute buckets can
+    cover it; otherwise a timer wakes the queue when they will. A caller not
+    admitted within queue_timeout, arriving to a full queue, or facing a
+    rate-limit wait longer than that, gets UpstreamBusy instead of waiting.
+
+    Retries use full-jitter exponential backoff, or Retry-After when the
+    response has one. A 429 also pauses admission for everyone queued, so
+    the next wave doesn't pile onto a rate-limited upstream.
+    """
+
+    def __init__(self, max_in_flight: int, requests_per_minute: int, tokens_per_minute: int,
+                 queue_timeout: float, max_queue: int, max_retries: int, backoff_base: float, backoff_max: float):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self.waiting = 0
+        self._queue: list = []
+        self._arrivals = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int):
+        """Hold one admitted in-flight slot for the duration of the block."""
+        await self._acquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+    async def _acquire(self, priority: int, tokens: int) -> None:
+        if self.waiting >= self.max_queue:
+            llm_rejected.inc("queue_full")
+            raise UpstreamBusy("upstream queue is full", self.queue_timeout)
+        # A lower bound on the wait, whatever the queue position: fail now if it's already too long
+        wait = max(self._paused_until - time.monotonic(), self.requests.delay(1), self.tokens.delay(tokens))
+        if wait > self.queue_timeout:
+            llm_rejected.inc("rate_limited")
+            raise UpstreamBusy("upstream rate limit reached", wait)
+
+        admitted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._arrivals), admitted, tokens))
+        self.waiting += 1
+        start = time.monotonic()
+        self._dispatch()
+        try:
+            await asyncio.wait({admitted}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(admitted)
+            raise
+        if not admitted.done():
+            self._abandon(admitted)
+            llm_rejected.inc("deadline")
+            raise UpstreamBusy("timed out waiting for an upstream slot", self.queue_timeout)
+        llm_queue_wait.observe(time.monotonic() - start, str(priority))
+
+    def _abandon(self, admitted: asyncio.Future) -> None:
+        if admitted.done():
+            # Admitted just as the caller gave up: hand the slot back
+            self.in_flight -= 1
+            self._dispatch()
+        else:
+            admitted.cancel()
+            self.waiting -= 1
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._queue and self.in_flight < self.max_in_flight:
+            priority, _, admitted, tokens = self._queue[0]
+            if admitted.done():
+                heapq.heappop(self._queue)
+                continue
+            wait = max(self._paused_until - now, self.requests.delay(1), self.tokens.delay(tokens))
+            if wait > 0:
+                self._wake_in(wait)
+                return
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            self.waiting -= 1
+            admitted.set_result(None)
+
+    def _wake_in(self, delay: float) -> None:
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Charge the tokens-per-minute bucket for usage beyond (or refund usage below) the estimate."""
+        if actual:
+            self.tokens.take(actual - estimated)
+
+    async def with_retries(self, call, max_retries: Optional[int] = None):
+        """Await call(), retrying throttling, server and connection errors.
+
+        max_retries overrides the scheduler's own limit; a 429 still pauses
+        the queue when no retries are left.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= max_retries:
+                    raise
+                attempt += 1
+                reason = str(getattr(e, "status_code", None) or type(e).__name__)
+                llm_retries.inc(reason)
+                logger.warning("OpenAI call failed (%s), retry %s/%s in %.2fs", reason, attempt, max_retries, delay)
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        from openai import APIConnectionError, APIStatusError
+
+        retry_after = None
+        if isinstance(error, APIStatusError):
+            if error.status_code not in (408, 409, 429) and error.status_code < 500:
+                return None
+            retry_after = parse_retry_after(error.response.headers)
+        elif not isinstance(error, APIConnectionError):
+            return None
+
+        if retry_after is not None:
+            # A little jitter so everyone told the same Retry-After doesn't return at once
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        else:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if getattr(error, "status_code", None) == 429:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "paused_for_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+        }
+
+upstream_scheduler = UpstreamScheduler(
+    LLM_MAX_IN_FLIGHT,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    LLM_MAX_QUEUE,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE_SECONDS,
+    LLM_BACKOFF_MAX_SECONDS
+)
+metrics.register(Gauge(
+    "aeroassist_llm_queue_depth", "OpenAI calls waiting for admission.", (),
+    lambda: {(): upstream_scheduler.waiting}))
+metrics.register(Gauge(
+    "aeroassist_llm_in_flight", "OpenAI calls in progress.", (),
+    lambda: {(): upstream_scheduler.in_flight}))
+
+llm_route_latency = metrics.register(Histogram(
+    "aeroassist_llm_route_latency_seconds",
+    "Time for a model route to answer (to the first token when streaming).", ("route", "kind")))
+llm_route_attempts = metrics.register(Counter(
+    "aeroassist_llm_route_attempts_total", "Calls to each model route by outcome.", ("route", "outcome")))
+llm_hedges = metrics.register(Counter(
+    "aeroassist_llm_hedges_total", "Hedged duplicate calls fired, and how many answered first.", ("result",)))
+
+HEDGE_MIN_SAMPLES = 20
+HEDGE_CREDIT_BURST = 10
+
+# Set in each ModelRouter attempt's task: [when its upstream call started, or None while it waits for a slot]
+_upstream_started: ContextVar[Optional[list]] = ContextVar("upstream_started", default=None)
+
+class ModelRoute:
+    """One model on one endpoint, with its recent latencies and outcomes.
+
+    Latency windows are kept per kind of call ("response" for a whole reply,
+    "stream" for the first token), since the two are far apart.
+    """
+
+    def __init__(self, model: str, base_url: Optional[str], timeout: float, window: int = 200):
+        self.model = model
+        self.base_url = base_url
+        self.timeout = timeout
+        self.name = f"{model}@{base_url}" if base_url else model
+        self.cooling_until = 0.0
+        self._window = window
+        self._latencies: Dict[str, deque] = {}
+        self._outcomes: deque = deque(maxlen=window)
+        self._client = None
+
+    def client(self):
+        """The OpenAI client for this route; the shared one unless it has its own endpoint."""
+        if self.base_url is None:
+            return openai_client
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=self.base_url, max_retries=0)
+        return self._client
+
+    async def timed(self, kind: str, call):
+        """Await call() within this route's timeout, sampling its latency on success.
+
+        Only the upstream call is covered, not the wait for a scheduler slot
+        before it or the backoff between its retries.
+        """
+        start = time.monotonic()
+        started = _upstream_started.get()
+        if started is not None:
+            started[0] = start
+        result = await asyncio.wait_for(call(), self.timeout)
+        self.record_success(kind, time.monotonic() - start)
+        return result
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        self._latencies.setdefault(kind, deque(maxlen=self._window)).append(seconds)
+
+    def record_success(self, kind: str, seconds: float) -> None:
+        self.record_latency(kind, seconds)
+        self._outcomes.append(True)
+        llm_route_latency.observe(seconds, self.name, kind)
+
+    def record_failure(self, error_threshold: float, cooldown: float) -> None:
+        self._outcomes.append(False)
+        if len(self._outcomes) >= 10 and self.error_rate() >= error_threshold:
+            self.cooling_until = time.monotonic() + cooldown
+            # Start afresh after the cooldown rather than tripping again at once
+            self._outcomes.clear()
+            logger.warning("Model route %s is failing, trying it last for %.0fs", self.name, cooldown)
+
+    def error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def latency_percentile(self, kind: str, p: float) -> Optional[float]:
+        samples = self._latencies.get(kind)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "model": self.model,
+            "timeout": self.timeout,
+            "error_rate": round(self.error_rate(), 3),
+            "cooling_for_seconds": round(max(0.0, self.cooling_until - time.monotonic()), 1),
+        }
+        for kind in self._latencies:
+            for p in (50, 95):
+                value = self.latency_percentile(kind, p)
+                stats[f"{kind}_p{p}_seconds"] = round(value, 3) if value is not None else None
+        return stats
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+def parse_model_routes(spec: str, default_timeout: float) -> List[ModelRoute]:
+    """Parse LLM_ROUTES: comma-separated model[@base_url][=timeout_seconds]."""
+    routes = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        entry, _, timeout = entry.rpartition("=") if "=" in entry else (entry, "", "")
+        model, _, base_url = entry.partition("@")
+        routes.append(ModelRoute(model.strip(), base_url.strip() or None,
+                                 float(timeout) if timeout else default_timeout))
+    if not routes:
+        raise ValueError("LLM_ROUTES lists no models")
+    return routes
+
+class ModelRouter:
+    """Sends each upstream call down an ordered list of model routes.
+
+    A call goes to the first route not cooling down. If it fails or runs
+    past its route's timeout, the next route is tried; if every route
+    fails, the last error is raised. UpstreamBusy is raised straight away,
+    since the scheduler is shared by all routes, and so is
+    ResponseChainBroken, which is the conversation's fault, not the route's.
+
+    With hedging on, once the first attempt has run longer than its route's
+    hedge_percentile latency, a duplicate goes to the next route (or the
+    same route when there is only one). Whichever answers first wins and the
+    other is cancelled. Hedges only fire while the scheduler has a free slot
+    and hedge credit remains; each call earns max_ratio of a credit (up to
+    a burst of HEDGE_CREDIT_BURST), so hedging adds at most that share of
+    upstream calls. A route failing often
+    gets hedged at min_delay rather than its percentile.
+    """
+
+    def __init__(self, routes: List[ModelRoute], hedge_enabled: bool, hedge_percentile: float, min_delay: float,
+                 max_ratio: float, error_threshold: float, cooldown: float):
+        self.routes = routes
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.calls = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.failovers = 0
+        self._hedge_credit = 1.0
+
+    def ordered_routes(self) -> List[ModelRoute]:
+        now = time.monotonic()
+        return sorted(self.routes, key=lambda route: route.cooling_until > now)
+
+    def hedge_delay(self, route: ModelRoute, kind: str) -> Optional[float]:
+        """How long to wait on route before hedging, or None if it can't be hedged yet."""
+        if not self.hedge_enabled:
+            return None
+        if route.error_rate() >= self.error_threshold / 2:
+            return self.min_delay
+        latency = route.latency_percentile(kind, self.hedge_percentile)
+        if latency is None:
+            return None
+        return min(max(latency, self.min_delay), route.timeout)
+
+    def _take_hedge_credit(self) -> bool:
+        if self._hedge_credit < 1 or upstream_scheduler.waiting or upstream_scheduler.in_flight >= upstream_scheduler.max_in_flight:
+            return False
+        self._hedge_credit -= 1
+        return True
+
+    async def _attempt(self, route: ModelRoute, kind: str, attempt, last: bool, started: list):
+        # The attempt's upstream calls go through route.timed, which applies the timeout
+        _upstream_started.set(started)
+        try:
+            result = await attempt(route, last)
+        except asyncio.CancelledError:
+            llm_route_attempts.inc(route.name, "cancelled")
+            raise
+        except asyncio.TimeoutError:
+            llm_route_attempts.inc(route.name, "timeout")
+            route.record_failure(self.error_threshold, self.cooldown)
+            raise
+        except (UpstreamBusy, ResponseChainBroken):
+            raise
+        except Exception:
+            llm_route_attempts.inc(route.name, "error")
+            route.record_failure(self.error_threshold, self.cooldown)
+            raise
+        llm_route_attempts.inc(route.name, "ok")
+        return result
+
+    async def call(self, attempt, kind: str = "response", discard=None):
+        """Run `await attempt(route, last)` down the routes, hedging and failing over.
+
+        `last` is true for the final route, the one worth retrying on. The
+        attempt makes its upstream call through `route.timed`. When
+        a losing attempt has already produced a result, it is passed to
+        `await discard(result)` to release it.
+        """
+        self.calls += 1
+        self._hedge_credit = min(self._hedge_credit + self.max_ratio, HEDGE_CREDIT_BURST)
+        remaining = self.ordered_routes()
+        pending: Dict[asyncio.Task, tuple] = {}
+        hedge: Optional[asyncio.Task] = None
+        may_hedge = self.hedge_enabled
+        error: Optional[BaseException] = None
+
+        def launch(route: ModelRoute) -> asyncio.Task:
+            if route in remaining:
+                remaining.remove(route)
+            started = [None]
+            task = asyncio.create_task(self._attempt(route, kind, attempt, not remaining, started))
+            pending[task] = (route, started)
+            return task
+
+        launch(remaining[0])
+        try:
+            while pending:
+                delay = None
+                if may_hedge and len(pending) == 1:
+                    delay = self.hedge_delay(next(iter(pending.values()))[0], kind)
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    may_hedge = False
+                    if self._take_hedge_credit():
+                        self.hedges += 1
+                        llm_hedges.inc("fired")
+                        hedge = launch(remaining[0] if remaining else next(iter(pending.values()))[0])
+                    continue
+
+                winner = next((task for task in done if task.exception() is None), None)
+                for task in done:
+                    pending.pop(task)
+                    if task is not winner and task.exception() is None and discard is not None:
+                        await discard(task.result())
+                if winner is not None:
+                    if winner is hedge:
+                        self.hedges_won += 1
+                        llm_hedges.inc("won")
+                    # The cancelled attempts took at least this long; without
+                    # these samples the percentile would only see the winners
+                    for route, started in pending.values():
+                        if started[0] is not None:
+                            route.record_latency(kind, time.monotonic() - started[0])
+                    return winner.result()
+
+                error = next(iter(done)).exception()
+                if isinstance(error, (UpstreamBusy, ResponseChainBroken)):
+                    raise error
+                if not pending and remaining:
+                    self.failovers += 1
+                    logger.warning("Model route failed (%s), failing over to %s",
+                                   type(error).__name__, remaining[0].name)
+                    launch(remaining[0])
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+                if discard is not None:
+                    task.add_done_callback(lambda t: self._discard_late(t, discard))
+
+    @staticmethod
+    def _discard_late(task: asyncio.Task, discard) -> None:
+        # A loser that finished just as it was cancelled still holds its result
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(discard(task.result()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers,
+            "routes": {route.name: dict(route.stats(), hedge_delay_seconds=self.hedge_delay(route, "response"))
+                       for route in self.routes},
+        }
+
+    async def close(self) -> None:
+        for route in self.routes:
+            await route.close()
+
+model_router = ModelRouter(
+    parse_model_routes(LLM_ROUTES, LLM_ROUTE_TIMEOUT_SECONDS),
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_SECONDS,
+    LLM_HEDGE_MAX_RATIO,
+    LLM_ROUTE_ERROR_THRESHOLD,
+    LLM_ROUTE_COOLDOWN_SECONDS
+)
+
+def estimate_request_tokens(request_args: Dict[str, Any]) -> int:
+    """Tokens a call will likely use: the prompt plus the expected reply."""
+    prompt = sum(estimate_message_tokens(message) for message in request_args["input"])
+    return prompt + estimate_tokens(request_args.get("instructions") or "") + LLM_EXPECTED_OUTPUT_TOKENS
+
+async def _responses_create(route: ModelRoute, request_args: Dict[str, Any], previous_response_id: Optional[str],
+                            **kwargs):
+    """Create a response on route, continuing from previous_response_id when set.
+
+    Stored responses live on the default endpoint only, so a route with its
+    own base_url gets the full context instead.
+    """
+    from openai import BadRequestError, NotFoundError
+
+    args = dict(request_args, model=route.model)
+    if previous_response_id and route.base_url is None:
+        args.update(input=args["input"][-1:], previous_response_id=previous_response_id, truncation="auto")
+    try:
+        return await route.client().responses.create(**args, **kwargs)
+    except (BadRequestError, NotFoundError) as e:
+        if "previous_response_id" in args and (
+            getattr(e, "param", None) == "previous_response_id" or "previous response" in str(e).lower()
+        ):
+            raise ResponseChainBroken(str(e)) from e
+        raise
+
+def chainable_response_id(route: ModelRoute, response) -> Optional[str]:
+    """The id the session's next turn can continue from, None to rebuild its context instead."""
+    if not LLM_CHAIN_RESPONSES or route.base_url is not None:
+        return None
+    usage = getattr(response, 'usage', None)
+    if usage is not None and (getattr(usage, 'input_tokens', 0) or 0) > LLM_CHAIN_MAX_INPUT_TOKENS:
+        # Restart from the budgeted context rather than pay for an ever longer chain
+        return None
+    return getattr(response, 'id', None)
+
+async def _create_response(request_args: Dict[str, Any], priority: int,
+                           previous_response_id: Optional[str] = None) -> Dict[str, Any]:
+    estimated = estimate_request_tokens(request_args)
+
+    async def attempt(route: ModelRoute, last: bool):
+        # Failing over beats retrying, except on the last route
+        async with upstream_scheduler.slot(priority, estimated):
+            return route, await upstream_scheduler.with_retries(
+                lambda: route.timed("response", lambda: _responses_create(route, request_args, previous_response_id)),
+                None if last else 0
+            )
+
+    route, response = await model_router.call(attempt, "response")
+
+    # Extract the response text
+    final_text = ""
+    if hasattr(response, 'output_text') and response.output_text:
+        final_text = response.output_text
+    else:
+        for output in response.output:
+            if output.type == "message":
+                for content in output.content:
+                    if content.type == "output_text":
+                        final_text += content.text
+
+    log_sampled(logging.INFO, "Successfully used Responses API")
+    usage = getattr(response, 'usage', None)
+    record_upstream_usage(usage)
+    tokens_used = getattr(usage, 'total_tokens', 0) if usage else 0
+    upstream_scheduler.settle(estimated, tokens_used)
+    return {
+        'reply': final_text.strip(),
+        'tokens_used': tokens_used,
+        'response_id': chainable_response_id(route, response)
+    }
+
+async def process_with_openai(messages: List[Dict[str, str]], user_message: str,
+                              priority: int = PRIORITY_NEW_SESSION,
+                              previous_response_id: Optional[str] = None) -> Dict[str, Any]:
+    """Process message with OpenAI and return response with token usage.
+
+    Calls go through upstream_scheduler, which raises UpstreamBusy when it
+    can't admit one in time. Identical concurrent requests share one
+    upstream call, and each reports its token usage. With
+    previous_response_id only the new message is sent; ResponseChainBroken
+    means the context has to be sent in full.
+    """
+    try:
+        request_args = build_openai_request(messages, user_message)
+
+        # Use the Responses API
+        if not openai_client:
+            raise Exception("OpenAI client not initialized")
+
+        if not LLM_COALESCING_ENABLED:
+            return await _create_response(request_args, priority, previous_response_id)
+
+        result, leader = await llm_flights.do(
+            request_fingerprint(request_args, previous_response_id),
+            lambda: _create_response(request_args, priority, previous_response_id)
+        )
+        if not leader:
+            llm_flights.coalesced_tokens += result["tokens_used"]
+        return result
+        
+    except (UpstreamBusy, ResponseChainBroken):
+        raise
+    except Exception as e:
+        logger.error("OpenAI processing error: %s", e)
+        raise HTTPException(status_code=500, detail=f"AI processing error: {str(e)}")
+
+async def _open_stream(route: ModelRoute, last: bool, request_args: Dict[str, Any],
+                       priority: int, estimated: int, previous_response_id: Optional[str] = None) -> tuple:
+    """Open a stream on route and read it up to the first text delta.
+
+    Returns (exit stack holding the slot and the stream, event iterator,
+    events read so far, route). Closing the stack releases both.
+    """
+    async def first_delta() -> tuple:
+        stream = await _responses_create(route, request_args, previous_response_id, stream=True)
+        try:
+            events = stream.__aiter__()
+            buffered = []
+            async for event in events:
+                buffered.append(event)
+                if event.type in ("response.failed", "error"):
+                    raise Exception(f"Streaming failed: {event.type}")
+                if event.type == "response.output_text.delta":
+                    break
+            return stream, events, buffered
+        except BaseException:
+            await stream.close()
+            raise
+
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(upstream_scheduler.slot(priority, estimated))
+        stream, events, buffered = await upstream_scheduler.with_retries(
+            lambda: route.timed("stream", first_delta),
+            None if last else 0
+        )
+        stack.push_async_callback(stream.close)
+        return stack, events, buffered, route
+    except BaseException:
+        await stack.aclose()
+        raise
+
+async def _replay(buffered: list, events) -> AsyncIterator[Any]:
+    for event in buffered:
+        yield event
+    async for event in events:
+        yield event
+
+async def _stream_response(request_args: Dict[str, Any], priority: int,
+                           previous_response_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    # Routing, hedging and retries cover opening the stream up to its first
+    # delta; after that it is committed, since deltas can't be taken back
+    estimated = estimate_request_tokens(request_args)
+    stack, events, buffered, route = await model_router.call(
+        lambda route, last: _open_stream(route, last, request_args, priority, estimated, previous_response_id),
+        "stream",
+        discard=lambda opened: opened[0].aclose()
+    )
+    async with stack:
+        chunks = []
+        tokens_used = 0
+        response_id = None
+        async for event in _replay(buffered, events):
+            if event.type == "response.output_text.delta":
+                chunks.append(event.delta)
+                yield {"type": "delta", "content": event.delta}
+            elif event.type == "response.completed":
+                usage = getattr(event.response, 'usage', None)
+                record_upstream_usage(usage)
+                tokens_used = getattr(usage, 'total_tokens', 0) if usage else 0
+                response_id = chainable_response_id(route, event.response)
+            elif event.type in ("response.failed", "error"):
+                raise Exception(f"Streaming failed: {event.type}")
+        upstream_scheduler.settle(estimated, tokens_used)
+
+    yield {"type": "done", "reply": "".join(chunks).strip(), "tokens_used": tokens_used, "response_id": response_id}
+
+async def stream_with_openai(messages: List[Dict[str, str]], user_message: str,
+                             priority: int = PRIORITY_NEW_SESSION,
+                             previous_response_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Stream a reply from OpenAI as `delta` events followed by one `done` event.
+
+    Identical concurrent requests share one upstream stream, each reporting
+    its token usage as in process_with_openai. A broken chain raises
+    ResponseChainBroken before the first delta.
+    """
+    if not openai_client:
+        raise HTTPException(status_code=500, detail="AI processing error: OpenAI client not initialized")
+
+    request_args = build_openai_request(messages, user_message)
+    if not LLM_COALESCING_ENABLED:
+        async for event in _stream_response(request_args, priority, previous_response_id):
+            yield event
+        return
+
+    events, leader = llm_flights.stream(
+        request_fingerprint(request_args, previous_response_id),
+        lambda: _stream_response(request_args, priority, previous_response_id)
+    )
+    async for event in events:
+        if event["type"] == "done" and not leader:
+            llm_flights.coalesced_tokens += event["tokens_used"]
+        yield event
+
+async def answer_turn(history: List[Dict[str, Any]], messages: List[Dict[str, str]], user_message: str,
+                      user_id: str, previous_response_id: Optional[str] = None) -> Dict[str, Any]:
+    """Reply to a turn, serving first-turn questions from the answer cache when possible.
+
+    With previous_response_id the turn continues that stored response, and
+    falls back to the assembled `messages` if OpenAI no longer has it.
+    """
+    cacheable = response_cache is not None and not history
+    if cacheable:
+        cached = response_cache.get(user_message, user_id)
+        if cached is not None:
+            log_sampled(logging.INFO, "Answered from response cache")
+            return {'reply': cached, 'tokens_used': 0, 'response_id': None}
+
+    # Follow-up turns keep an active conversation going, so they go first
+    priority = PRIORITY_FOLLOW_UP if history else PRIORITY_NEW_SESSION
+    if previous_response_id:
+        try:
+            ai_response = await process_with_openai(messages, user_message, priority, previous_response_id)
+            response_chain_turns.inc("chained")
+            return ai_response
+        except ResponseChainBroken as e:
+            response_chain_turns.inc("rebuilt")
+            logger.warning("Response chain broken (%s), sending the full context", e)
+    elif LLM_CHAIN_RESPONSES:
+        response_chain_turns.inc("full")
+    ai_response = await process_with_openai(messages, user_message, priority)
+    if cacheable:
+        response_cache.set(user_message, ai_response['reply'], user_id)
+    return ai_response
+
+async def stream_answer_turn(history: List[Dict[str, Any]], messages: List[Dict[str, str]], user_message: str,
+                             user_id: str, previous_response_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Streaming counterpart of answer_turn; a cache hit arrives as a single delta."""
+    cacheable = response_cache is not None and not history
+    if cacheable:
+        cached = response_cache.get(user_message, user_id)
+        if cached is not None:
+            yield {"type": "delta", "content": cached}
+            yield {"type": "done", "reply": cached, "tokens_used": 0, "response_id": None}
+            return
+
+    priority = PRIORITY_FOLLOW_UP if history else PRIORITY_NEW_SESSION
+    if previous_response_id:
+        try:
+            # Nothing has been yielded yet if the chain turns out to be broken
+            async for event in stream_with_openai(messages, user_message, priority, previous_response_id):
+                yield event
+            response_chain_turns.inc("chained")
+            return
+        except ResponseChainBroken as e:
+            response_chain_turns.inc("rebuilt")
+            logger.warning("Response chain broken (%s), sending the full context", e)
+    elif LLM_CHAIN_RESPONSES:
+        response_chain_turns.inc("full")
+    async for event in stream_with_openai(messages, user_message, priority):
+        if event["type"] == "done" and cacheable:
+            response_cache.set(user_message, event["reply"], user_id)
+        yield event
+
+# ============================================================================
+# WEBSOCKET CHAT
+# ============================================================================
+
+# Application close code (4000-4999) mirroring HTTP 401
+WS_CLOSE_UNAUTHORIZED = 4401
+# Rough per-message cost beyond its text: the dict, its seq and the list slot
+WS_MESSAGE_OVERHEAD_BYTES = 250
+
+ws_disconnects = metrics.register(Counter(
+    "aeroassist_ws_disconnects_total", "WebSocket chat connections refused or closed by the server, by reason.",
+    ("reason",)))
+
+def _message_bytes(message: Dict[str, Any]) -> int:
+    return sys.getsizeof(message["content"]) + WS_MESSAGE_OVERHEAD_BYTES
+
+class ChatConnection:
+    """One WebSocket chat connection: its user, session and conversation so far.
+
+    `history` holds the session's recent messages and is kept current by
+    the connection's own turns, so a turn never reloads it. It is trimmed
+    from the oldest message to stay under WS_MAX_HISTORY_BYTES; those
+    messages were folded into the session's summary long before.
+    """
+
+    __slots__ = ("websocket", "user_id", "session_id", "expires_at", "last_active",
+                 "history", "history_bytes", "response_id", "turn")
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.user_id: Optional[str] = None
+        self.session_id: Optional[str] = None
+        self.expires_at = math.inf
+        self.last_active = time.monotonic()
+        self.history: List[Dict[str, Any]] = []
+        self.history_bytes = 0
+        self.response_id: Optional[str] = None
+        self.turn: Optional[asyncio.Task] = None
+
+    def remember(self, message: Dict[str, Any]) -> None:
+        self.history.append(message)
+        self.history_bytes += _message_bytes(message)
+        drop = 0
+        while self.history_bytes > WS_MAX_HISTORY_BYTES and drop < len(self.history) - 1:
+            self.history_bytes -= _message_bytes(self.history[drop])
+            drop += 1
+        del self.history[:drop]
+
+    def busy(self) -> bool:
+        return self.turn is not None and not self.turn.done()
+
+class ChatConnections:
+    """The WebSocket chat connections open in this worker.
+
+    Enforces the connection limits, and closes connections whose token has
+    expired or that have gone idle in one sweep every WS_AUTH_CHECK_SECONDS
+    rather than with a timer per connection.
+    """
+
+    def __init__(self, max_connections: int, max_per_user: int, idle_seconds: float):
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.idle_seconds = idle_seconds
+        self._connections: set = set()
+        self._per_user: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def has_room(self) -> bool:
+        return len(self._connections) < self.max_connections
+
+    def add(self, conn: ChatConnection) -> None:
+        self._connections.add(conn)
+
+    def bind_user(self, conn: ChatConnection, user_id: str) -> bool:
+        """Count the connection against its user's limit; False if the user is at it."""
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            return False
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        conn.user_id = user_id
+        return True
+
+    def remove(self, conn: ChatConnection) -> None:
+        self._connections.discard(conn)
+        if conn.user_id is not None:
+            left = self._per_user.get(conn.user_id, 0) - 1
+            if left > 0:
+                self._per_user[conn.user_id] = left
+            else:
+                self._per_user.pop(conn.user_id, None)
+
+    async def sweep(self) -> None:
+        wall, now = time.time(), time.monotonic()
+        for conn in list(self._connections):
+            if conn.expires_at <= wall:
+                await ws_close(conn, WS_CLOSE_UNAUTHORIZED, "token_expired")
+            elif not conn.busy() and now - conn.last_active > self.idle_seconds:
+                await ws_close(conn, status.WS_1000_NORMAL_CLOSURE, "idle")
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("WebSocket connection sweep failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self._connections),
+            "users": len(self._per_user),
+            "busy": sum(1 for conn in self._connections if conn.busy()),
+            "max_connections": self.max_connections,
+            "max_per_user": self.max_per_user,
+        }
+
+chat_connections = ChatConnections(WS_MAX_CONNECTIONS, WS_MAX_CONNECTIONS_PER_USER, WS_IDLE_TIMEOUT_SECONDS)
+metrics.register(Gauge(
+    "aeroassist_ws_connections", "Open WebSocket chat connections.", (),
+    lambda: {(): len(chat_connections)}))
+
+async def ws_send(conn: ChatConnection, payload: Dict[str, Any]) -> None:
+    await conn.websocket.send_text(json.dumps(payload))
+
+async def ws_close(conn: ChatConnection, code: int, reason: str) -> None:
+    ws_disconnects.inc(reason)
+    try:
+        await conn.websocket.close(code=code, reason=reason)
+    except RuntimeError:
+        # Already closed
+        pass
+
+async def ws_frame(conn: ChatConnection) -> Optional[Dict[str, Any]]:
+    """The next frame as a dict ({} if it isn't a JSON object), None once the connection is closed."""
+    message = await conn.websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        return None
+    conn.last_active = time.monotonic()
+    data = message.get("text")
+    if data is None:
+        data = (message.get("bytes") or b"").decode("utf-8", "replace")
+    if len(data) > WS_MAX_MESSAGE_BYTES:
+        await ws_close(conn, status.WS_1009_MESSAGE_TOO_BIG, "too_big")
+        return None
+    try:
+        frame = json.loads(data)
+    except ValueError:
+        return {}
+    return frame if isinstance(frame, dict) else {}
+
+def _bearer_token(value: Optional[str]) -> Optional[str]:
+    scheme, _, token = (value or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+
+async def ws_verify(token: Any) -> Optional[Dict[str, Any]]:
+    """Verified claims for a token, None if it doesn't verify."""
+    if not isinstance(token, str) or not token:
+        return None
+    try:
+        with StageTimer("auth"):
+            # May call Supabase, so off the event loop as for HTTP requests
+            return await asyncio.to_thread(verify_token_claims, token)
+    except Exception as e:
+        logger.warning("WebSocket token verification failed: %s (%s)", e, type(e).__name__)
+        return None
+
+async def ws_open_session(conn: ChatConnection, session_id: Optional[str]) -> None:
+    """Bind the connection to the user's session (a new one unless session_id is theirs) and load its history."""
+    if SessionLocal is None:
+        conn.session_id = session_id or str(uuid.uuid4())
+        return
+    async with SessionLocal() as db:
+        with StageTimer("session"):
+            conn.session_id = await get_or_create_session(conn.user_id, session_id, db)
+        with StageTimer("history"):
+            history = await load_history(db, conn.session_id)
+            conn.response_id = await response_chain(db, conn.session_id, history)
+    for message in history:
+        conn.remember(message)
+
+async def ws_save(conn: ChatConnection, role: str, content: str, tokens_used: int = 0,
+                  response_id: Optional[str] = None) -> Dict[str, Any]:
+    if SessionLocal is None:
+        return {"seq": next_message_seq(), "role": role, "content": content}
+    async with SessionLocal() as db:
+        message = await save_message(db, conn.session_id, conn.user_id, role, content, tokens_used, response_id)
+    return message_to_dict(message)
+
+async def ws_turn(conn: ChatConnection, content: str) -> None:
+    """Answer one message on a connection, streaming the reply as it is generated.
+
+    Runs as its own task so the connection can still receive a cancel. A
+    cancelled turn keeps the user's message, if it was saved, but not the
+    partial reply.
+    """
+    start = time.perf_counter()
+    try:
+        await enforce_quota(conn.user_id)
+        # Only whether there was any history matters to the answer cache and priority
+        history = conn.history if conn.history else []
+        previous_response_id, conn.response_id = conn.response_id, None
+        with StageTimer("context"):
+            messages = prepare_context(conn.session_id, conn.history, content)
+        with StageTimer("save_user_message"):
+            conn.remember(await ws_save(conn, "user", content))
+
+        first_token = True
+        async for event in stream_answer_turn(history, messages, content, conn.user_id, previous_response_id):
+            if event["type"] == "delta":
+                if first_token:
+                    stage_seconds.observe(time.perf_counter() - start, "llm_first_token")
+                    first_token = False
+                await ws_send(conn, event)
+                continue
+            stage_seconds.observe(time.perf_counter() - start, "llm")
+            if usage_ledger is not None:
+                usage_ledger.record(conn.user_id, conn.session_id, event["tokens_used"])
+            with StageTimer("save_assistant_message"):
+                # The reply is complete; a cancel arriving now shouldn't lose it
+                saved = await asyncio.shield(ws_save(conn, "assistant", event["reply"], event["tokens_used"],
+                                                     event["response_id"]))
+            conn.remember(saved)
+            conn.response_id = event["response_id"]
+            await ws_send(conn, {
+                "type": "done",
+                "session_id": conn.session_id,
+                "timestamp": datetime.now().isoformat(),
+                "tokens_used": event["tokens_used"]
+            })
+    except HTTPException as e:
+        retry_after = (e.headers or {}).get("Retry-After")
+        await ws_send(conn, {"type": "error", "status": e.status_code, "detail": e.detail,
+                             **({"retry_after": int(retry_after)} if retry_after else {})})
+    except UpstreamBusy as e:
+        logger.warning("AI service busy: %s", e)
+        await ws_send(conn, {
+            "type": "error",
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "detail": "AI service is busy, please try again shortly",
+            "retry_after": math.ceil(e.retry_after)
+        })
+    except Exception as e:
+        stage_errors.inc("llm")
+        logger.error("Error in WebSocket chat turn: %s", e)
+        await ws_send(conn, {"type": "error", "status": 500, "detail": f"AI processing error: {str(e)}"})
+
+async def serve_chat_connection(conn: ChatConnection, session_id: Optional[str]) -> None:
+    """Authenticate an accepted connection, bind its session and serve frames until it closes."""
+    token = _bearer_token(conn.websocket.headers.get("authorization"))
+    if token is None:
+        # Browsers can't set headers on a WebSocket, so the token may come first instead
+        try:
+            frame = await asyncio.wait_for(ws_frame(conn), WS_AUTH_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            await ws_close(conn, WS_CLOSE_UNAUTHORIZED, "auth_timeout")
+            return
+        if frame is None:
+            return
+        token = frame.get("token") if frame.get("type") == "auth" else None
+        session_id = frame.get("session_id") or session_id
+
+    claims = await ws_verify(token)
+    if claims is None:
+        await ws_close(conn, WS_CLOSE_UNAUTHORIZED, "auth_failed")
+        return
+    if not chat_connections.bind_user(conn, claims["sub"]):
+        await ws_close(conn, status.WS_1013_TRY_AGAIN_LATER, "user_limit")
+        return
+    conn.expires_at = claims.get("exp") or math.inf
+    await ws_open_session(conn, session_id)
+    await ws_send(conn, {"type": "ready", "session_id": conn.session_id, "messages": len(conn.history)})
+
+    while True:
+        frame = await ws_frame(conn)
+        if frame is None:
+            return
+        kind = frame.get("type")
+        if kind == "message":
+            content = frame.get("content")
+            if not isinstance(content, str) or not content.strip():
+                await ws_send(conn, {"type": "error", "status": 400, "detail": "Message is required."})
+            elif conn.busy():
+                await ws_send(conn, {"type": "error", "status": 409,
+                                     "detail": "A reply is still being generated; cancel it first"})
+            else:
+                conn.turn = asyncio.create_task(ws_turn(conn, content))
+        elif kind == "cancel":
+            if conn.busy():
+                conn.turn.cancel()
+                await asyncio.gather(conn.turn, return_exceptions=True)
+                if conn.turn.cancelled():
+                    await ws_send(conn, {"type": "cancelled"})
+        elif kind == "auth":
+            # A fresh token for the same user keeps the connection open past the old one's expiry
+            claims = await ws_verify(frame.get("token"))
+            if claims is None or claims["sub"] != conn.user_id:
+                await ws_close(conn, WS_CLOSE_UNAUTHORIZED, "auth_failed")
+                return
+            conn.expires_at = claims.get("exp") or math.inf
+            await ws_send(conn, {"type": "authenticated", "expires_at": claims.get("exp")})
+        elif kind == "ping":
+            await ws_send(conn, {"type": "pong"})
+        else:
+            await ws_send(conn, {"type": "error", "status": 400, "detail": "Unknown frame type"})
+
 # ============================================================================
-# PYDANTIC MODELS
+# BATCH JOBS
 # ============================================================================
 
-class ChatMessageRequest(BaseModel):
-    role: str
-    content: str
-    timestamp: Optional[str] = None
+BATCH_ACTIVE = ("queued", "running")
+# About this many bytes of a job's file are read per trip to the thread pool
+BATCH_READ_BYTES = 64 * 1024
 
-class ChatRequest(BaseModel):
-    message: str
-    conversation_history: Optional[List[ChatMessageRequest]] = []
-    session_id: Optional[str] = None
+batch_prompts = metrics.register(Counter(
+    "aeroassist_batch_prompts_total", "Batch prompts handled, by outcome.", ("outcome",)))
 
-class ChatResponse(BaseModel):
-    reply: str
-    timestamp: str
-    session_id: str
-    tokens_used: int
+def _read_batch_lines(f, limit: int) -> List[bytes]:
+    """About BATCH_READ_BYTES of lines; a line over `limit` bytes comes back cut to limit + 1."""
+    lines, size = [], 0
+    while size < BATCH_READ_BYTES:
+        raw = f.readline(limit + 1)
+        if not raw:
+            break
+        if len(raw) > limit and not raw.endswith(b"\n"):
+            # Skip the rest of it without holding it
+            while (rest := f.readline(BATCH_READ_BYTES)) and not rest.endswith(b"\n"):
+                pass
+        lines.append(raw)
+        size += len(raw)
+    return lines
 
-class User(BaseModel):
-    id: str
-    email: str
-    role: str = "user"
+def scan_batch_file(path: str) -> int:
+    """Count a batch file's prompts (its non-blank lines); ValueError if a line is too long."""
+    total = 0
+    with open(path, "rb") as f:
+        while lines := _read_batch_lines(f, BATCH_MAX_PROMPT_BYTES):
+            for raw in lines:
+                raw = raw.strip()
+                if len(raw) > BATCH_MAX_PROMPT_BYTES:
+                    raise ValueError(f"Prompt {total + 1} is over {BATCH_MAX_PROMPT_BYTES} bytes")
+                total += bool(raw)
+    return total
 
-# ============================================================================
-# DATABASE SETUP
-# ============================================================================
+def parse_batch_line(raw: bytes) -> Dict[str, Any]:
+    """A prompt line: {"message": ..., "custom_id": ..., "conversation_history": [...]}, the last two optional.
 
-# Create engine with error handling
-engine = None
-SessionLocal = None
+    Raises ValueError saying what is wrong with it.
+    """
+    if len(raw) > BATCH_MAX_PROMPT_BYTES:
+        raise ValueError(f"over {BATCH_MAX_PROMPT_BYTES} bytes")
+    item = json.loads(raw)
+    if not isinstance(item, dict) or not isinstance(item.get("message"), str) or not item["message"].strip():
+        raise ValueError('not a JSON object with a "message"')
+    history = item.get("conversation_history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(msg, dict) and msg.get("role") in ("user", "assistant") and isinstance(msg.get("content"), str)
+        for msg in history
+    ):
+        raise ValueError('"conversation_history" is not a list of {"role", "content"} messages')
+    return item
 
-try:
-    if DATABASE_URL:
-        logger.info("Attempting to connect to database...")
-        engine = create_engine(
-            DATABASE_URL,
-            pool_pre_ping=True,
-            pool_recycle=300,
-            echo=False  # Set to True for SQL debugging
-        )
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        
-        # Test connection and create tables
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-            logger.info("Database connection test successful")
-            
-            # Create tables
-            Base.metadata.create_all(bind=engine)
-            logger.info("Database tables created/verified successfully")
-    else:
-        logger.warning("DATABASE_URL not configured - running without database")
-        
-except Exception as e:
-    logger.error(f"Database connection failed: {e}")
-    logger.warning("Running without database - chat will work but messages won't be stored")
-    engine = None
-    SessionLocal = None
+class BatchJob:
+    """One batch job running in this worker.
 
-def get_db():
-    """Database session dependency."""
-    if SessionLocal is None:
-        # Return a mock database session that does nothing
-        class MockDB:
-            def add(self, obj): pass
-            def commit(self): pass
-            def rollback(self): pass
-            def close(self): pass
-            def query(self, model): 
-                class MockQuery:
-                    def filter(self, *args): return self
-                    def first(self): return None
-                    def all(self): return []
-                    def count(self): return 0
-                    def order_by(self, *args): return self
-                return MockQuery()
-        return MockDB()
-    
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    A feeder reads the job's file from its checkpoint and hands lines to
+    `concurrency` workers, each answering a prompt at a time through
+    process_with_openai at PRIORITY_BATCH. Results are stored in line order:
+    a finished line waits for every line before it, then goes out with the
+    next flush, which moves the checkpoint in the same commit. What is
+    stored is therefore exactly the lines before the checkpoint, and a
+    resumed job only answers again the lines that were in flight. The
+    feeder stays within `window` lines of the checkpoint, so memory is
+    bounded by that rather than by the size of the file.
+    """
 
-# ============================================================================
-# AUTHENTICATION
-# ============================================================================
+    def __init__(self, session_factory, batch: ChatBatch, concurrency: int, flush_rows: int, flush_seconds: float):
+        self.session_factory = session_factory
+        self.id = batch.id
+        self.user_id = batch.user_id
+        self.source = batch.source
+        self.concurrency = concurrency
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.window = max(flush_rows, 16 * concurrency)
+        self.resumed_from = batch.checkpoint
+        self.next_line = batch.checkpoint
+        self.flushed_line = batch.checkpoint
+        self.handled = 0
+        self.started = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        # Set when a prompt is refused by the daily token quota; no new prompts start after it
+        self.quota_exceeded: Optional[QuotaExceeded] = None
+        self._ready: Dict[int, Optional[Dict[str, Any]]] = {}
+        self._rows: List[Dict[str, Any]] = []
+        self._advanced = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._last_flush = time.monotonic()
 
-# Initialize Supabase client with error handling
-supabase: Client = None
+    def rate(self) -> float:
+        """Prompts handled per second since this worker took the job on."""
+        return self.handled / max(time.monotonic() - self.started, 1e-9)
 
-# Debug environment variables
-logger.info(f"SUPABASE_URL configured: {'Yes' if SUPABASE_URL else 'No'}")
-logger.info(f"SUPABASE_SERVICE_ROLE_KEY configured: {'Yes' if SUPABASE_SERVICE_ROLE_KEY else 'No'}")
-if SUPABASE_URL:
-    logger.info(f"SUPABASE_URL: {SUPABASE_URL[:20]}...")
-if SUPABASE_SERVICE_ROLE_KEY:
-    logger.info(f"SUPABASE_SERVICE_ROLE_KEY: {SUPABASE_SERVICE_ROLE_KEY[:20]}...")
+    async def run(self) -> None:
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency)
+        tasks = [asyncio.create_task(self._feed(queue))]
+        tasks += [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Whatever is complete is kept, also when the job is stopped
+            await self._flush()
+        if self.quota_exceeded is not None:
+            raise self.quota_exceeded
 
-try:
-    if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        logger.info("Supabase client initialized successfully")
-    else:
-        logger.warning("Supabase credentials not configured - authentication will fail")
-        logger.warning("Please set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables")
-except Exception as e:
-    logger.error(f"Failed to initialize Supabase client: {e}")
-    supabase = None
+    async def _feed(self, queue: asyncio.Queue) -> None:
+        line = 0
+        with open(self.source, "rb") as f:
+            while self.quota_exceeded is None and (
+                    lines := await asyncio.to_thread(_read_batch_lines, f, BATCH_MAX_PROMPT_BYTES)):
+                for raw in lines:
+                    if line >= self.resumed_from:
+                        while line >= self.next_line + self.window and self.quota_exceeded is None:
+                            self._advanced.clear()
+                            await self._advanced.wait()
+                        if self.quota_exceeded is not None:
+                            break
+                        await queue.put((line, raw))
+                    line += 1
+        for _ in range(self.concurrency):
+            await queue.put(None)
 
-# Security
-security = HTTPBearer()
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while (item := await queue.get()) is not None:
+            if self.quota_exceeded is not None:
+                # Queued prompts are dropped; ones already past the quota check still finish
+                continue
+            line, raw = item
+            raw = raw.strip()
+            try:
+                row = await self._answer(line, raw) if raw else None
+            except QuotaExceeded as e:
+                self.quota_exceeded = e
+                self._advanced.set()
+                continue
+            self._complete(line, row)
+            if len(self._rows) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_seconds:
+                await self._flush()
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    """Verify JWT token and return user information."""
-    try:
-        token = credentials.credentials
-        
-        # Debug logging
-        logger.info(f"Received token length: {len(token) if token else 0}")
-        logger.info(f"Token starts with: {token[:20] if token else 'None'}...")
-        
-        if not supabase:
-            logger.error("Supabase client not initialized")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Authentication service not available"
-            )
-        
-        # Get user directly from Supabase (more reliable)
+    async def _answer(self, line: int, raw: bytes) -> Dict[str, Any]:
+        row = {"batch_id": self.id, "line": line, "custom_id": None, "reply": None, "tokens_used": 0, "error": None}
+        self.handled += 1
         try:
-            logger.info("Attempting to verify token with Supabase...")
-            user_response = supabase.auth.get_user(token)
-            user_data = user_response.user
-            
-            if not user_data:
-                logger.error("Supabase returned no user data")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid user credentials"
-                )
-            
-            logger.info(f"Successfully verified user: {user_data.email}")
-            return User(
-                id=user_data.id,
-                email=user_data.email,
-                role=getattr(user_data, 'role', 'user')
-            )
-            
+            item = parse_batch_line(raw)
+        except ValueError as e:
+            batch_prompts.inc("invalid")
+            row["error"] = f"Invalid line: {e}"
+            return row
+        if item.get("custom_id") is not None:
+            row["custom_id"] = str(item["custom_id"])
+
+        history = [{"seq": index, "role": msg["role"], "content": msg["content"]}
+                   for index, msg in enumerate(item.get("conversation_history") or [])]
+        messages, _ = assemble_context(history, item["message"])
+        await self._within_quota()
+        while True:
+            try:
+                result = await process_with_openai(messages, item["message"], PRIORITY_BATCH)
+                break
+            except UpstreamBusy as e:
+                # Nobody is waiting on a batch prompt, so it waits for room rather than failing
+                await asyncio.sleep(max(1.0, e.retry_after))
+            except HTTPException as e:
+                batch_prompts.inc("failed")
+                row["error"] = str(e.detail)
+                return row
+        if usage_ledger is not None:
+            usage_ledger.record(self.user_id, None, result["tokens_used"])
+        batch_prompts.inc("succeeded")
+        row["reply"] = result["reply"]
+        row["tokens_used"] = result["tokens_used"]
+        return row
+
+    async def _within_quota(self) -> None:
+        """Count a prompt against the owner's quotas, like a chat turn.
+
+        Over the per-minute request quota the prompt waits for room. Over the
+        daily token quota QuotaExceeded is raised, which ends the job as
+        failed once the prompts already admitted have been answered; those
+        are kept up to the first line that wasn't.
+        """
+        if usage_ledger is None:
+            return
+        while True:
+            try:
+                await usage_ledger.check_quota(self.user_id)
+                return
+            except QuotaExceeded as e:
+                quota_rejected.inc(e.quota)
+                if e.quota != "requests_per_minute":
+                    raise
+                await asyncio.sleep(max(0.1, e.retry_after))
+
+    def _complete(self, line: int, row: Optional[Dict[str, Any]]) -> None:
+        self._ready[line] = row
+        while self.next_line in self._ready:
+            row = self._ready.pop(self.next_line)
+            if row is not None:
+                self._rows.append(row)
+            self.next_line += 1
+        self._advanced.set()
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            rows, checkpoint = self._rows, self.next_line
+            if checkpoint == self.flushed_line:
+                return
+            self._rows = []
+            self._last_flush = time.monotonic()
+            batch_table = ChatBatch.__table__
+            while True:
+                try:
+                    async with self.session_factory() as db:
+                        if rows:
+                            await db.execute(insert_ignoring_duplicates(ChatBatchResult.__table__), rows)
+                        await db.execute(update(batch_table).where(batch_table.c.id == self.id).values(
+                            checkpoint=checkpoint,
+                            succeeded=batch_table.c.succeeded + sum(1 for row in rows if row["error"] is None),
+                            failed=batch_table.c.failed + sum(1 for row in rows if row["error"] is not None),
+                            tokens_used=batch_table.c.tokens_used + sum(row["tokens_used"] for row in rows)
+                        ))
+                        await db.commit()
+                    break
+                except Exception as e:
+                    logger.error("Storing %s results of batch %s failed, retrying: %s", len(rows), self.id, e)
+                    await asyncio.sleep(1.0)
+            self.flushed_line = checkpoint
+
+class BatchRunner:
+    """The batch jobs running in this worker.
+
+    A job is claimed by taking its lease in a conditional UPDATE, so only
+    one worker runs it. Every third of lease_seconds the runner renews its
+    jobs' leases, stops any that were cancelled meanwhile (from whichever
+    worker), and, when started with adopt, claims jobs whose lease has
+    lapsed because their worker stopped, resuming them from their checkpoint.
+    """
+
+    def __init__(self, session_factory, concurrency: int, flush_rows: int, flush_seconds: float,
+                 lease_seconds: float):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.lease_seconds = lease_seconds
+        self.jobs: Dict[str, BatchJob] = {}
+        self.adopt = False
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def start(self, adopt: bool = True) -> None:
+        self.adopt = adopt
+        if adopt:
+            await self.claim_lapsed()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+        jobs = list(self.jobs.values())
+        for job in jobs:
+            job.task.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+        if jobs:
+            # Released rather than left to lapse, so a restarted worker resumes them at once
+            batch_table = ChatBatch.__table__
+            async with self.session_factory() as db:
+                await db.execute(update(batch_table).where(
+                    batch_table.c.id.in_([job.id for job in jobs]), batch_table.c.status == "running"
+                ).values(lease_expires_at=None))
+                await db.commit()
+
+    async def claim(self, batch_id: str) -> bool:
+        """Run the job in this worker unless a worker already holds it."""
+        if batch_id in self.jobs:
+            return False
+        now = datetime.now(timezone.utc)
+        batch_table = ChatBatch.__table__
+        async with self.session_factory() as db:
+            result = await db.execute(update(batch_table).where(
+                batch_table.c.id == batch_id,
+                batch_table.c.status.in_(BATCH_ACTIVE),
+                batch_table.c.lease_expires_at.is_(None) | (batch_table.c.lease_expires_at < now)
+            ).values(
+                status="running",
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                started_at=func.coalesce(batch_table.c.started_at, now)
+            ))
+            if result.rowcount != 1:
+                return False
+            batch = await db.get(ChatBatch, batch_id)
+            await db.commit()
+        job = BatchJob(self.session_factory, batch, self.concurrency, self.flush_rows, self.flush_seconds)
+        self.jobs[batch_id] = job
+        job.task = asyncio.create_task(self._run(job))
+        logger.info("Batch %s running from line %s", batch_id, batch.checkpoint)
+        return True
+
+    async def claim_lapsed(self) -> None:
+        """Take over uploaded jobs whose worker stopped; batch.py jobs are only resumed by batch.py."""
+        batch_table = ChatBatch.__table__
+        async with self.session_factory() as db:
+            rows = await db.execute(select(batch_table.c.id).where(
+                batch_table.c.status.in_(BATCH_ACTIVE),
+                batch_table.c.source.startswith(os.path.abspath(BATCH_SPOOL_DIR) + os.sep, autoescape=True),
+                batch_table.c.lease_expires_at.is_(None)
+                | (batch_table.c.lease_expires_at < datetime.now(timezone.utc))
+            ))
+            batch_ids = rows.scalars().all()
+        for batch_id in batch_ids:
+            await self.claim(batch_id)
+
+    async def _run(self, job: BatchJob) -> None:
+        outcome, error = "completed", None
+        try:
+            await job.run()
+        except QuotaExceeded as e:
+            logger.warning("Batch %s stopped, user %s is over their %s quota", job.id, job.user_id, e.quota)
+            outcome, error = "failed", f"Usage quota exceeded ({e.quota}) after {job.flushed_line} prompts"
         except Exception as e:
-            logger.error(f"Supabase user verification failed: {str(e)}")
-            logger.error(f"Error type: {type(e).__name__}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user credentials"
-            )
-            
-    except Exception as e:
-        logger.error(f"Token verification error: {str(e)}")
-        logger.error(f"Error type: {type(e).__name__}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+            logger.error("Batch %s failed: %s", job.id, e)
+            outcome, error = "failed", str(e)
+        finally:
+            self.jobs.pop(job.id, None)
+        batch_table = ChatBatch.__table__
+        async with self.session_factory() as db:
+            await db.execute(update(batch_table).where(
+                batch_table.c.id == job.id, batch_table.c.status == "running"
+            ).values(status=outcome, error=error, finished_at=datetime.now(timezone.utc), lease_expires_at=None))
+            await db.commit()
+        discard_batch_source(job.source)
+        logger.info("Batch %s %s: %s prompts in %.1fs", job.id, outcome, job.handled, time.monotonic() - job.started)
 
-# ============================================================================
-# SESSION MANAGEMENT
-# ============================================================================
+    async def _renew(self) -> None:
+        if not self.jobs:
+            return
+        batch_table = ChatBatch.__table__
+        batch_ids = list(self.jobs)
+        async with self.session_factory() as db:
+            await db.execute(update(batch_table).where(
+                batch_table.c.id.in_(batch_ids), batch_table.c.status == "running"
+            ).values(lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)))
+            running = set((await db.execute(select(batch_table.c.id).where(
+                batch_table.c.id.in_(batch_ids), batch_table.c.status == "running"
+            ))).scalars())
+            await db.commit()
+        for batch_id in batch_ids:
+            job = self.jobs.get(batch_id)
+            if job is not None and batch_id not in running:
+                job.task.cancel()
 
-def get_or_create_session(user_id: str, session_id: Optional[str], db: Session) -> str:
-    """Get existing session or create new one."""
-    # If database is not available, generate a simple session ID
-    if SessionLocal is None:
-        if session_id:
-            return session_id
-        else:
-            return str(uuid.uuid4())
-    
-    if session_id:
-        # Check if session exists and belongs to user
-        session = db.query(ChatSession).filter(
-            ChatSession.id == session_id,
-            ChatSession.user_id == user_id
-        ).first()
-        if session:
-            # Update last activity
-            session.updated_at = datetime.now()
-            db.commit()
-            return session_id
-    
-    # Create new session
-    new_session = ChatSession(user_id=user_id)
-    db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
-    return new_session.id
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self._renew()
+                if self.adopt:
+                    await self.claim_lapsed()
+            except Exception as e:
+                logger.error("Batch lease renewal failed: %s", e)
 
-# ============================================================================
-# AI PROCESSING
-# ============================================================================
+batch_runner: Optional[BatchRunner] = None
 
-def process_with_openai(messages: List[Dict[str, str]], user_message: str) -> Dict[str, Any]:
-    """Process message with OpenAI and return response with token usage."""
-    try:
-        # Simple system prompt
-        system_prompt = "You are AeroAssist, a helpful airline assistant. Help users with flight information, bookings, and travel questions."
+def discard_batch_source(path: str) -> None:
+    """Delete a finished job's file if it was spooled from an upload; files given to batch.py are left alone."""
+    if os.path.dirname(path) == os.path.abspath(BATCH_SPOOL_DIR):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
-        # Build conversation context
-        conversation_messages = [{"role": "system", "content": system_prompt}]
-        conversation_messages.extend(messages)
-        conversation_messages.append({"role": "user", "content": user_message})
-        
-        logger.info(f"Processing chat request with {len(conversation_messages)} messages in context")
-        
-        # Use the Responses API
-        if not openai_client:
-            raise Exception("OpenAI client not initialized")
-            
-        response = openai_client.responses.create(
-            model="gpt-4o-mini",
-            input=conversation_messages,
-            instructions="You are AeroAssist, a helpful airline assistant. Help users with flight information, bookings, and travel questions.",
-            temperature=0.7,
-        )
-        
-        # Extract the response text
-        final_text = ""
-        if hasattr(response, 'output_text') and response.output_text:
-            final_text = response.output_text
-        else:
-            for output in response.output:
-                if output.type == "message":
-                    for content in output.content:
-                        if content.type == "output_text":
-                            final_text += content.text
-        
-        logger.info("Successfully used Responses API")
-        return {
-            'reply': final_text.strip(),
-            'tokens_used': getattr(response.usage, 'total_tokens', 0) if hasattr(response, 'usage') else 0
-        }
-        
-    except Exception as e:
-        logger.error(f"OpenAI processing error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"AI processing error: {str(e)}")
+async def create_batch(session_factory, user_id: str, source: str, batch_id: Optional[str] = None) -> ChatBatch:
+    """Queue a job for the prompts in `source`; ValueError if it has none or a line is too long."""
+    total = await asyncio.to_thread(scan_batch_file, source)
+    if not total:
+        raise ValueError("The batch has no prompts")
+    batch = ChatBatch(id=batch_id or str(uuid.uuid4()), user_id=user_id, status="queued",
+                      source=os.path.abspath(source), total=total)
+    async with session_factory() as db:
+        db.add(batch)
+        await db.commit()
+    return batch
+
+def batch_to_dict(batch: ChatBatch) -> Dict[str, Any]:
+    done = batch.succeeded + batch.failed
+    job = batch_runner.jobs.get(batch.id) if batch_runner is not None else None
+    if job is not None:
+        rate = job.rate()
+    elif batch.started_at is not None and batch.finished_at is not None:
+        rate = done / max((batch.finished_at - batch.started_at).total_seconds(), 1e-9)
+    else:
+        rate = None
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": batch.total,
+        "completed": done,
+        "succeeded": batch.succeeded,
+        "failed": batch.failed,
+        "tokens_used": batch.tokens_used,
+        "prompts_per_second": round(rate, 2) if rate is not None else None,
+        "error": batch.error,
+        "created_at": batch.created_at.isoformat() if batch.created_at else None,
+        "started_at": batch.started_at.isoformat() if batch.started_at else None,
+        "finished_at": batch.finished_at.isoformat() if batch.finished_at else None
+    }
+
+async def batch_results(session_factory, batch_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """A job's stored results in line order, read through a server-side cursor like the history export."""
+    result_table = ChatBatchResult.__table__
+    query = (
+        select(result_table.c.line, result_table.c.custom_id, result_table.c.reply,
+               result_table.c.tokens_used, result_table.c.error)
+        .where(result_table.c.batch_id == batch_id)
+        .order_by(result_table.c.line)
+        .execution_options(yield_per=EXPORT_FETCH_ROWS)
+    )
+    async with session_factory() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            for row in rows:
+                yield {"line": row.line, "custom_id": row.custom_id, "reply": row.reply,
+                       "tokens_used": row.tokens_used, "error": row.error}
 
 # ============================================================================
 # ROUTES
@@ -393,69 +5064,52 @@ async def health_check():
 async def chat_endpoint(
     request: ChatRequest,
     user: User = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Simple chat endpoint with authentication and session management."""
     if not request.message.strip():
         raise HTTPException(status_code=400, detail="Message is required.")
+    await enforce_quota(user.id)
 
     try:
         # 1. Session Management
-        session_id = get_or_create_session(user.id, request.session_id, db)
-        logger.info(f"Session created/retrieved: {session_id}")
+        with StageTimer("session"):
+            session_id = await get_or_create_session(user.id, request.session_id, db)
+        log_sampled(logging.INFO, "Session created/retrieved: %s", session_id)
         
-        # 2. Get existing conversation from session
-        conversation = []
+        # 2. Get existing conversation: the server-side history is authoritative,
+        # the client's copy is only used when there is no database
+        conversation = client_history(request)
+        previous_response_id = None
         if SessionLocal is not None:
-            try:
-                messages = db.query(ChatMessage).filter(
-                    ChatMessage.session_id == session_id
-                ).order_by(ChatMessage.id).all()
-                
-                for msg in messages:
-                    conversation.append({
-                        "role": msg.role,
-                        "content": msg.content
-                    })
-                logger.info(f"Loaded existing conversation with {len(conversation)} messages")
-            except Exception as e:
-                logger.warning(f"Failed to load conversation from session: {e}")
+            with StageTimer("history"):
+                conversation = await load_history(db, session_id)
+                previous_response_id = await response_chain(db, session_id, conversation)
+            log_sampled(logging.INFO, "Loaded existing conversation with %s messages", len(conversation))
         
         # 3. Save user message to database
         if SessionLocal is not None:
-            user_message = ChatMessage(
-                session_id=session_id,
-                role="user",
-                content=request.message
-            )
-            db.add(user_message)
-            db.commit()
-            logger.info(f"User message saved to database")
+            with StageTimer("save_user_message"):
+                await save_message(db, session_id, user.id, "user", request.message)
+            log_sampled(logging.INFO, "User message saved to database")
         
         # 4. AI Processing (use conversation history for context)
-        conversation_for_ai = []
-        if request.conversation_history:
-            for msg in request.conversation_history:
-                conversation_for_ai.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        ai_response = process_with_openai(conversation_for_ai, request.message)
-        logger.info(f"AI response generated successfully")
+        with StageTimer("context"):
+            conversation_for_ai = prepare_context(session_id, conversation, request.message)
+        with StageTimer("llm"):
+            ai_response = await answer_turn(conversation, conversation_for_ai, request.message, user.id, previous_response_id)
+        log_sampled(logging.INFO, "AI response generated successfully")
+        if usage_ledger is not None:
+            usage_ledger.record(user.id, session_id, ai_response['tokens_used'])
         
         # 5. Save AI response to database
         if SessionLocal is not None:
-            ai_message = ChatMessage(
-                session_id=session_id,
-                role="assistant",
-                content=ai_response['reply']
-            )
-            db.add(ai_message)
-            db.commit()
-            logger.info(f"AI response saved to database")
+            with StageTimer("save_assistant_message"):
+                await save_message(db, session_id, user.id, "assistant", ai_response['reply'], ai_response['tokens_used'],
+                                   ai_response['response_id'])
+            log_sampled(logging.INFO, "AI response saved to database")
         else:
-            logger.info(f"Chat processed successfully - User: {user.id}, Session: {session_id} (no database)")
+            log_sampled(logging.INFO, "Chat processed successfully - User: %s, Session: %s (no database)", user.id, session_id)
         
         return ChatResponse(
             reply=ai_response['reply'],
@@ -464,33 +5118,243 @@ async def chat_endpoint(
             tokens_used=ai_response['tokens_used']
         )
         
+    except UpstreamBusy as e:
+        logger.warning("AI service busy: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is busy, please try again shortly",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        if SessionLocal is not None:
+            try:
+                await db.rollback()
+            except:
+                pass
+        logger.error("Error in chat endpoint: %s", e)
+        raise HTTPException(status_code=500, detail=f"Chat processing error: {str(e)}")
+
+def _sse(payload: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    user: User = Depends(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """Chat endpoint that streams the reply as Server-Sent Events."""
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message is required.")
+    await enforce_quota(user.id)
+
+    try:
+        with StageTimer("session"):
+            session_id = await get_or_create_session(user.id, request.session_id, db)
+        log_sampled(logging.INFO, "Session created/retrieved: %s", session_id)
+
+        conversation = client_history(request)
+        previous_response_id = None
+        if SessionLocal is not None:
+            with StageTimer("history"):
+                conversation = await load_history(db, session_id)
+                previous_response_id = await response_chain(db, session_id, conversation)
+            with StageTimer("save_user_message"):
+                await save_message(db, session_id, user.id, "user", request.message)
+    except HTTPException:
+        raise
     except Exception as e:
         if SessionLocal is not None:
             try:
-                db.rollback()
+                await db.rollback()
             except:
                 pass
-        logger.error(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat stream endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Chat processing error: {str(e)}")
 
+    with StageTimer("context"):
+        conversation_for_ai = prepare_context(session_id, conversation, request.message)
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            start = time.perf_counter()
+            first_token = True
+            async for event in stream_answer_turn(conversation, conversation_for_ai, request.message, user.id, previous_response_id):
+                if event["type"] == "delta":
+                    if first_token:
+                        stage_seconds.observe(time.perf_counter() - start, "llm_first_token")
+                        first_token = False
+                    yield _sse(event)
+                    continue
+                stage_seconds.observe(time.perf_counter() - start, "llm")
+                if usage_ledger is not None:
+                    usage_ledger.record(user.id, session_id, event["tokens_used"])
+
+                # The request-scoped session is closed once streaming starts
+                if SessionLocal is not None:
+                    with StageTimer("save_assistant_message"):
+                        async with SessionLocal() as stream_db:
+                            await save_message(stream_db, session_id, user.id, "assistant", event["reply"],
+                                               event["tokens_used"], event["response_id"])
+                    log_sampled(logging.INFO, "AI response saved to database")
+
+                yield _sse({
+                    "type": "done",
+                    "session_id": str(session_id),
+                    "timestamp": datetime.now().isoformat(),
+                    "tokens_used": event["tokens_used"]
+                })
+        except UpstreamBusy as e:
+            # Headers are already sent, so the 503 travels in the error event
+            logger.warning("AI service busy: %s", e)
+            yield _sse({
+                "type": "error",
+                "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "detail": "AI service is busy, please try again shortly",
+                "retry_after": math.ceil(e.retry_after)
+            })
+        except Exception as e:
+            stage_errors.inc("llm")
+            logger.error("Error in chat stream: %s", e)
+            yield _sse({"type": "error", "detail": f"AI processing error: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None):
+    """Chat over one WebSocket: authenticate once, then stream any number of turns.
+
+    The token comes in the Authorization header or a first {"type": "auth"}
+    frame; the frames exchanged are described in the README.
+    """
+    if not chat_connections.has_room():
+        ws_disconnects.inc("capacity")
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    await websocket.accept()
+    conn = ChatConnection(websocket)
+    chat_connections.add(conn)
+    try:
+        await serve_chat_connection(conn, session_id)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error("Error in WebSocket chat: %s", e)
+        await ws_close(conn, status.WS_1011_INTERNAL_ERROR, "error")
+    finally:
+        chat_connections.remove(conn)
+        if conn.turn is not None:
+            conn.turn.cancel()
+            await asyncio.gather(conn.turn, return_exceptions=True)
+
+@router.post("/chat/batch", status_code=status.HTTP_202_ACCEPTED)
+async def submit_chat_batch(request: Request, user: User = Depends(verify_token)):
+    """Submit a JSONL file of prompts as the request body, one {"message": ...} object per line.
+
+    The body is spooled to BATCH_SPOOL_DIR as it arrives rather than held in
+    memory, and the job runs in the background; poll GET /chat/batch/{batch_id}.
+    """
+    if batch_runner is None:
+        raise HTTPException(status_code=503, detail="Batch jobs need a database")
+    await enforce_quota(user.id)
+
+    batch_id = str(uuid.uuid4())
+    os.makedirs(BATCH_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(os.path.abspath(BATCH_SPOOL_DIR), f"{batch_id}.jsonl")
+    try:
+        size = 0
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > BATCH_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Batch files are limited to {BATCH_MAX_BYTES} bytes")
+                await asyncio.to_thread(f.write, chunk)
+        batch = await create_batch(SessionLocal, user.id, path, batch_id)
+    except ValueError as e:
+        discard_batch_source(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        discard_batch_source(path)
+        raise
+
+    await batch_runner.claim(batch.id)
+    return {"batch_id": batch.id, "status": "running" if batch.id in batch_runner.jobs else batch.status,
+            "total": batch.total}
+
+async def get_user_batch(db: AsyncSession, batch_id: str, user_id: str) -> ChatBatch:
+    batch = await db.get(ChatBatch, batch_id) if SessionLocal is not None else None
+    if batch is None or batch.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@router.get("/chat/batch/{batch_id}")
+async def get_chat_batch(batch_id: str, user: User = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    """Progress of a batch job: prompts done, failed, tokens and throughput."""
+    return batch_to_dict(await get_user_batch(db, batch_id, user.id))
+
+@router.get("/chat/batch/{batch_id}/results")
+async def get_chat_batch_results(
+    batch_id: str,
+    compress: bool = False,
+    user: User = Depends(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream a job's results as NDJSON in line order, gzipped with compress=true.
+
+    Available while the job runs, up to its checkpoint.
+    """
+    await get_user_batch(db, batch_id, user.id)
+    filename = f"batch-{batch_id}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        ndjson_chunks(batch_results(SessionLocal, batch_id), compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.delete("/chat/batch/{batch_id}")
+async def cancel_chat_batch(batch_id: str, user: User = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    """Cancel a batch job; results stored so far are kept."""
+    batch = await get_user_batch(db, batch_id, user.id)
+    if batch.status in BATCH_ACTIVE:
+        batch_table = ChatBatch.__table__
+        await db.execute(update(batch_table).where(
+            batch_table.c.id == batch_id, batch_table.c.status.in_(BATCH_ACTIVE)
+        ).values(status="cancelled", finished_at=datetime.now(timezone.utc), lease_expires_at=None))
+        await db.commit()
+        # A job running in another worker stops at its next lease renewal
+        job = batch_runner.jobs.get(batch_id)
+        if job is not None:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        discard_batch_source(batch.source)
+        await db.refresh(batch)
+    return batch_to_dict(batch)
+
 @router.get("/sessions/{user_id}")
 async def get_user_sessions(
     user_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     user: User = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all chat sessions for a user."""
+    """Get a user's chat sessions, newest activity first, one page at a time."""
     if user.id != user_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
     # If database is not available, return empty sessions
     if SessionLocal is None:
-        return {"sessions": []}
+        return {"sessions": [], "next_cursor": None}
     
     try:
-        sessions = db.query(ChatSession).filter(
-            ChatSession.user_id == user_id
-        ).order_by(ChatSession.updated_at.desc()).all()
+        sessions, next_cursor = await list_user_sessions(db, user_id, limit, cursor)
         
         return {
             "sessions": [
@@ -498,59 +5362,182 @@ async def get_user_sessions(
                     "id": session.id,
                     "created_at": session.created_at.isoformat(),
                     "updated_at": session.updated_at.isoformat(),
-                    "message_count": db.query(ChatMessage).filter(
-                        ChatMessage.session_id == session.id
-                    ).count()
+                    "message_count": session.message_count,
+                    "tokens_used": session.tokens_used,
+                    "archived": session.archived_at is not None
                 }
                 for session in sessions
-            ]
+            ],
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching sessions: {e}")
-        return {"sessions": []}
+        logger.error("Error fetching sessions: %s", e)
+        return {"sessions": [], "next_cursor": None}
+
+@router.get("/usage/{user_id}")
+async def get_user_usage(
+    user_id: str,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    days: int = Query(7, ge=1, le=90),
+    user: User = Depends(verify_token)
+):
+    """Get a user's token and chat turn totals per hour or day for the last `days` days.
+
+    Served from the usage rollups, never by scanning chat_messages.
+    """
+    if user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    # Hours cover the last `days` * 24 hours; days are today and the days - 1 before it
+    since = time.time() - (days if granularity == "hour" else days - 1) * DAY_SECONDS
+    buckets = []
+    if usage_ledger is not None:
+        try:
+            buckets = await usage_ledger.usage(user_id, granularity, since)
+        except Exception as e:
+            logger.error("Error fetching usage: %s", e)
+            raise HTTPException(status_code=500, detail="Failed to fetch usage")
+
+    return {
+        "granularity": granularity,
+        "buckets": buckets,
+        "total_tokens": sum(bucket["tokens"] for bucket in buckets),
+        "total_requests": sum(bucket["requests"] for bucket in buckets),
+        "quotas": {
+            "requests_per_minute": USER_REQUESTS_PER_MINUTE or None,
+            "tokens_per_day": USER_TOKENS_PER_DAY or None
+        }
+    }
 
 @router.get("/conversation/{session_id}")
 async def get_conversation(
     session_id: str,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=500),
     user: User = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get complete conversation for a session."""
+    """Get one page of a session's conversation, oldest message first.
+
+    Without cursors the newest `limit` messages are returned. Pass the first
+    message's `seq` as `before` to page back, or the last one's as `after` to
+    fetch newer messages.
+    """
     if SessionLocal is None:
-        return {"conversation": []}
+        return {"conversation": [], "has_more": False}
     
     try:
-        session = db.query(ChatSession).filter(
-            ChatSession.id == session_id,
-            ChatSession.user_id == user.id
-        ).first()
+        session = await get_user_session(db, session_id, user.id)
         
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        messages = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session_id
-        ).order_by(ChatMessage.id).all()
+        # Fetch one extra row to learn whether another page exists
+        messages = await get_session_messages(db, session_id, before, after, limit + 1)
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[:limit] if after is not None else messages[1:]
         
         conversation = []
         for msg in messages:
             conversation.append({
+                "seq": msg.seq,
                 "role": msg.role,
                 "content": msg.content,
-                "timestamp": msg.id  # Using ID as timestamp since we don't have a timestamp column
+                "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
+                "tokens_used": msg.tokens_used or 0
             })
         
-        return {"conversation": conversation}
+        return {"conversation": conversation, "has_more": has_more}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching conversation: {e}")
+        logger.error("Error fetching conversation: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch conversation")
 
+@router.get("/search")
+async def search_conversations(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = None,
+    user: User = Depends(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """Search the user's messages, best match first, one page at a time.
+
+    Each hit has a snippet with the matches marked, and its session_id and
+    seq; pass `before=seq + 1` to /conversation/{session_id} to open the
+    conversation at that message.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query is required")
+    if SessionLocal is None:
+        return {"results": [], "next_cursor": None}
+
+    try:
+        results, next_cursor = await search_messages(db, user.id, q, limit, cursor)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error searching messages: %s", e)
+        raise HTTPException(status_code=500, detail="Search failed")
+    return {"results": results, "next_cursor": next_cursor}
+
+@router.get("/export/{user_id}")
+async def export_user_history_endpoint(
+    user_id: str,
+    compress: bool = False,
+    user: User = Depends(verify_token)
+):
+    """Stream all of a user's sessions and messages as NDJSON, gzipped with compress=true.
+
+    Records are read from a server-side cursor and written as they arrive,
+    so the export never has to fit in memory. The request-scoped database
+    session is closed once streaming starts, so the export opens its own.
+    """
+    if user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Export needs a database")
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in ndjson_chunks(export_user_history(SessionLocal, user_id), compress):
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; the missing "end" record marks the export as incomplete
+            logger.error("Export for user %s failed: %s", user_id, e)
+            raise
+
+    filename = f"aeroassist-{user_id}-{datetime.now(timezone.utc):%Y%m%d}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.delete("/cache/responses")
+async def invalidate_cached_response(
+    question: str,
+    user: User = Depends(require_admin)
+):
+    """Drop the cached answer for a question, e.g. after a policy change. Admins only."""
+    if response_cache is None:
+        return {"invalidated": False}
+    return {"invalidated": response_cache.invalidate(question)}
+
 @router.get("/debug/auth")
 async def debug_auth():
     """Debug endpoint to check authentication configuration."""
     return {
         "supabase_configured": supabase is not None,
+        "auth_verify_mode": AUTH_VERIFY_MODE,
+        "local_jwt_secret_configured": bool(LOCAL_JWT_SECRET),
+        "auth_cache_entries": len(auth_cache),
         "supabase_url_configured": bool(SUPABASE_URL),
         "supabase_key_configured": bool(SUPABASE_SERVICE_ROLE_KEY),
         "openai_configured": bool(OPENAI_API_KEY),
@@ -558,6 +5545,47 @@ async def debug_auth():
         "timestamp": datetime.now().isoformat()
     }
 
+@router.get("/debug/cache")
+async def debug_cache():
+    """Debug endpoint with conversation and claims cache statistics."""
+    return {
+        "conversation_cache": conversation_store.stats(),
+        "auth_cache": {"entries": len(auth_cache), "hits": auth_cache.hits, "misses": auth_cache.misses},
+        "response_cache": response_cache.stats() if response_cache else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/debug/llm")
+async def debug_llm():
+    """Debug endpoint with upstream call coalescing, scheduler, routing, response chain and policy index statistics."""
+    return {
+        "coalescing_enabled": LLM_COALESCING_ENABLED,
+        **llm_flights.stats(),
+        "scheduler": upstream_scheduler.stats(),
+        "routing": model_router.stats(),
+        "response_chains": {
+            "enabled": LLM_CHAIN_RESPONSES,
+            **{outcome: int(response_chain_turns.value(outcome)) for outcome in ("chained", "full", "rebuilt")}
+        },
+        "policy_index": policy_index.stats() if policy_index is not None else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/debug/ws")
+async def debug_ws():
+    """Debug endpoint with WebSocket chat connection statistics."""
+    return {
+        **chat_connections.stats(),
+        "disconnects": {reason: int(ws_disconnects.value(reason)) for reason in
+                        ("capacity", "user_limit", "auth_timeout", "auth_failed", "token_expired", "idle", "too_big", "error")},
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint: stage latencies, request, DB and token counters, pool gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @router.get("/debug/env")
 async def debug_env():
     """Debug endpoint to check environment variables (without sensitive data)."""
@@ -576,19 +5604,81 @@ async def debug_env():
 @asynccontextmanager
 async def lifespan(app):
     """Application lifespan manager."""
+    configure_logging()
     logger.info("AeroAssist API starting up...")
     
-    # Test database connection
-    try:
-        if engine:
-            with engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-            logger.info("Database connection successful")
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
+    global write_behind, usage_ledger, batch_runner, engine, SessionLocal
+
+    # Independent resources come up concurrently; SDK imports and client
+    # construction run in threads while the database answers its ping. The
+    # Supabase client is left for first use unless every request needs it.
+    startup = [init_database(create_tables=AUTO_MIGRATE), asyncio.to_thread(init_openai_client),
+               asyncio.to_thread(load_token_encoding), reload_policy_index()]
+    if AUTH_VERIFY_MODE != "local" or not LOCAL_JWT_SECRET:
+        startup.append(asyncio.to_thread(get_supabase))
+    await asyncio.gather(*startup)
+    if engine:
+        logger.info("Database connection successful")
+    if policy_index is None:
+        logger.info("No policy index at %s; answering without policy excerpts", POLICY_INDEX_PATH)
+    policy_watcher = asyncio.create_task(watch_policy_index())
+    ws_sweeper = asyncio.create_task(chat_connections.run(WS_AUTH_CHECK_SECONDS))
+
+    # Warm the SDK in the background rather than holding up readiness
+    warm_up = asyncio.create_task(warm_openai_sdk()) if openai_client is not None else None
+
+    if SessionLocal is not None and PERSISTENCE_MODE == "write_behind":
+        write_behind = WriteBehindWriter(
+            SessionLocal,
+            WRITE_BEHIND_FLUSH_MS,
+            WRITE_BEHIND_BATCH_ROWS,
+            WRITE_BEHIND_QUEUE_SIZE,
+            WRITE_BEHIND_SPILL_PATH,
+            WRITE_BEHIND_MAX_RETRIES,
+            WRITE_BEHIND_REJECT_PATH
+        )
+        await write_behind.start()
+        logger.info("Write-behind persistence enabled")
+
+    # Quotas apply with or without a database; usage is only kept with one
+    usage_ledger = UsageLedger(
+        SessionLocal,
+        USAGE_FLUSH_SECONDS,
+        USER_REQUESTS_PER_MINUTE,
+        USER_TOKENS_PER_DAY,
+        USAGE_TRACKED_USERS
+    )
+    await usage_ledger.start()
+
+    if SessionLocal is not None:
+        # Picks up jobs left running by a worker that stopped
+        batch_runner = BatchRunner(SessionLocal, BATCH_CONCURRENCY, BATCH_FLUSH_ROWS, BATCH_FLUSH_SECONDS,
+                                   BATCH_LEASE_SECONDS)
+        await batch_runner.start()
     
     yield
     logger.info("AeroAssist API shutting down...")
+    if batch_runner is not None:
+        await batch_runner.stop()
+        batch_runner = None
+    policy_watcher.cancel()
+    ws_sweeper.cancel()
+    if warm_up is not None:
+        await warm_up
+    # The ledger's last flush may wait on queued write-behind sessions
+    await usage_ledger.stop()
+    usage_ledger = None
+    if write_behind is not None:
+        await write_behind.stop()
+        write_behind = None
+    await model_router.close()
+    if openai_client is not None:
+        await openai_client.close()
+    if engine:
+        await engine.dispose()
+        engine = None
+        SessionLocal = None
+    stop_logging()
 
 # Create FastAPI app
 app = FastAPI(
@@ -607,18 +5697,62 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Count and time every request
+app.add_middleware(MetricsMiddleware)
+
+# Outermost, so every log line of a request carries its ID
+app.add_middleware(RequestIdMiddleware)
+
 # Include routes
 app.include_router(router)
 
 if __name__ == "__main__":
-    logger.info(f"Starting AeroAssist API on port {PORT}")
-    
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=PORT,
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    import uvicorn
+
+    configure_logging()
+
+    if RUN_MODE == "production":
+        # uvloop and httptools come with uvicorn[standard]; fall back if missing
+        try:
+            import uvloop  # noqa: F401
+            loop = "uvloop"
+        except ImportError:
+            loop = "asyncio"
+        try:
+            import httptools  # noqa: F401
+            http = "httptools"
+        except ImportError:
+            http = "h11"
+
+        logger.info("Starting AeroAssist API on port %s with %s workers (%s/%s, %s DB connections each)",
+                    PORT, WEB_CONCURRENCY, loop, http, DB_POOL_SIZE)
+        # Workers re-import this module; pin the worker count so each sizes its pool alike
+        os.environ["WEB_CONCURRENCY"] = str(WEB_CONCURRENCY)
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=PORT,
+            workers=WEB_CONCURRENCY,
+            loop=loop,
+            http=http,
+            ws_max_size=WS_MAX_MESSAGE_BYTES,
+            ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+            log_level="info",
+            # Let uvicorn's server and access logs propagate to the queued JSON pipeline
+            log_config=None
+        )
+    else:
+        logger.info("Starting AeroAssist API on port %s", PORT)
+
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=PORT,
+            reload=True,
+            ws_max_size=WS_MAX_MESSAGE_BYTES,
+            ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+            log_level="info"
+        )
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""Create any missing AeroAssist tables and indexes in DATABASE_URL.
+
+Run once per deployment (or set AUTO_MIGRATE=true to do it at startup):
+
+    python migrate.py
+
+Existing tables are left as they are; supabase_tables.sql has the column
+and index changes for databases created by older versions.
+
+    python migrate.py --partition-messages
+
+also converts chat_messages to monthly partitions (a one-off that copies
+every row, so run it in a maintenance window), or adds any missing ones.
+"""
+
+import argparse
+import asyncio
+import sys
+
+import main
+
+async def migrate(partition_messages: bool) -> bool:
+    await main.init_database(create_tables=True)
+    if main.engine is None:
+        return False
+    try:
+        if partition_messages:
+            async with main.engine.begin() as conn:
+                created = await conn.run_sync(main.partition_message_table, main.MESSAGE_PARTITIONS_AHEAD)
+            print(f"chat_messages is partitioned by month; created {', '.join(created) or 'no new partitions'}")
+    finally:
+        await main.engine.dispose()
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--partition-messages", action="store_true",
+                        help="partition chat_messages by month (SQLite emulates it with a view)")
+    args = parser.parse_args()
+    main.configure_logging()
+
+    if not main.ASYNC_DATABASE_URL:
+        print("No DATABASE_URL available")
+        sys.exit(1)
+    if not asyncio.run(migrate(args.partition_messages)):
+        print("Migration failed - see the log above")
+        sys.exit(1)
+    print("Database schema is up to date")
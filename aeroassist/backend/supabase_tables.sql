@@ -36,4 +36,134 @@ DROP TRIGGER IF EXISTS update_chat_sessions_updated_at ON chat_sessions;
 CREATE TRIGGER update_chat_sessions_updated_at 
     BEFORE UPDATE ON chat_sessions 
     FOR EACH ROW 
-    EXECUTE FUNCTION update_updated_at_column();
\ No newline at end of file
+    EXECUTE FUNCTION update_updated_at_column();
+-- Denormalized per-session message count, maintained by the backend on every
+-- message write so listing sessions never scans chat_messages
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+
+-- Backfill existing sessions in one grouped pass without touching updated_at
+ALTER TABLE chat_sessions DISABLE TRIGGER update_chat_sessions_updated_at;
+UPDATE chat_sessions s
+SET message_count = c.n
+FROM (SELECT session_id, COUNT(*) AS n FROM chat_messages GROUP BY session_id) c
+WHERE c.session_id = s.id AND s.message_count <> c.n;
+ALTER TABLE chat_sessions ENABLE TRIGGER update_chat_sessions_updated_at;
+
+-- Keyset pagination of a user's sessions by recent activity
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated ON chat_sessions(user_id, updated_at DESC, id DESC);
+
+-- Monotonic message order. seq is microseconds since the epoch, assigned by
+-- the backend; existing rows are backfilled from their timestamp.
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+UPDATE chat_messages m
+SET seq = o.seq
+FROM (
+    SELECT id,
+           (EXTRACT(EPOCH FROM timestamp) * 1000000)::BIGINT
+               + ROW_NUMBER() OVER (PARTITION BY session_id, timestamp ORDER BY id) - 1 AS seq
+    FROM chat_messages
+    WHERE seq IS NULL
+) o
+WHERE m.id = o.id;
+ALTER TABLE chat_messages ALTER COLUMN seq SET NOT NULL;
+
+-- Ordered index scans for conversation pages
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_messages_session_seq ON chat_messages(session_id, seq);
+
+-- Per-session token totals, added in batches by the backend's usage ledger.
+-- The ledger's updates aren't session activity, so updated_at is only
+-- bumped by updates that touch the session's messages.
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS tokens_used BIGINT NOT NULL DEFAULT 0;
+DROP TRIGGER IF EXISTS update_chat_sessions_updated_at ON chat_sessions;
+UPDATE chat_sessions s
+SET tokens_used = c.tokens
+FROM (SELECT session_id, SUM(tokens_used) AS tokens FROM chat_messages GROUP BY session_id) c
+WHERE c.session_id = s.id AND s.tokens_used <> c.tokens;
+CREATE TRIGGER update_chat_sessions_updated_at
+    BEFORE UPDATE OF user_id, message_count ON chat_sessions
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- Per-user usage rollups by UTC hour and day. GET /usage reads these
+-- instead of scanning chat_messages; requests counts answered chat turns.
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    user_id VARCHAR NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    tokens BIGINT NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, bucket_start)
+);
+
+CREATE TABLE IF NOT EXISTS usage_daily (
+    user_id VARCHAR NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    tokens BIGINT NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, bucket_start)
+);
+
+-- Backfill the rollups from existing assistant messages, once
+INSERT INTO usage_hourly (user_id, bucket_start, tokens, requests)
+SELECT user_id, date_trunc('hour', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', SUM(tokens_used), COUNT(*)
+FROM chat_messages
+WHERE role = 'assistant'
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+INSERT INTO usage_daily (user_id, bucket_start, tokens, requests)
+SELECT user_id, date_trunc('day', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', SUM(tokens_used), COUNT(*)
+FROM chat_messages
+WHERE role = 'assistant'
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+-- Cold archival: archived_at is set while a session's messages live in the
+-- compressed archive files (archive.py) instead of chat_messages. The
+-- partial index finds archive candidates and shrinks as sessions go cold.
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_active_updated ON chat_sessions(updated_at) WHERE archived_at IS NULL;
+
+-- Monthly partitions of chat_messages are optional. The conversion copies
+-- every row, so it is not part of this script; run it in a maintenance
+-- window with `python migrate.py --partition-messages`, after which
+-- archive.py keeps upcoming months' partitions created and drops emptied ones.
+
+-- Full-text search over a user's messages (GET /search). The expression
+-- index leads with user_id, so btree_gin is needed for the plain column;
+-- queries must use the same to_tsvector('english', content) to hit it.
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX IF NOT EXISTS idx_chat_messages_search ON chat_messages USING GIN (user_id, to_tsvector('english', content));
+
+-- Server-side conversation state (LLM_CHAIN_RESPONSES): the id of the
+-- session's last stored OpenAI response, which the next turn continues from.
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS last_response_id VARCHAR;
+
+-- Batch chat jobs (POST /chat/batch, batch.py): one row per job, with the
+-- checkpoint it resumes from, and one row per answered line of its file.
+CREATE TABLE IF NOT EXISTS chat_batches (
+    id VARCHAR PRIMARY KEY,
+    user_id VARCHAR NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'queued',
+    source VARCHAR NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    checkpoint INTEGER NOT NULL DEFAULT 0,
+    succeeded INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    tokens_used BIGINT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    lease_expires_at TIMESTAMP WITH TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS idx_chat_batches_user_id ON chat_batches(user_id);
+
+CREATE TABLE IF NOT EXISTS chat_batch_results (
+    batch_id VARCHAR NOT NULL REFERENCES chat_batches(id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    custom_id VARCHAR,
+    reply TEXT,
+    tokens_used INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (batch_id, line)
+);
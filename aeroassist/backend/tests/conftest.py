@@ -0,0 +1,73 @@
+"""Shared fixtures: the app under uvicorn on a temporary SQLite database, against a fake OpenAI.
+
+main reads its configuration at import, so the environment is set here
+before anything imports it.
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import httpx
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+_tmpdir = tempfile.mkdtemp(prefix="aeroassist-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_tmpdir, 'test.db')}",
+    "AUTO_MIGRATE": "true",
+    "OPENAI_API_KEY": "fake",
+    "LOG_LEVEL": "WARNING",
+    "RESPONSE_CACHE_ENABLED": "false",
+    "POLICY_INDEX_PATH": os.path.join(_tmpdir, "policy.idx"),
+    "BATCH_SPOOL_DIR": os.path.join(_tmpdir, "batches"),
+    "ARCHIVE_DIR": os.path.join(_tmpdir, "archive"),
+})
+
+from fakes import FAKE_JWT_SECRET, AppServer, FakeOpenAI, FakeSupabaseAuth, make_token  # noqa: E402
+
+os.environ["JWT_SECRET_KEY"] = FAKE_JWT_SECRET
+
+import main  # noqa: E402
+
+@pytest.fixture(scope="session")
+def fake():
+    with FakeOpenAI() as fake:
+        yield fake
+
+@pytest.fixture(scope="session")
+def supabase_auth():
+    with FakeSupabaseAuth() as fake:
+        yield fake
+
+@pytest.fixture(scope="session")
+def server(fake):
+    from openai import AsyncOpenAI
+
+    with AppServer(main.app) as server:
+        main.openai_client = AsyncOpenAI(api_key="fake", base_url=fake.url + "/v1", max_retries=0)
+        yield server
+
+@pytest.fixture(autouse=True)
+def reset(request):
+    """Undo what a test changed on the fake and the app's upstream scheduler."""
+    main.upstream_scheduler = main.UpstreamScheduler(64, 0, 0, 30, 10000, 3, 0.01, 0.05)
+    yield
+    if "fake" in request.fixturenames:
+        fake = request.getfixturevalue("fake")
+        fake.failure_rate = 0.0
+        fake.latency_ms = 0.0
+        fake.token_interval_ms = 0.0
+
+@pytest.fixture
+def user_id() -> str:
+    return f"test-{uuid.uuid4()}"
+
+@pytest.fixture
+def client(server, user_id):
+    headers = {"Authorization": f"Bearer {make_token(user_id=user_id)}"}
+    with httpx.Client(base_url=server.url, headers=headers, timeout=30) as client:
+        yield client
@@ -0,0 +1,37 @@
+"""Restoring archived sessions on read."""
+
+import os
+import sqlite3
+
+def database():
+    return sqlite3.connect(os.environ["DATABASE_URL"].removeprefix("sqlite:///"))
+
+def archived_at(session_id: str):
+    with database() as db:
+        return db.execute("SELECT archived_at FROM chat_sessions WHERE id = ?", (session_id,)).fetchone()[0]
+
+def session_missing_from_the_archive(client) -> str:
+    """A session marked archived, but with no entry in the archive."""
+    session_id = client.post("/chat", json={"message": "I'm flying to Lisbon."}).json()["session_id"]
+    with database() as db:
+        db.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+        db.execute("UPDATE chat_sessions SET archived_at = CURRENT_TIMESTAMP WHERE id = ?", (session_id,))
+    return session_id
+
+def test_archived_session_missing_from_the_archive_stays_archived(client):
+    session_id = session_missing_from_the_archive(client)
+
+    response = client.get(f"/conversation/{session_id}")
+
+    assert response.status_code == 503
+    assert archived_at(session_id) is not None
+
+def test_chat_on_an_archived_session_missing_from_the_archive_is_a_503(client):
+    session_id = session_missing_from_the_archive(client)
+
+    chat = client.post("/chat", json={"message": "Can I bring a surfboard?", "session_id": session_id})
+    stream = client.post("/chat/stream", json={"message": "Can I bring a surfboard?", "session_id": session_id})
+
+    assert chat.status_code == 503
+    assert stream.status_code == 503
+    assert archived_at(session_id) is not None
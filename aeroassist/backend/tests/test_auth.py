@@ -0,0 +1,89 @@
+"""Token verification: local HS256 and JWKS checks, the claims cache, and the Supabase fallback."""
+
+import time
+
+import httpx
+import pytest
+from jose import JWTError
+
+from fakes import make_service_role_key, make_signing_key, make_token
+
+import main
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    main.auth_cache.clear()
+    main.jwks_cache.clear()
+
+@pytest.fixture
+def jwks(supabase_auth, monkeypatch):
+    monkeypatch.setattr(main, "SUPABASE_JWKS_URL", f"{supabase_auth.url}/auth/v1/.well-known/jwks.json")
+    supabase_auth.jwks_requests = 0
+    return supabase_auth
+
+@pytest.fixture
+def remote_only(supabase_auth, monkeypatch):
+    """AUTH_VERIFY_MODE left at local, but no JWT_SECRET_KEY: HS256 tokens go to Supabase."""
+    monkeypatch.setattr(main, "LOCAL_JWT_SECRET", None)
+    monkeypatch.setattr(main, "SUPABASE_URL", supabase_auth.url)
+    monkeypatch.setattr(main, "SUPABASE_SERVICE_ROLE_KEY", make_service_role_key())
+    monkeypatch.setattr(main, "supabase", None)
+    monkeypatch.setattr(main, "_supabase_attempted", False)
+    return supabase_auth
+
+def status_with(server, token: str) -> int:
+    return httpx.get(f"{server.url}/sessions/someone", headers={"Authorization": f"Bearer {token}"}).status_code
+
+def test_hs256_token_is_accepted():
+    assert main.verify_token_claims(make_token(user_id="alice"))["sub"] == "alice"
+
+@pytest.mark.parametrize("token", [
+    make_token(secret="not-the-project-secret"),
+    make_token(expires_in=-60),
+    make_token(audience="someone-else"),
+], ids=["bad signature", "expired", "wrong audience"])
+def test_invalid_tokens_are_refused(server, token):
+    with pytest.raises(JWTError):
+        main.verify_token_claims(token)
+    assert status_with(server, token) == 401
+
+def test_jwks_is_refetched_once_for_a_rotated_key(jwks):
+    old_key, old_jwk = make_signing_key("2024")
+    new_key, new_jwk = make_signing_key("2025")
+    jwks.jwks = [old_jwk]
+
+    for user_id in ("alice", "bob"):
+        token = make_token(user_id=user_id, secret=old_key, algorithm="ES256", kid="2024")
+        assert main.verify_token_claims(token)["sub"] == user_id
+    assert jwks.jwks_requests == 1
+
+    # The project rotates its signing key
+    jwks.jwks = [old_jwk, new_jwk]
+    token = make_token(user_id="carol", secret=new_key, algorithm="ES256", kid="2025")
+    assert main.verify_token_claims(token)["sub"] == "carol"
+    assert jwks.jwks_requests == 2
+
+    forged_key, _ = make_signing_key("2026")
+    with pytest.raises(JWTError):
+        main.verify_token_claims(make_token(secret=forged_key, algorithm="ES256", kid="2026"))
+
+def test_cached_claims_expire_with_the_token():
+    token = make_token(expires_in=1)
+    main.verify_token_claims(token)
+    assert main.auth_cache.get(main.hashlib.sha256(token.encode()).hexdigest()) is not None
+
+    # Expiry is checked in whole seconds
+    time.sleep(main.jwt.get_unverified_claims(token)["exp"] + 1.1 - time.time())
+    with pytest.raises(JWTError):
+        main.verify_token_claims(token)
+
+def test_without_a_jwt_secret_tokens_are_checked_with_supabase(remote_only):
+    requests = remote_only.requests
+
+    claims = main.verify_token_claims(make_token(user_id="dave"))
+
+    assert claims["sub"] == "dave"
+    assert remote_only.requests - requests == 1
+    with pytest.raises(main.HTTPException) as refused:
+        main.verify_token_claims(make_token(secret="not-the-project-secret"))
+    assert refused.value.status_code == 401
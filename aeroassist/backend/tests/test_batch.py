@@ -0,0 +1,48 @@
+"""POST /chat/batch jobs against the fake OpenAI server."""
+
+import json
+import time
+
+import main
+
+def run_batch(client, prompts: int) -> dict:
+    body = "".join(json.dumps({"custom_id": f"msg-{i}", "message": f"Question {i}"}) + "\n" for i in range(prompts))
+    response = client.post("/chat/batch", content=body)
+    assert response.status_code == 202
+    batch_id = response.json()["batch_id"]
+    deadline = time.monotonic() + 30
+    while (batch := client.get(f"/chat/batch/{batch_id}").json())["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return batch
+
+def test_batch_answers_every_prompt(client):
+    batch = run_batch(client, 20)
+
+    assert batch["status"] == "completed", batch["error"]
+    assert batch["succeeded"] == 20
+    assert batch["tokens_used"] > 0
+
+def test_batch_stops_once_over_the_daily_token_quota(client, monkeypatch):
+    # Room for the first prompts only: each answer uses more tokens than this
+    monkeypatch.setattr(main, "usage_ledger", main.UsageLedger(None, 60, 0, 1, 100))
+    batch = run_batch(client, 200)
+
+    assert batch["status"] == "failed"
+    assert "tokens_per_day" in batch["error"]
+    assert 0 < batch["succeeded"] < 200
+    assert batch["completed"] == batch["succeeded"]
+
+def test_prompts_admitted_before_the_quota_ran_out_are_kept(client, fake, monkeypatch):
+    monkeypatch.setattr(main, "usage_ledger", main.UsageLedger(None, 60, 0, 1, 100))
+    # The first prompt is still being answered when the others use up the quota
+    latencies = iter([500.0])
+    fake.latency_ms = lambda: next(latencies, 0.0)
+
+    batch = run_batch(client, 50)
+
+    assert batch["status"] == "failed"
+    assert batch["succeeded"] >= 1
+    results = [json.loads(line) for line in client.get(f"/chat/batch/{batch['batch_id']}/results").text.splitlines()]
+    assert results[0]["line"] == 0
+    assert results[0]["reply"]
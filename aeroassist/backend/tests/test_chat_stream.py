@@ -0,0 +1,75 @@
+"""POST /chat and POST /chat/stream against the fake OpenAI server."""
+
+import json
+
+from fakes import FAKE_REPLY
+
+def stream_events(client, **body) -> list:
+    events = []
+    with client.stream("POST", "/chat/stream", json=body) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for line in response.iter_lines():
+            if line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+    return events
+
+def conversation(client, session_id: str) -> list:
+    response = client.get(f"/conversation/{session_id}")
+    assert response.status_code == 200
+    return [(msg["role"], msg["content"]) for msg in response.json()["conversation"]]
+
+def test_chat_replies_and_saves_both_messages(client):
+    response = client.post("/chat", json={"message": "What is my baggage allowance?"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["reply"] == FAKE_REPLY
+    assert body["tokens_used"] > 0
+    assert conversation(client, body["session_id"]) == [
+        ("user", "What is my baggage allowance?"), ("assistant", FAKE_REPLY)]
+
+def test_chat_requires_a_token(server):
+    import httpx
+
+    assert httpx.post(f"{server.url}/chat", json={"message": "hi"}).status_code in (401, 403)
+
+def test_stream_sends_deltas_in_order_then_done(client, fake):
+    fake.token_interval_ms = 1
+    events = stream_events(client, message="Can I bring a surfboard?")
+
+    *deltas, done = events
+    assert deltas and all(event["type"] == "delta" for event in deltas)
+    assert "".join(event["content"] for event in deltas) == FAKE_REPLY
+    assert done["type"] == "done"
+    assert done["tokens_used"] > 0
+    assert conversation(client, done["session_id"]) == [
+        ("user", "Can I bring a surfboard?"), ("assistant", FAKE_REPLY)]
+
+def test_stream_continues_a_session(client):
+    first = stream_events(client, message="I'm flying to Lisbon.")[-1]
+    second = stream_events(client, message="Can I bring a surfboard?", session_id=first["session_id"])[-1]
+
+    assert second["type"] == "done"
+    assert second["session_id"] == first["session_id"]
+    assert [role for role, _ in conversation(client, first["session_id"])] == [
+        "user", "assistant", "user", "assistant"]
+
+def test_stream_upstream_error_ends_with_an_error_event(client, fake):
+    requests = fake.requests
+    fake.failure_rate = 1.0
+    events = stream_events(client, message="Will this fail?")
+
+    assert fake.requests - requests > 1, "5xx responses are retried"
+    assert [event["type"] for event in events] == ["error"]
+    assert "detail" in events[0]
+
+def test_stream_error_saves_no_reply(client, fake, user_id):
+    fake.failure_rate = 1.0
+    stream_events(client, message="Will this fail?")
+    fake.failure_rate = 0.0
+
+    # The user's message is kept, no assistant reply is saved
+    sessions = client.get(f"/sessions/{user_id}").json()["sessions"]
+    assert len(sessions) == 1
+    assert conversation(client, sessions[0]["id"]) == [("user", "Will this fail?")]
@@ -0,0 +1,32 @@
+"""Identical concurrent requests sharing one upstream call."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+def test_coalesced_followers_report_the_calls_tokens(client, fake):
+    fake.latency_ms = 300
+    requests = fake.requests
+
+    with ThreadPoolExecutor(3) as pool:
+        replies = list(pool.map(lambda _: client.post("/chat", json={"message": "Is there wifi on board?"}).json(),
+                                range(3)))
+
+    assert fake.requests - requests == 1
+    tokens = [reply["tokens_used"] for reply in replies]
+    assert tokens[0] > 0 and len(set(tokens)) == 1
+
+def test_stream_is_cancelled_when_every_subscriber_leaves(client, fake):
+    # The whole reply would take a couple of seconds to arrive
+    fake.token_interval_ms = 100
+    with client.stream("POST", "/chat/stream", json={"message": "Which lounges can I use?"}) as response:
+        for line in response.iter_lines():
+            if line.startswith("data: "):
+                break
+
+    deadline = time.monotonic() + 1
+    while main.llm_flights.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert main.llm_flights.stats()["in_flight"] == 0
+    assert main.upstream_scheduler.in_flight == 0
@@ -0,0 +1,41 @@
+"""GET /conversation/{session_id}: messages in seq order, paged with before/after."""
+
+import httpx
+
+from fakes import make_token
+
+def page(client, session_id: str, **params) -> tuple:
+    response = client.get(f"/conversation/{session_id}", params=params)
+    assert response.status_code == 200
+    body = response.json()
+    return [(msg["seq"], msg["content"]) for msg in body["conversation"]], body["has_more"]
+
+def test_pages_back_and_forth_in_seq_order(client):
+    session_id = client.post("/chat", json={"message": "Question 0"}).json()["session_id"]
+    for i in (1, 2):
+        client.post("/chat", json={"message": f"Question {i}", "session_id": session_id})
+    everything, has_more = page(client, session_id)
+    seqs = [seq for seq, _ in everything]
+    assert not has_more
+    assert len(everything) == 6
+    assert seqs == sorted(set(seqs))
+    assert [content for _, content in everything[::2]] == ["Question 0", "Question 1", "Question 2"]
+
+    newest, has_more = page(client, session_id, limit=4)
+    assert newest == everything[2:] and has_more
+
+    older, has_more = page(client, session_id, limit=4, before=newest[0][0])
+    assert older == everything[:2] and not has_more
+
+    forward, has_more = page(client, session_id, limit=2, after=everything[1][0])
+    assert forward == everything[2:4] and has_more
+
+    last, has_more = page(client, session_id, limit=2, after=everything[3][0])
+    assert last == everything[4:] and not has_more
+
+def test_other_users_conversations_are_not_found(client, server):
+    session_id = client.post("/chat", json={"message": "Hello"}).json()["session_id"]
+    response = httpx.get(f"{server.url}/conversation/{session_id}",
+                         headers={"Authorization": f"Bearer {make_token()}"})
+
+    assert response.status_code == 404
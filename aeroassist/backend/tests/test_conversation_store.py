@@ -0,0 +1,72 @@
+"""The conversation cache backends."""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+import pytest
+
+import main
+
+def test_incomplete_store_fails_at_construction():
+    class NoDelete(main.ConversationStore):
+        async def get(self, session_id):
+            return None
+
+        async def set(self, session_id, messages):
+            pass
+
+        async def append(self, session_id, messages):
+            pass
+
+    with pytest.raises(TypeError):
+        NoDelete(10)
+
+def test_in_memory_store_keeps_the_window():
+    store = main.InMemoryConversationStore(window=3, max_sessions=10, max_bytes=1 << 20, ttl_seconds=60)
+    messages = [{"seq": i, "role": "user", "content": f"message {i}"} for i in range(5)]
+
+    async def run():
+        assert await store.get("s") is None
+        await store.set("s", messages[:2])
+        await store.append("s", messages[2:])
+        await store.append("other", messages)
+        return await store.get("s"), await store.get("other")
+
+    window, other = asyncio.run(run())
+    assert [m["seq"] for m in window] == [2, 3, 4]
+    assert other is None
+
+def test_in_memory_store_misses_when_the_message_count_moved():
+    store = main.InMemoryConversationStore(window=10, max_sessions=10, max_bytes=1 << 20, ttl_seconds=60)
+
+    async def run():
+        await store.set("s", [{"seq": 1, "role": "user", "content": "hi"}], total=1)
+        await store.append("s", [{"seq": 2, "role": "assistant", "content": "hello"}])
+        current = await store.get("s", total=2)
+        behind = await store.get("s", total=4)
+        return current, behind
+
+    current, behind = asyncio.run(run())
+    assert len(current) == 2
+    assert behind is None
+    assert store.stats()["stale"] == 1
+
+def test_turns_saved_by_another_worker_reach_the_prompt(client, fake, user_id):
+    session_id = client.post("/chat", json={"message": "I'm flying to Lisbon."}).json()["session_id"]
+
+    # Another worker, with its own cache, saves a turn of this session
+    database = os.environ["DATABASE_URL"].removeprefix("sqlite:///")
+    with sqlite3.connect(database) as db:
+        seq = int(time.time() * 1_000_000)
+        for offset, (role, content) in enumerate((("user", "Sent through another worker"), ("assistant", "Noted."))):
+            db.execute("INSERT INTO chat_messages (id, session_id, user_id, role, content, tokens_used, seq) "
+                       "VALUES (?, ?, ?, ?, ?, 0, ?)", (f"{session_id}-{offset}", session_id, user_id, role,
+                                                        content, seq + offset))
+        db.execute("UPDATE chat_sessions SET message_count = message_count + 2 WHERE id = ?", (session_id,))
+
+    client.post("/chat", json={"message": "Can I bring a surfboard?", "session_id": session_id})
+
+    assert "Sent through another worker" in json.dumps(fake.bodies[-1])
@@ -0,0 +1,42 @@
+"""GET /export/{user_id}: the NDJSON history export."""
+
+import gzip
+import json
+
+def records(body: bytes) -> list:
+    return [json.loads(line) for line in body.decode().splitlines()]
+
+def test_export_has_every_session_and_message_then_the_totals(client, user_id):
+    first = client.post("/chat", json={"message": "Can I bring a guitar?"}).json()["session_id"]
+    client.post("/chat", json={"message": "And a cello?", "session_id": first})
+    second = client.post("/chat", json={"message": "Is there wifi?"}).json()["session_id"]
+
+    response = client.get(f"/export/{user_id}")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = records(response.content)
+    sessions = [record for record in exported if record["type"] == "session"]
+    messages = [record for record in exported if record["type"] == "message"]
+    assert [session["id"] for session in sessions] == [second, first]
+    seqs = [message["seq"] for message in messages if message["session_id"] == first]
+    assert seqs == sorted(seqs)
+    assert len(messages) == 6
+    assert exported[-1] == {"type": "end", "user_id": user_id, "sessions": 2, "messages": 6}
+
+def test_compressed_export_is_the_same_records_gzipped(client, user_id):
+    client.post("/chat", json={"message": "Hello"})
+
+    plain = client.get(f"/export/{user_id}")
+    compressed = client.get(f"/export/{user_id}", params={"compress": "true"})
+
+    assert compressed.headers["content-type"] == "application/gzip"
+    assert records(gzip.decompress(compressed.content)) == records(plain.content)
+
+def test_export_of_a_user_without_history_is_just_the_end_record(client, user_id):
+    assert records(client.get(f"/export/{user_id}").content) == [
+        {"type": "end", "user_id": user_id, "sessions": 0, "messages": 0}
+    ]
+
+def test_other_users_history_is_refused(client):
+    assert client.get("/export/someone-else").status_code == 403
@@ -0,0 +1,21 @@
+"""Logging is set up by the app's lifespan, not by importing main."""
+
+import json
+import os
+import subprocess
+import sys
+
+import main
+
+def test_import_leaves_logging_and_threads_alone():
+    script = ("import logging, threading; import main; "
+              "print(json.dumps([threading.active_count(), len(logging.getLogger().handlers), logging.logThreads]))")
+    out = subprocess.run([sys.executable, "-c", "import json; " + script], cwd=os.path.dirname(main.__file__),
+                         capture_output=True, text=True, check=True).stdout
+
+    assert json.loads(out) == [1, 0, True]
+
+def test_lifespan_starts_the_log_listener(server):
+    # Root handlers are left to pytest here, as basicConfig leaves a configured host's
+    assert main._logging_configured
+    assert main.log_listener._thread is not None
@@ -0,0 +1,41 @@
+"""GET /metrics and the Server-Timing header."""
+
+import re
+
+import main
+
+def sample(client, name: str, **labels) -> float:
+    """One sample's value from /metrics, 0 if it isn't there yet."""
+    body = client.get("/metrics").text
+    label_set = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf"^{re.escape(name)}{re.escape('{' + label_set + '}' if label_set else '')} (\S+)$", body, re.M)
+    return float(match.group(1)) if match else 0.0
+
+def test_metrics_is_prometheus_text(client):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE aeroassist_stage_duration_seconds histogram" in response.text
+    assert "# TYPE aeroassist_requests_total counter" in response.text
+
+def test_a_chat_turn_is_counted_by_route_and_stage(client):
+    requests = sample(client, "aeroassist_requests_total", route="/chat", status="200")
+    llm = sample(client, "aeroassist_stage_duration_seconds_count", stage="llm")
+    tokens = sample(client, "aeroassist_upstream_tokens_total", kind="output")
+
+    client.post("/chat", json={"message": "What is my baggage allowance?"})
+
+    assert sample(client, "aeroassist_requests_total", route="/chat", status="200") == requests + 1
+    assert sample(client, "aeroassist_stage_duration_seconds_count", stage="llm") == llm + 1
+    assert sample(client, "aeroassist_upstream_tokens_total", kind="output") > tokens
+
+def test_server_timing_lists_the_stages_when_enabled(client, monkeypatch):
+    assert "server-timing" not in client.post("/chat", json={"message": "Hello"}).headers
+
+    monkeypatch.setattr(main, "SERVER_TIMING_ENABLED", True)
+    header = client.post("/chat", json={"message": "Hello again"}).headers["server-timing"]
+
+    stages = dict(entry.split(";dur=") for entry in header.split(", "))
+    assert {"auth", "session", "llm"} <= set(stages)
+    assert all(float(duration) >= 0 for duration in stages.values())
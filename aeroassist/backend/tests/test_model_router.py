@@ -0,0 +1,21 @@
+"""Route timeouts and latency samples in the model router."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+def test_route_timeout_does_not_count_the_wait_for_a_slot(client, fake, monkeypatch):
+    route = main.model_router.routes[0]
+    monkeypatch.setattr(route, "timeout", 0.5)
+    monkeypatch.setattr(route, "_latencies", {})
+    # One call at a time, so the last of three waits twice the fake's latency for its slot
+    main.upstream_scheduler = main.UpstreamScheduler(1, 0, 0, 30, 10000, 3, 0.01, 0.05)
+    fake.latency_ms = 300
+
+    with ThreadPoolExecutor(3) as pool:
+        responses = list(pool.map(lambda i: client.post("/chat", json={"message": f"Question {i}"}), range(3)))
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    samples = route._latencies["response"]
+    assert len(samples) == 3
+    assert max(samples) < 0.5
@@ -0,0 +1,77 @@
+"""The policy retrieval index: building, searching, reloading, and use in chat turns."""
+
+import asyncio
+import os
+
+import main
+
+BAGGAGE = """# Checked baggage
+
+Economy fares include one checked bag up to 23 kg. Overweight bags cost extra at the airport.
+
+# Musical instruments
+
+Small instruments such as violins travel in the cabin. A cello needs its own seat, booked as an extra seat.
+"""
+
+PETS = """Pets
+
+Cats and dogs under 8 kg travel in the cabin in a carrier. Larger pets travel in the hold.
+"""
+
+def build(tmp_path, documents: dict, name: str = "policy.idx"):
+    source = tmp_path / "policies"
+    source.mkdir(exist_ok=True)
+    for filename, text in documents.items():
+        (source / filename).write_text(text)
+    output = tmp_path / name
+    return main.build_policy_index(str(source), str(output), chunk_words=40), str(output)
+
+def test_the_best_chunk_for_a_question_comes_first(tmp_path):
+    stats, path = build(tmp_path, {"baggage.md": BAGGAGE, "pets.txt": PETS, "notes.pdf": "not indexed"})
+
+    index = main.PolicyIndex(path)
+    hits = index.search("Can my cello come on board?", k=2)
+
+    assert stats["chunks"] == index.chunk_count == 3
+    assert hits[0]["source"] == "baggage.md"
+    assert hits[0]["heading"] == "Musical instruments"
+    assert "own seat" in hits[0]["text"]
+    assert all(hit["score"] > 0 for hit in hits)
+    assert index.search("How heavy can a dog be?", k=1)[0]["source"] == "pets.txt"
+    assert index.search("zeppelin", k=3) == []
+
+def test_a_rebuilt_index_is_swapped_in_and_a_bad_file_keeps_the_old_one(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "policy_index", None)
+    _, path = build(tmp_path, {"baggage.md": BAGGAGE})
+
+    assert asyncio.run(main.reload_policy_index(path)) is True
+    # Unchanged files aren't mapped again
+    assert asyncio.run(main.reload_policy_index(path)) is False
+    loaded = main.policy_index
+
+    # Swapped in whole, like the builder does; the old mapping keeps the replaced file alive
+    bad = tmp_path / "bad.idx"
+    bad.write_bytes(b"not a policy index" * 16)
+    os.replace(bad, path)
+    assert asyncio.run(main.reload_policy_index(path)) is False
+    assert main.policy_index is loaded
+    assert main.policy_index.search("cello", k=1)[0]["heading"] == "Musical instruments"
+
+    build(tmp_path, {"baggage.md": BAGGAGE, "pets.txt": PETS})
+    assert asyncio.run(main.reload_policy_index(path)) is True
+    assert main.policy_index.chunk_count == 3
+
+def test_matching_excerpts_go_into_the_instructions(client, fake, tmp_path, monkeypatch):
+    _, path = build(tmp_path, {"baggage.md": BAGGAGE, "pets.txt": PETS})
+    monkeypatch.setattr(main, "policy_index", main.PolicyIndex(path))
+
+    client.post("/chat", json={"message": "Can my cat travel in the cabin with me?"})
+    with_pets = fake.bodies[-1]["instructions"]
+    client.post("/chat", json={"message": "What is the weather like in Lisbon?"})
+    without = fake.bodies[-1]["instructions"]
+
+    assert "[pets.txt]\nPets\n\nCats and dogs under 8 kg travel in the cabin in a carrier." in with_pets
+    # The instruments chunk shares "travel" and "cabin" but scores under POLICY_MIN_SCORE
+    assert "baggage.md" not in with_pets
+    assert "pets.txt" not in without
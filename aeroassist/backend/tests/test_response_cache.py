@@ -0,0 +1,36 @@
+"""The answer cache and DELETE /cache/responses, which is for admins only."""
+
+import time
+
+import httpx
+from jose import jwt
+
+from fakes import FAKE_JWT_SECRET
+
+import main
+
+def service_role_token() -> str:
+    now = int(time.time())
+    claims = {"sub": "ops", "role": "service_role", "aud": "authenticated", "iat": now, "exp": now + 3600}
+    return jwt.encode(claims, FAKE_JWT_SECRET, algorithm="HS256")
+
+def test_users_may_not_drop_cached_answers(client):
+    response = client.delete("/cache/responses", params={"question": "What is my baggage allowance?"})
+
+    assert response.status_code == 403
+
+def test_the_service_role_may_drop_cached_answers(server):
+    response = httpx.delete(f"{server.url}/cache/responses", params={"question": "What is my baggage allowance?"},
+                            headers={"Authorization": f"Bearer {service_role_token()}"})
+
+    assert response.status_code == 200
+
+def test_near_duplicates_only_match_the_same_users_questions():
+    cache = main.ResponseCache(100, 60, near_duplicates=True, similarity=0.5)
+    cache.set("what is the checked baggage allowance on flights to lisbon", "23 kg", owner="alice")
+
+    reworded = "what is the checked baggage allowance on my flights to lisbon"
+    assert cache.get(reworded, owner="bob") is None
+    assert cache.get(reworded, owner="alice") == "23 kg"
+    # The same question is answered from the cache whoever asks it
+    assert cache.get("What is the checked baggage allowance on flights to Lisbon?", owner="bob") == "23 kg"
@@ -0,0 +1,70 @@
+"""LLM_CHAIN_RESPONSES: continuing stored responses, and rebuilding the context when one is gone."""
+
+import json
+
+import pytest
+
+import main
+from fakes import FAKE_REPLY
+
+@pytest.fixture(autouse=True)
+def chained(monkeypatch):
+    monkeypatch.setattr(main, "LLM_CHAIN_RESPONSES", True)
+
+def rebuilt() -> int:
+    return int(main.response_chain_turns.value("rebuilt"))
+
+def ask(client, message: str, session_id: str = None) -> dict:
+    response = client.post("/chat", json={"message": message, **({"session_id": session_id} if session_id else {})})
+    assert response.status_code == 200
+    return response.json()
+
+def ask_streaming(client, message: str, session_id: str) -> tuple:
+    """The streamed reply and the final event."""
+    with client.stream("POST", "/chat/stream", json={"message": message, "session_id": session_id}) as response:
+        assert response.status_code == 200
+        events = [json.loads(line[len("data: "):]) for line in response.iter_lines() if line.startswith("data: ")]
+    return "".join(event["content"] for event in events if event["type"] == "delta"), events[-1]
+
+def test_a_follow_up_sends_only_the_new_message(client, fake):
+    session_id = ask(client, "I'm flying to Lisbon.")["session_id"]
+    first = fake.bodies[-1]
+
+    ask(client, "Can I bring a surfboard?", session_id)
+    follow_up = fake.bodies[-1]
+
+    assert "previous_response_id" not in first
+    assert follow_up["previous_response_id"]
+    assert len(follow_up["input"]) == 1
+
+def test_a_forgotten_chain_is_rebuilt_from_the_database(client, fake):
+    session_id = ask(client, "I'm flying to Lisbon.")["session_id"]
+    before = rebuilt()
+    fake.forget()
+
+    reply = ask(client, "Can I bring a surfboard?", session_id)
+    refused, resent = fake.bodies[-2:]
+
+    assert reply["reply"] == FAKE_REPLY
+    assert rebuilt() == before + 1
+    assert refused["previous_response_id"]
+    assert "previous_response_id" not in resent
+    assert [item["content"] for item in resent["input"]] == [
+        "I'm flying to Lisbon.", FAKE_REPLY, "Can I bring a surfboard?"]
+
+    # The rebuilt turn starts a new chain
+    ask(client, "And a bicycle?", session_id)
+    assert fake.bodies[-1]["previous_response_id"]
+    assert rebuilt() == before + 1
+
+def test_a_forgotten_chain_is_rebuilt_when_streaming(client, fake):
+    session_id = ask(client, "I'm flying to Lisbon.")["session_id"]
+    before = rebuilt()
+    fake.forget()
+
+    reply, done = ask_streaming(client, "Can I bring a surfboard?", session_id)
+
+    assert done["type"] == "done"
+    assert reply == FAKE_REPLY
+    assert rebuilt() == before + 1
+    assert "previous_response_id" not in fake.bodies[-1]
@@ -0,0 +1,42 @@
+"""The upstream scheduler: admission control and retrying throttled calls."""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+def ask_together(client, count: int) -> list:
+    with ThreadPoolExecutor(count) as pool:
+        return list(pool.map(lambda i: client.post("/chat", json={"message": f"Question {i}"}), range(count)))
+
+def test_a_call_that_cant_get_a_slot_in_time_is_a_503_with_retry_after(client, fake):
+    # One call at a time, and no more than 0.2s waiting for it
+    main.upstream_scheduler = main.UpstreamScheduler(1, 0, 0, 0.2, 10000, 3, 0.01, 0.05)
+    fake.latency_ms = 800
+
+    responses = ask_together(client, 2)
+
+    assert sorted(response.status_code for response in responses) == [200, 503]
+    busy = next(response for response in responses if response.status_code == 503)
+    assert int(busy.headers["Retry-After"]) == math.ceil(0.2)
+
+def test_a_full_queue_is_a_503(client, fake):
+    # One call in flight and one waiting; a third has no room
+    main.upstream_scheduler = main.UpstreamScheduler(1, 0, 0, 30, 1, 3, 0.01, 0.05)
+    fake.latency_ms = 500
+
+    responses = ask_together(client, 3)
+
+    assert sorted(response.status_code for response in responses) == [200, 200, 503]
+
+def test_a_429_is_retried_after_its_retry_after(client, fake, monkeypatch):
+    main.upstream_scheduler = main.UpstreamScheduler(64, 0, 0, 30, 10000, 10, 0.01, 0.05)
+    monkeypatch.setattr(fake, "max_concurrency", 1)
+    monkeypatch.setattr(fake, "retry_after", 0.1)
+    fake.latency_ms = 200
+    throttled = fake.throttled
+
+    responses = ask_together(client, 3)
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert fake.throttled > throttled
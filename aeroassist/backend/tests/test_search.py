@@ -0,0 +1,58 @@
+"""GET /search on SQLite FTS5: ranking, keyset pages and user scoping."""
+
+import httpx
+
+from fakes import make_token
+
+def search(client, q: str, **params) -> dict:
+    response = client.get("/search", params={"q": q, **params})
+    assert response.status_code == 200
+    return response.json()
+
+def test_the_closest_match_ranks_first_with_a_marked_snippet(client):
+    client.post("/chat", json={"message": "My ukulele case has stickers from every trip I have taken so far"})
+    best = client.post("/chat", json={"message": "Ukulele ukulele?"}).json()["session_id"]
+
+    results = search(client, "ukulele")["results"]
+
+    assert len(results) == 2
+    assert results[0]["session_id"] == best
+    assert results[0]["score"] > results[1]["score"]
+    assert results[0]["role"] == "user"
+    assert "**Ukulele**" in results[0]["snippet"]
+
+def test_every_word_must_match_and_prefixes_need_a_star(client):
+    client.post("/chat", json={"message": "Is a harmonica allowed in cabin bags?"})
+
+    assert len(search(client, "harmonica allowed")["results"]) == 1
+    assert search(client, "harmonica trombone")["results"] == []
+    assert search(client, "harmon")["results"] == []
+    assert len(search(client, "harmon*")["results"]) == 1
+
+def test_cursor_walks_every_match_once_in_rank_order(client):
+    for i in range(5):
+        client.post("/chat", json={"message": f"Question {i} about my bassoon" + " and more" * i})
+
+    pages, cursor = [], None
+    while True:
+        body = search(client, "bassoon", limit=2, **({"cursor": cursor} if cursor else {}))
+        pages.append(body["results"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    hits = [hit for page in pages for hit in page]
+    assert len({(hit["session_id"], hit["seq"]) for hit in hits}) == 5
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+    assert search(client, "bassoon", limit=5)["results"] == hits
+
+def test_bad_cursor_is_a_400(client):
+    assert client.get("/search", params={"q": "anything", "cursor": "not-a-cursor"}).status_code == 400
+
+def test_other_users_messages_are_not_found(client, server):
+    client.post("/chat", json={"message": "Where do I pick up my didgeridoo?"})
+
+    with httpx.Client(base_url=server.url, headers={"Authorization": f"Bearer {make_token()}"}) as other:
+        assert other.get("/search", params={"q": "didgeridoo"}).json()["results"] == []
+    assert len(search(client, "didgeridoo")["results"]) == 1
@@ -0,0 +1,36 @@
+"""GET /sessions/{user_id}: keyset pages, newest activity first."""
+
+def pages(client, user_id: str, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/sessions/{user_id}", params=params)
+        assert response.status_code == 200
+        body = response.json()
+        pages.append(body["sessions"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+def test_cursor_walks_every_session_once_newest_first(client, user_id):
+    created = [client.post("/chat", json={"message": f"Question {i}"}).json()["session_id"] for i in range(5)]
+    # Activity on the oldest session moves it to the front
+    client.post("/chat", json={"message": "One more thing", "session_id": created[0]})
+
+    walked = pages(client, user_id, limit=2)
+
+    assert [len(page) for page in walked] == [2, 2, 1]
+    sessions = [session for page in walked for session in page]
+    assert [session["id"] for session in sessions] == [created[0]] + created[:0:-1]
+    assert [session["message_count"] for session in sessions] == [4, 2, 2, 2, 2]
+
+def test_a_page_that_fits_has_no_cursor(client, user_id):
+    client.post("/chat", json={"message": "Hello"})
+
+    assert [len(page) for page in pages(client, user_id, limit=50)] == [1]
+
+def test_bad_cursor_is_a_400(client, user_id):
+    assert client.get(f"/sessions/{user_id}", params={"cursor": "not-a-cursor"}).status_code == 400
+
+def test_other_users_sessions_are_refused(client):
+    assert client.get("/sessions/someone-else").status_code == 403
@@ -0,0 +1,14 @@
+"""Token counting falls back to the character estimate without tiktoken."""
+
+import sys
+
+import main
+
+def test_estimate_without_tiktoken(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    monkeypatch.setattr(main, "_token_encoding", None)
+
+    main.load_token_encoding()
+
+    assert main._token_encoding is None
+    assert main.estimate_tokens("x" * 40) == 11
@@ -0,0 +1,81 @@
+"""Per-user quotas and the /usage rollups."""
+
+import asyncio
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import main
+from fakes import make_token
+
+def test_requests_over_the_per_minute_quota_are_a_429(client, monkeypatch):
+    monkeypatch.setattr(main.usage_ledger, "requests_per_minute", 2)
+
+    responses = [client.post("/chat", json={"message": f"Question {i}"}) for i in range(3)]
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert int(responses[2].headers["Retry-After"]) >= 1
+    assert "requests_per_minute" in responses[2].json()["detail"]
+
+def test_tokens_over_the_daily_quota_are_a_429(client, monkeypatch):
+    monkeypatch.setattr(main.usage_ledger, "tokens_per_day", 1)
+
+    first = client.post("/chat", json={"message": "Can I bring a guitar on board?"})
+    second = client.post("/chat", json={"message": "What about a cello?"})
+
+    assert first.status_code == 200
+    assert first.json()["tokens_used"] > 1
+    assert second.status_code == 429
+    assert "tokens_per_day" in second.json()["detail"]
+
+def test_usage_sums_the_turns_per_hour_and_day(client, user_id):
+    replies = [client.post("/chat", json={"message": f"Question {i}"}).json() for i in range(3)]
+    tokens = sum(reply["tokens_used"] for reply in replies)
+
+    for granularity in ("hour", "day"):
+        usage = client.get(f"/usage/{user_id}", params={"granularity": granularity}).json()
+
+        assert usage["granularity"] == granularity
+        assert usage["total_requests"] == 3
+        assert usage["total_tokens"] == tokens
+        assert len(usage["buckets"]) == 1
+        assert usage["buckets"][0]["requests"] == 3
+
+def test_flushed_usage_is_read_back_and_seeds_quotas_after_a_restart(tmp_path):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'usage.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(main.Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        try:
+            ledger = main.UsageLedger(session_factory, 3600, 0, 100, 1000)
+            await ledger.check_quota("u")
+            for tokens in (30, 50):
+                ledger.record("u", None, tokens)
+            await ledger.flush()
+            pending, buckets = ledger.pending_rows(), await ledger.usage("u", "day", time.time())
+
+            # A new process starts counting today's tokens from the rollup
+            restarted = main.UsageLedger(session_factory, 3600, 0, 100, 1000)
+            await restarted.check_quota("u")
+            restarted.record("u", None, 30)
+            try:
+                await restarted.check_quota("u")
+            except main.QuotaExceeded as e:
+                return pending, buckets, e.quota
+            return pending, buckets, None
+        finally:
+            await engine.dispose()
+
+    pending, buckets, refused = asyncio.run(run())
+
+    assert pending == 0
+    assert [(bucket["tokens"], bucket["requests"]) for bucket in buckets] == [(80, 2)]
+    assert refused == "tokens_per_day"
+
+def test_usage_of_another_user_is_refused(client, server, user_id):
+    client.post("/chat", json={"message": "Hello"})
+
+    with httpx.Client(base_url=server.url, headers={"Authorization": f"Bearer {make_token()}"}) as other:
+        assert other.get(f"/usage/{user_id}").status_code == 403
@@ -0,0 +1,105 @@
+"""/ws/chat: authentication, turns, cancelling a turn, and the per-user connection limit."""
+
+import json
+import time
+
+import pytest
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+
+import main
+from fakes import FAKE_REPLY, make_token
+
+def open_chat(server, token: str = None, **params):
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    headers = {"Authorization": f"Bearer {token}"} if token else None
+    return connect(f"ws{server.url[4:]}/ws/chat" + (f"?{query}" if query else ""), additional_headers=headers,
+                   open_timeout=10)
+
+def receive(ws) -> dict:
+    return json.loads(ws.recv(timeout=10))
+
+def turn(ws, content: str) -> tuple:
+    """Send a message; the streamed reply and the frame that ended it."""
+    ws.send(json.dumps({"type": "message", "content": content}))
+    deltas = []
+    while (frame := receive(ws))["type"] == "delta":
+        deltas.append(frame["content"])
+    return "".join(deltas), frame
+
+def close_code(ws) -> int:
+    with pytest.raises(ConnectionClosed) as closed:
+        receive(ws)
+    return closed.value.rcvd.code
+
+def test_turns_stream_over_one_connection(server, client, user_id):
+    with open_chat(server, make_token(user_id=user_id)) as ws:
+        ready = receive(ws)
+        first, done = turn(ws, "I'm flying to Lisbon.")
+        second, _ = turn(ws, "Can I bring a surfboard?")
+
+    assert ready == {"type": "ready", "session_id": ready["session_id"], "messages": 0}
+    assert first == second == FAKE_REPLY
+    assert done["type"] == "done"
+    assert done["session_id"] == ready["session_id"]
+    assert done["tokens_used"] > 0
+    assert len(client.get(f"/conversation/{ready['session_id']}").json()["conversation"]) == 4
+
+def test_the_token_can_come_in_the_first_frame(server, user_id):
+    with open_chat(server) as ws:
+        ws.send(json.dumps({"type": "auth", "token": make_token(user_id=user_id)}))
+        assert receive(ws)["type"] == "ready"
+
+def test_a_bad_or_missing_token_closes_the_connection(server, user_id):
+    with open_chat(server, make_token(user_id=user_id, secret="not-the-secret")) as ws:
+        assert close_code(ws) == main.WS_CLOSE_UNAUTHORIZED
+    with open_chat(server) as ws:
+        ws.send(json.dumps({"type": "message", "content": "Hello"}))
+        assert close_code(ws) == main.WS_CLOSE_UNAUTHORIZED
+
+def test_another_users_session_is_not_opened(server, client):
+    session_id = client.post("/chat", json={"message": "Hello"}).json()["session_id"]
+
+    with open_chat(server, make_token(), session_id=session_id) as ws:
+        ready = receive(ws)
+
+    assert ready["session_id"] != session_id
+    assert ready["messages"] == 0
+
+def test_cancel_stops_the_reply_and_keeps_the_connection(server, client, fake, user_id):
+    fake.token_interval_ms = 100
+
+    with open_chat(server, make_token(user_id=user_id)) as ws:
+        session_id = receive(ws)["session_id"]
+        ws.send(json.dumps({"type": "message", "content": "Tell me everything about baggage."}))
+        assert receive(ws)["type"] == "delta"
+        ws.send(json.dumps({"type": "cancel"}))
+        while (frame := receive(ws))["type"] == "delta":
+            pass
+        fake.token_interval_ms = 0
+        reply, done = turn(ws, "Just the allowance, please.")
+
+    assert frame == {"type": "cancelled"}
+    assert reply == FAKE_REPLY
+    assert done["type"] == "done"
+    # The cancelled turn's partial reply isn't saved
+    conversation = client.get(f"/conversation/{session_id}").json()["conversation"]
+    assert [msg["role"] for msg in conversation] == ["user", "user", "assistant"]
+
+def test_a_user_over_the_connection_limit_is_turned_away(server, user_id, monkeypatch):
+    monkeypatch.setattr(main.chat_connections, "max_per_user", 2)
+    token = make_token(user_id=user_id)
+
+    with open_chat(server, token) as first, open_chat(server, token) as second:
+        assert receive(first)["type"] == receive(second)["type"] == "ready"
+        with open_chat(server, token) as third:
+            assert close_code(third) == 1013
+        with open_chat(server, make_token()) as other_user:
+            assert receive(other_user)["type"] == "ready"
+
+    # Closed connections stop counting once the server has seen them go
+    deadline = time.monotonic() + 5
+    while len(main.chat_connections) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with open_chat(server, token) as again:
+        assert receive(again)["type"] == "ready"
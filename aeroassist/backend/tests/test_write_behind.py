@@ -0,0 +1,131 @@
+"""WriteBehindWriter against its own SQLite database."""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import main
+
+def message(session_id: str, content: str, message_id: str = None) -> dict:
+    return {"kind": "message", "id": message_id or str(uuid.uuid4()), "session_id": session_id, "user_id": "u",
+            "role": "user", "content": content, "timestamp": datetime.now(), "tokens_used": 0,
+            "seq": main.next_message_seq()}
+
+def run_writer(tmp_path, body, **options):
+    """Run body(writer, session_factory) against a fresh database; returns its result."""
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'writes.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(main.Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        writer = main.WriteBehindWriter(session_factory, 10, 100, 1000, **options)
+        await writer.start()
+        try:
+            return await body(writer, session_factory)
+        finally:
+            await writer.stop()
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+async def count_messages(session_factory, session_id: str) -> int:
+    async with session_factory() as db:
+        return (await db.execute(select(func.count()).select_from(main.ChatMessage.__table__)
+                                 .where(main.ChatMessage.session_id == session_id))).scalar_one()
+
+def test_a_refused_row_is_set_aside_and_the_rest_written(tmp_path):
+    reject_path = tmp_path / "rejected.ndjson"
+    session_id = str(uuid.uuid4())
+
+    async def body(writer, session_factory):
+        now = datetime.now()
+        await writer.add({"kind": "session", "session_id": session_id, "user_id": "u", "created_at": now,
+                          "updated_at": now})
+        await writer.add(message(session_id, "first", message_id="duplicate"))
+        await writer.sync(session_id=session_id)
+        # The second batch has a good row and one whose primary key is taken
+        await writer.add(message(session_id, "second"))
+        await writer.add(message(session_id, "poison", message_id="duplicate"))
+        await asyncio.wait_for(writer.sync(session_id=session_id), timeout=10)
+        await writer.add(message(session_id, "third"))
+        await asyncio.wait_for(writer.sync(session_id=session_id), timeout=10)
+        return writer.rejected, await count_messages(session_factory, session_id)
+
+    rejected, stored = run_writer(tmp_path, body, max_retries=1, reject_path=str(reject_path))
+
+    assert rejected == 1
+    assert stored == 3
+    lines = reject_path.read_text().splitlines()
+    assert [json.loads(line)["content"] for line in lines] == ["poison"]
+
+def test_stop_during_a_flush_loses_nothing(tmp_path):
+    session_id = str(uuid.uuid4())
+    writing = asyncio.Event()
+
+    async def body(writer, session_factory):
+        write = writer._write
+
+        async def slow_write(batch, replay=False):
+            writing.set()
+            await asyncio.sleep(0.2)
+            await write(batch, replay)
+
+        writer._write = slow_write
+        now = datetime.now()
+        await writer.add({"kind": "session", "session_id": session_id, "user_id": "u", "created_at": now,
+                          "updated_at": now})
+        for i in range(20):
+            await writer.add(message(session_id, f"message {i}"))
+        # Stop while the background task is in the middle of writing its batch
+        await writing.wait()
+        await writer.stop()
+        return await count_messages(session_factory, session_id)
+
+    assert run_writer(tmp_path, body) == 20
+
+def test_spill_file_holds_queued_records_until_written(tmp_path):
+    spill_path = tmp_path / "spill.ndjson"
+    session_id = str(uuid.uuid4())
+    release = asyncio.Event()
+
+    async def body(writer, session_factory):
+        write = writer._write
+
+        async def held_write(batch, replay=False):
+            await release.wait()
+            await write(batch, replay)
+
+        writer._write = held_write
+        now = datetime.now()
+        await writer.add({"kind": "session", "session_id": session_id, "user_id": "u", "created_at": now,
+                          "updated_at": now})
+        for i in range(5):
+            await writer.add(message(session_id, f"message {i}"))
+        await asyncio.sleep(0.1)
+        spilled = len(spill_path.read_text().splitlines())
+        release.set()
+        await writer.sync(session_id=session_id)
+        return spilled, spill_path.read_text(), await count_messages(session_factory, session_id)
+
+    spilled, left, stored = run_writer(tmp_path, body, spill_path=str(spill_path))
+
+    assert spilled == 6
+    assert left == ""
+    assert stored == 5
+
+def test_spill_file_is_replayed_at_start(tmp_path):
+    spill_path = tmp_path / "spill.ndjson"
+    session_id = str(uuid.uuid4())
+    now = datetime.now()
+    records = [{"kind": "session", "session_id": session_id, "user_id": "u", "created_at": now, "updated_at": now},
+               message(session_id, "left over from a crash")]
+    spill_path.write_text("".join(json.dumps(record, default=str) + "\n" for record in records))
+
+    async def body(writer, session_factory):
+        return await count_messages(session_factory, session_id)
+
+    assert run_writer(tmp_path, body, spill_path=str(spill_path)) == 1